@@ -9,12 +9,14 @@ import io
 from urllib.parse import urlparse
 from . import CoveoConstants
 from . import CoveoPermissions
+from . import CoveoTrace
 import json
 import re
 import logging
 import zlib
 import os.path
 import hashlib
+import time
 from datetime import datetime
 
 # ---------------------------------------------------------------------------------
@@ -102,9 +104,11 @@ class BatchDocument():
     class BatchDocument.
     Class to hold the Batch Document.
     """
-    AddOrUpdate = []
-    Delete = []
-    partialUpdate = []
+
+    def __init__(self):
+        self.AddOrUpdate = []
+        self.Delete = []
+        self.partialUpdate = []
 
     def toJson(self):
       data = {}
@@ -119,15 +123,56 @@ class BatchDocument():
 # ---------------------------------------------------------------------------------
 
 
+def EncodeJson(p_Json):
+    """
+    EncodeJson.
+    Encodes a JSON object (dict) into the bytes which are written into a batch.
+    Already encoded fragments (bytes) are returned as is.
+    """
+    if isinstance(p_Json, bytes):
+        return p_Json
+    return json.dumps(p_Json, default=str).encode('utf-8')
+
+
+def EncodeList(p_List: []):
+    """
+    EncodeList.
+    Encodes a list of JSON objects and/or encoded fragments into a JSON array (bytes).
+    """
+    return b'[' + b','.join([EncodeJson(item) for item in p_List]) + b']'
+
+
+def EncodeBatch(p_ToAdd: [], p_ToDelete: [], p_ToUpdate: []):
+    """
+    EncodeBatch.
+    Encodes the batch (same layout as BatchDocument.toJson) into bytes.
+    Items can be JSON objects (dict) or already encoded fragments (bytes).
+    """
+    parts = []
+    if len(p_ToAdd) > 0:
+        parts.append(b'"AddOrUpdate":' + EncodeList(p_ToAdd))
+    if len(p_ToDelete) > 0:
+        parts.append(b'"Delete":' + EncodeList(p_ToDelete))
+    if len(p_ToUpdate) > 0:
+        parts.append(b'"partialUpdate":' + EncodeList(p_ToUpdate))
+    return b'{' + b','.join(parts) + b'}'
+
+
+# Bytes of an encoded batch which are not in its documents, when each document is counted with one separator:
+# the encoded batch is at most the summed document sizes (len + 1) plus s_BatchOverhead
+s_BatchOverhead = len(EncodeBatch([b''], [b''], [b'']))
+
+# ---------------------------------------------------------------------------------
+
+
 class DocumentToDelete:
     """
     class DocumentToDelete.
     Class to hold the Document To Delete.
     It should consist of the DocumentId (URL) only."""
     # The unique document identifier for the source, must be the document URI.
-    DocumentId = ''
-    Title = ''
-    deleteChildren = False
+    # DocumentId, Title, deleteChildren
+    __slots__ = ('DocumentId', 'Title', 'deleteChildren')
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def __init__(self, p_DocumentId: str, p_deleteChildren:bool=False):
@@ -156,10 +201,8 @@ class DocumentToUpdate:
     Class to hold the Document To Partial Update.
     It should consist of the DocumentId (URL) only."""
     # The unique document identifier for the source, must be the document URI.
-    DocumentId = ''
-    Operator = ''
-    Field = ''
-    Value = ''
+    # DocumentId, Operator, Field, Value
+    __slots__ = ('DocumentId', 'Operator', 'Field', 'Value')
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def __init__(self, p_DocumentId: str, p_Operator: str, p_Field: str, p_Value):
@@ -189,21 +232,26 @@ class Document:
     class Document.
     Class to hold the Document To Push.
     Mandatory properties: DocumentId (URL) and Title."""
-    Data = ''
-    Date = ''
-    DocumentId = ''
-    permanentid = ''
-    Title = ''
-    ModifiedDate = ''
-    CompressedBinaryData = ''
-    CompressedBinaryDataFileId = ''
-    CompressionType = ''
-    FileExtension = ''
-    ParentId = ''
-    ClickableUri = ''
-    Author = ''
-    Permissions = []
-    MetaData = {}
+    # Slots instead of a __dict__, there can be a lot of documents in memory
+    __slots__ = (
+        'Data', 'Date', 'DocumentId', 'permanentid', 'Title', 'ModifiedDate',
+        'CompressedBinaryData', 'CompressedBinaryDataFileId', 'CompressionType',
+        'FileExtension', 'ParentId', 'ClickableUri', 'Author', 'Permissions', 'MetaData',
+        'PermissionModel'
+    )
+
+    # Attributes written by ToJson (when set)
+    s_JsonAttributes = (
+        'DocumentId', 'permanentid', 'Title', 'ClickableUri',
+        'Data', 'CompressedBinaryData', 'CompressedBinaryDataFileId', 'CompressionType',
+        'Date', 'ModifiedDate',
+        'FileExtension',
+        'ParentId',
+        'Author', 'Permissions'
+    )
+
+    # Shared by all documents
+    logger = logging.getLogger('CoveoDocument')
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def __init__(self, p_DocumentId: str):
@@ -214,6 +262,7 @@ class Document:
         self.DocumentId = p_DocumentId
         self.permanentid = generatePermanentId(p_DocumentId)
         self.Permissions = []
+        self.PermissionModel = None
         self.MetaData = {}
         self.Data = ''
         self.Date = ''
@@ -226,7 +275,6 @@ class Document:
         self.ParentId = ''
         self.ClickableUri = ''
         self.Author = ''
-        self.logger = logging.getLogger('CoveoDocument')
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def ToJson(self):
@@ -234,19 +282,15 @@ class Document:
         ToJson, returns JSON for push.
         Puts all metadata and other fields into a clean JSON object"""
         # Check if empty
-        attributes = [
-            'DocumentId', 'permanentid', 'Title', 'ClickableUri',
-            'Data', 'CompressedBinaryData', 'CompressedBinaryDataFileId', 'CompressionType',
-            'Date', 'ModifiedDate',
-            'FileExtension',
-            'ParentId',
-            'Author', 'Permissions'
-        ]
-
         all = dict()
-        for attr in attributes:
-            if self.__dict__[attr]:
-                all[attr] = self.__dict__[attr]
+        for attr in self.s_JsonAttributes:
+            value = getattr(self, attr)
+            if value:
+                all[attr] = value
+
+        # Shared permission model first, then the own permission levels
+        if self.PermissionModel is not None:
+            all['Permissions'] = self.PermissionModel.Levels + self.Permissions
 
         for meta in self.MetaData:
             all[meta] = self.MetaData[meta]
@@ -254,6 +298,18 @@ class Document:
         # print (alljson)
         return all
 
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def ToEncodedJson(self):
+        """
+        ToEncodedJson, returns the encoded JSON (bytes) for push.
+        A shared permission model (SetPermissionModel) is not encoded again, its cached JSON is used."""
+        if self.PermissionModel is None or self.Permissions:
+            return EncodeJson(self.ToJson())
+
+        all = self.ToJson()
+        del all['Permissions']
+        return EncodeJson(all)[:-1] + b',"Permissions":' + self.PermissionModel.Encoded + b'}'
+
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def SetData(self, p_Data: str):
         """
@@ -365,8 +421,13 @@ class Document:
         if (p_Content == ''):
             Error(self, "SetContentAndCompress: value not set")
 
+        tracer = CoveoTrace.ActiveTracer
+        if tracer is not None:
+            start = time.perf_counter()
         compresseddata = zlib.compress(p_Content.encode('utf8'), zlib.Z_BEST_COMPRESSION)
         encodeddata = base64.b64encode(compresseddata).decode('ascii')
+        if tracer is not None:
+            tracer.Complete('compress', 'document', start, None, {'bytes': len(compresseddata)})
 
         self.CompressedBinaryData = encodeddata
         self.CompressedBinaryDataFileId = ''
@@ -389,10 +450,15 @@ class Document:
         if not (os.path.isfile):
             Error(self, "GetFileAndCompress: file does not exists "+p_FilePath)
 
+        tracer = CoveoTrace.ActiveTracer
+        if tracer is not None:
+            start = time.perf_counter()
         with open(p_FilePath, mode='rb') as file:  # b is important -> binary
             fileContent = file.read()
             compresseddata = zlib.compress(fileContent, zlib.Z_BEST_COMPRESSION)
             encodeddata = base64.b64encode(compresseddata).decode('ascii')
+        if tracer is not None:
+            tracer.Complete('compress', 'document', start, None, {'bytes': len(compresseddata), 'file': p_FilePath})
 
         # Get the extension
         __, file_extension = os.path.splitext(p_FilePath)
@@ -427,7 +493,8 @@ class Document:
         :arg p_Value: object, the value or object to set (str or list)
         """
 
-        self.logger.debug(p_Key + ": " + str(p_Value).encode('utf-8', errors='replace').decode('ascii', "ignore"))
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('%s: %s', p_Key, str(p_Value).encode('utf-8', errors='replace').decode('ascii', "ignore"))
         # Check if empty
         if (p_Key == ''):
             Error(self, "AddMetadata: key not set")
@@ -469,3 +536,18 @@ class Document:
         simplePermissionLevel.AddPermissionSet(simplePermissionSet)
 
         self.Permissions.append(simplePermissionLevel)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def SetPermissionModel(self, p_PermissionModel: CoveoPermissions.PermissionModel):
+        """
+        SetPermissionModel.
+        Sets a shared permission model (see PermissionModelRegistry) on the document.
+        The model is referenced, not copied: its cached JSON is used when the document is pushed.
+        :arg p_PermissionModel: PermissionModel
+        """
+
+        # Check if correct
+        if not isinstance(p_PermissionModel, CoveoPermissions.PermissionModel):
+            Error(self, "SetPermissionModel: value is not of type PermissionModel")
+
+        self.PermissionModel = p_PermissionModel
@@ -0,0 +1,202 @@
+# -------------------------------------------------------------------------------------
+# CoveoDocumentFrame
+# -------------------------------------------------------------------------------------
+# Contains the DocumentFrame class
+#   Columnar container for a large number of (metadata only) documents
+#   Permanent ids, validation and encoding are done per column, not per Document
+# -------------------------------------------------------------------------------------
+import itertools
+import json
+import logging
+import math
+import re
+from json.encoder import encode_basestring_ascii
+from .CoveoConstants import Constants
+from .CoveoDocument import generatePermanentId
+from .CoveoPermissions import PermissionModel
+from .CoveoTemplates import EncodeString
+
+
+# ---------------------------------------------------------------------------------
+def Error(log, err):
+    log.logger.info(err)
+    raise Exception(err)
+
+
+def ColumnToList(p_Values):
+    """
+    ColumnToList.
+    Returns the column as a list of python values (NumPy arrays, tuples, generators, lists).
+    """
+    if hasattr(p_Values, 'tolist'):
+        return p_Values.tolist()
+    return list(p_Values)
+
+
+def EncodeColumn(p_Key: str, p_Values: []):
+    """
+    EncodeColumn.
+    Encodes a column as a list of ',"key":value' (bytes), b'' for empty values (None, '', NaN and infinities).
+    """
+    key = b',' + EncodeString(p_Key) + b':'
+    encoded = []
+    append = encoded.append
+    for value in p_Values:
+        valueType = type(value)
+        if valueType is str:
+            append(key + encode_basestring_ascii(value).encode('ascii') if value else b'')
+        elif valueType is int or (valueType is float and math.isfinite(value)):
+            append(key + repr(value).encode('ascii'))
+        elif value is None or valueType is float:
+            # NaN (missing value of a NumPy float column) and infinities are not JSON: empty
+            append(b'')
+        else:
+            append(key + json.dumps(value, default=str, allow_nan=False).encode('utf-8'))
+    return encoded
+
+# ---------------------------------------------------------------------------------
+
+
+class DocumentFrame:
+    """
+    class DocumentFrame.
+    Holds documents as columns (DocumentId, Title and metadata), as lists or NumPy arrays.
+    No Document is created: permanent ids, validation and encoding are done on whole columns.
+    Meant for metadata only pushes (for example catalogs).
+
+        frame = DocumentFrame(ids, p_Titles=titles)
+        frame.AddMetadata('price', prices)
+        frame.AddMetadata('ec_category', categories)
+        push.Start(updateSourceStatus, deleteOlder)
+        frame.AddTo(push)
+        push.End(updateSourceStatus, deleteOlder)
+    """
+    # DocumentId must be an URL: scheme followed by a netloc or path
+    s_UrlPattern = re.compile(r'[A-Za-z][A-Za-z0-9+\-.]*:.')
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_DocumentIds, p_Titles=None, p_StaticMetadata: {} = None, p_Permissions=None, p_FileExtension: str = ''):
+        """
+        class DocumentFrame constructor.
+        :arg p_DocumentIds: column of DocumentIds (valid URLs)
+        :arg p_Titles: column of Titles (optional)
+        :arg p_StaticMetadata: dict, metadata name -> value (str or list), same for all documents
+        :arg p_Permissions: PermissionModel or list of DocumentPermissionLevel, same for all documents (optional)
+        :arg p_FileExtension: str, file extension, same for all documents (optional)
+        """
+        self.logger = logging.getLogger('CoveoDocumentFrame')
+        self.DocumentIds = ColumnToList(p_DocumentIds)
+        self.Titles = None
+        if p_Titles is not None:
+            self.Titles = self.__checkLength('Titles', ColumnToList(p_Titles))
+        # metadata name -> column
+        self.MetaData = {}
+        self.StaticMetaData = {}
+        for key, value in (p_StaticMetadata or {}).items():
+            self.__checkKey(key)
+            self.StaticMetaData[key.lower()] = value
+        self.Permissions = p_Permissions
+        self.FileExtension = p_FileExtension
+        self.permanentids = None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __len__(self):
+        return len(self.DocumentIds)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __checkLength(self, p_Name: str, p_Values: []):
+        if len(p_Values) != len(self.DocumentIds):
+            Error(self, "DocumentFrame: " + p_Name + " has " + str(len(p_Values)) + " values, expected " + str(len(self.DocumentIds)))
+        return p_Values
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __checkKey(self, p_Key: str):
+        if (p_Key == ''):
+            Error(self, "AddMetadata: key not set")
+        if (p_Key.lower() in [key.lower() for key in Constants.s_DocumentReservedKeys]):
+            Error(self, "AddMetadata: " + p_Key + " is a reserved field and cannot be set as metadata.")
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def AddMetadata(self, p_Key: str, p_Values):
+        """
+        AddMetadata.
+        Sets a metadata column. Empty values ('' or None) are not pushed.
+        :arg p_Key: str, the metadata name
+        :arg p_Values: column of values (str, numbers or lists), one for each document
+        """
+        self.__checkKey(p_Key)
+        self.MetaData[p_Key.lower()] = self.__checkLength(p_Key, ColumnToList(p_Values))
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def GetPermanentIds(self):
+        """
+        GetPermanentIds.
+        Returns the column of permanent ids (computed once).
+        """
+        if self.permanentids is None:
+            self.permanentids = list(map(generatePermanentId, self.DocumentIds))
+        return self.permanentids
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Validate(self):
+        """
+        Validate.
+        Validates all DocumentIds (not empty, valid URL format).
+        Returns True/False, Error
+        """
+        match = self.s_UrlPattern.match
+        invalid = [documentId for documentId in self.DocumentIds if not (type(documentId) is str and match(documentId))]
+        if invalid:
+            shown = [str(documentId) for documentId in invalid[:10]]
+            return False, str(len(invalid)) + ' DocumentIds are empty or not a valid URL format: ' + ', '.join(shown)
+        return True, ''
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Encode(self):
+        """
+        Encode.
+        Validates and encodes all documents, column by column.
+        returns: list of encoded documents (bytes), to use with Push.AddEncoded
+        """
+        valid, error = self.Validate()
+        if not valid:
+            Error(self, "DocumentFrame: " + error)
+
+        heads = [b'{"DocumentId":' + EncodeString(documentId) + b',"permanentid":"' + permanentId.encode('ascii') + b'"'
+                 for documentId, permanentId in zip(self.DocumentIds, self.GetPermanentIds())]
+
+        columns = []
+        if self.Titles is not None:
+            columns.append(EncodeColumn('Title', self.Titles))
+        for key, values in self.MetaData.items():
+            columns.append(EncodeColumn(key, values))
+
+        tail = []
+        if self.FileExtension:
+            tail.append(b',"FileExtension":' + EncodeString(self.FileExtension))
+        if isinstance(self.Permissions, PermissionModel):
+            tail.append(b',"Permissions":' + self.Permissions.Encoded)
+        elif self.Permissions:
+            tail.append(b',"Permissions":' + json.dumps(self.Permissions, default=str).encode('utf-8'))
+        for key, value in self.StaticMetaData.items():
+            if not (value == '' or value is None or (type(value) is float and not math.isfinite(value))):
+                tail.append(b',' + EncodeString(key) + b':' + json.dumps(value, default=str, allow_nan=False).encode('utf-8'))
+        tail.append(b'}')
+
+        return list(map(b''.join, zip(heads, *columns, itertools.repeat(b''.join(tail)))))
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def AddTo(self, p_Push):
+        """
+        AddTo.
+        Adds all documents to the batch call of p_Push (Start must be called before).
+        :arg p_Push: CoveoPush.Push
+        returns: number of documents added
+        """
+        add = p_Push.AddEncoded
+        count = 0
+        for encoded in self.Encode():
+            add(encoded)
+            count += 1
+        self.logger.info('Added ' + str(count) + ' documents')
+        return count
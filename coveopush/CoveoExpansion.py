@@ -0,0 +1,508 @@
+# -------------------------------------------------------------------------------------
+# CoveoExpansion
+# -------------------------------------------------------------------------------------
+# Contains the ExpansionUploader class
+#   Uploads security expansion batches, for one or more security providers, in parallel
+# Contains the ExpansionBuilder class
+#   Builds the expansion batches of a security provider from adjacency data (group -> members)
+# -------------------------------------------------------------------------------------
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .CoveoConstants import Constants
+from .CoveoPermissions import BatchPermissions
+from .CoveoPermissions import PermissionIdentityBody
+from .CoveoPermissions import PermissionIdentityExpansion
+
+
+# ---------------------------------------------------------------------------------
+def Error(log, err):
+    log.logger.info(err)
+    raise Exception(err)
+
+# ---------------------------------------------------------------------------------
+
+
+class ExpansionSession:
+    """
+    class ExpansionSession.
+    Holds the current expansion batch of one security provider.
+    """
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_SecurityProviderId: str, p_StartOrderingId: int):
+        self.SecurityProviderId = p_SecurityProviderId
+        self.StartOrderingId = p_StartOrderingId
+        self.BatchPermissions = BatchPermissions()
+        self.Size = 0
+        self.Count = 0
+        self.Batches = 0
+        self.Futures = []
+
+# ---------------------------------------------------------------------------------
+
+
+class ExpansionUploader:
+    """
+    class ExpansionUploader.
+    Security expansion for one or more security providers at once.
+    Batches are pushed (container, S3 upload and permissions/batch call) on a pool of workers,
+    so several batches, of several providers, are uploaded in parallel.
+    RemovePermissionIdentity is added to the 'deleted' entries of the batch, instead of one DELETE call each.
+
+        uploader = ExpansionUploader(push, p_Workers=8)
+        uploader.Start('Provider1')
+        uploader.Start('Provider2')
+        uploader.AddExpansionMember('Provider1', group, members, [], [])
+        uploader.AddExpansionMapping('Provider2', user, [], mappings, [])
+        uploader.RemovePermissionIdentity('Provider1', olduser)
+        uploader.End(p_DeleteOlder=True)
+    """
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_Push, p_Workers: int = 4, p_MaxPending: int = 0):
+        """
+        ExpansionUploader Constructor.
+        :arg p_Push: CoveoPush.Push, used for the API calls and the max request size
+        :arg p_Workers: int, number of parallel uploads
+        :arg p_MaxPending: int, max number of batches waiting/uploading (def: 2 x p_Workers), bounds the memory used
+        """
+        self.Push = p_Push
+        self.Workers = p_Workers
+        self.MaxPending = p_MaxPending or 2 * p_Workers
+        self.Sessions = {}
+        self.pending = threading.BoundedSemaphore(self.MaxPending)
+        self.executor = ThreadPoolExecutor(max_workers=p_Workers, thread_name_prefix='CoveoExpansion')
+        self.logger = logging.getLogger('CoveoExpansion')
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Start(self, p_SecurityProviderId: str):
+        """
+        Start.
+        Starts the expansion batch for the security provider, sets its start ordering Id.
+        :arg p_SecurityProviderId: Security Provider to use
+        """
+        self.logger.debug('Start ' + p_SecurityProviderId)
+        if p_SecurityProviderId in self.Sessions:
+            Error(self, "Start: expansion already started for " + p_SecurityProviderId)
+        self.Sessions[p_SecurityProviderId] = ExpansionSession(p_SecurityProviderId, self.Push.CreateOrderingId())
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __getSession(self, p_SecurityProviderId: str):
+        session = self.Sessions.get(p_SecurityProviderId)
+        if session is None:
+            Error(self, "Expansion not started for " + p_SecurityProviderId + ", call Start first")
+        return session
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __upload(self, p_SecurityProviderId: str, p_BatchPermissions: BatchPermissions):
+        try:
+            self.Push.UploadPermissionsBatch(p_SecurityProviderId, p_BatchPermissions)
+        finally:
+            self.pending.release()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __flush(self, p_Session: ExpansionSession):
+        if p_Session.Count == 0:
+            return
+        # Wait when too many batches are pending
+        self.pending.acquire()
+        try:
+            future = self.executor.submit(self.__upload, p_Session.SecurityProviderId, p_Session.BatchPermissions)
+        except BaseException:
+            self.pending.release()
+            raise
+        p_Session.Futures.append(future)
+        p_Session.Batches += 1
+        p_Session.BatchPermissions = BatchPermissions()
+        p_Session.Size = 0
+        p_Session.Count = 0
+        # Report failed uploads as soon as possible
+        self.__checkFutures(p_Session, False)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __checkFutures(self, p_Session: ExpansionSession, p_Wait: bool):
+        remaining = []
+        for future in p_Session.Futures:
+            if p_Wait or future.done():
+                # Raises the exception of a failed upload
+                future.result()
+            else:
+                remaining.append(future)
+        p_Session.Futures = remaining
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def AddExpansion(self, p_SecurityProviderId: str, p_PermissionIdentityBody: PermissionIdentityBody, p_Attr: str):
+        """
+        AddExpansion.
+        Add a PermissionIdentityBody to the batch of the provider, if the buffer max is reached the batch is pushed
+        :arg p_SecurityProviderId: Security Provider to use
+        :arg p_PermissionIdentityBody: PermissionIdentityBody
+        :arg p_Attr: str, members, mappings or deleted
+        """
+        session = self.__getSession(p_SecurityProviderId)
+        maxSize = self.Push.GetSizeMaxRequest()
+        bodySize = len(json.dumps(p_PermissionIdentityBody, default=str)) + 1
+
+        if (bodySize > maxSize):
+            Error(self, "No permission identity can be larger than " + str(maxSize) + " bytes in size.")
+
+        if (session.Size + bodySize > maxSize - session.Count):
+            self.__flush(session)
+
+        if p_Attr == 'members':
+            session.BatchPermissions.AddMembers(p_PermissionIdentityBody)
+        elif p_Attr == 'mappings':
+            session.BatchPermissions.AddMappings(p_PermissionIdentityBody)
+        elif p_Attr == 'deleted':
+            session.BatchPermissions.AddDeletes(p_PermissionIdentityBody)
+        else:
+            Error(self, "AddExpansion: " + p_Attr + " must be members, mappings or deleted")
+        session.Size += bodySize
+        session.Count += 1
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __body(self, p_Identity: PermissionIdentityExpansion, p_Members: [], p_Mappings: [], p_WellKnowns: []):
+        permissionIdentityBody = PermissionIdentityBody(p_Identity)
+        permissionIdentityBody.AddMembers(p_Members)
+        permissionIdentityBody.AddMappings(p_Mappings)
+        permissionIdentityBody.AddWellKnowns(p_WellKnowns)
+        return permissionIdentityBody
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def AddExpansionMember(self, p_SecurityProviderId: str, p_Identity: PermissionIdentityExpansion, p_Members: [], p_Mappings: [], p_WellKnowns: []):
+        """
+        AddExpansionMember.
+        Same as Push.AddExpansionMember, for the security provider.
+        """
+        self.AddExpansion(p_SecurityProviderId, self.__body(p_Identity, p_Members, p_Mappings, p_WellKnowns), 'members')
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def AddExpansionMapping(self, p_SecurityProviderId: str, p_Identity: PermissionIdentityExpansion, p_Members: [], p_Mappings: [], p_WellKnowns: []):
+        """
+        AddExpansionMapping.
+        Same as Push.AddExpansionMapping, for the security provider.
+        """
+        self.AddExpansion(p_SecurityProviderId, self.__body(p_Identity, p_Members, p_Mappings, p_WellKnowns), 'mappings')
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def AddExpansionDeleted(self, p_SecurityProviderId: str, p_Identity: PermissionIdentityExpansion, p_Members: [], p_Mappings: [], p_WellKnowns: []):
+        """
+        AddExpansionDeleted.
+        Same as Push.AddExpansionDeleted, for the security provider.
+        """
+        self.AddExpansion(p_SecurityProviderId, self.__body(p_Identity, p_Members, p_Mappings, p_WellKnowns), 'deleted')
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def RemovePermissionIdentity(self, p_SecurityProviderId: str, p_PermissionIdentity: PermissionIdentityExpansion):
+        """
+        RemovePermissionIdentity.
+        Same as Push.RemovePermissionIdentity, but added to the 'deleted' entries of the batch instead of a DELETE call.
+        :arg p_SecurityProviderId: Security Provider to use
+        :arg p_PermissionIdentity: PermissionIdentityExpansion, permissionIdentity to remove
+        """
+        self.AddExpansion(p_SecurityProviderId, PermissionIdentityBody(p_PermissionIdentity), 'deleted')
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def End(self, p_SecurityProviderId: str = None, p_DeleteOlder: bool = False):
+        """
+        End.
+        Pushes the last batches and waits for all uploads of the provider(s).
+        Then, if p_DeleteOlder, the older permissions are deleted, once per provider.
+        :arg p_SecurityProviderId: Security Provider to end (def: all started providers)
+        :arg p_DeleteOlder: bool (False), if older permissions should be removed after the new push
+        """
+        if p_SecurityProviderId is None:
+            sessions = list(self.Sessions.values())
+        else:
+            sessions = [self.__getSession(p_SecurityProviderId)]
+
+        for session in sessions:
+            self.__flush(session)
+        try:
+            for session in sessions:
+                self.__checkFutures(session, True)
+        finally:
+            for session in sessions:
+                del self.Sessions[session.SecurityProviderId]
+
+        if p_DeleteOlder:
+            futures = [self.executor.submit(self.Push.DeletePermissionsOlderThan, session.SecurityProviderId, session.StartOrderingId)
+                       for session in sessions]
+            for future in futures:
+                future.result()
+
+        for session in sessions:
+            self.logger.info('Expansion ' + session.SecurityProviderId + ': ' + str(session.Batches) + ' batches pushed')
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Close(self):
+        """
+        Close.
+        Stops the workers (End must be called before, pending batches of started providers are not pushed).
+        """
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.Close()
+
+# ---------------------------------------------------------------------------------
+
+
+class ExpansionBuilder:
+    """
+    class ExpansionBuilder.
+    Builds the expansion of a security provider from adjacency data, without a
+    PermissionIdentityExpansion/PermissionIdentityBody per member.
+    Identities are interned: each one is encoded once, whatever the number of groups it is member of.
+    The batches are encoded directly (bytes), split on the max request size.
+
+        builder = ExpansionBuilder('MyProvider')
+        builder.AddMembers({'HR': ['wim', 'peter'], 'Sales': ['peter']})
+        builder.AddMemberEdges(groupColumn, memberColumn)
+        builder.AddMappings({'wim': ['wim@coveo.com']}, 'Email Security Provider')
+        builder.Upload(push, p_DeleteOlder=True)
+
+    Names (str) are identities of the security provider, of the group or member type.
+    PermissionIdentityExpansion can be used for other providers, types or additionalInfo.
+    """
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_SecurityProvider: str,
+                 p_GroupType: Constants.PermissionIdentityType = Constants.PermissionIdentityType.Group,
+                 p_MemberType: Constants.PermissionIdentityType = Constants.PermissionIdentityType.User):
+        """
+        ExpansionBuilder Constructor.
+        :arg p_SecurityProvider: str, Security Provider of the identities given by name
+        :arg p_GroupType: PermissionIdentityType of the groups given by name (def: Group)
+        :arg p_MemberType: PermissionIdentityType of the members given by name (def: User)
+        """
+        self.SecurityProvider = p_SecurityProvider
+        self.GroupType = p_GroupType
+        self.MemberType = p_MemberType
+        self.logger = logging.getLogger('CoveoExpansion')
+        # (type, provider, name) -> PermissionIdentityExpansion
+        self.Identities = {}
+        # (type, provider, name[, additionalInfo]) -> encoded identity (bytes)
+        self.Encoded = {}
+        # Encoded PermissionIdentityBody (bytes)
+        self.Members = []
+        self.Mappings = []
+        self.Deleted = []
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def GetIdentity(self, p_Name: str, p_IdentityType: Constants.PermissionIdentityType = None, p_SecurityProvider: str = None):
+        """
+        GetIdentity.
+        Returns the (shared) PermissionIdentityExpansion for the name.
+        :arg p_Name: str, identity name
+        :arg p_IdentityType: PermissionIdentityType (def: the member type)
+        :arg p_SecurityProvider: str (def: the security provider of the builder)
+        """
+        key = ((p_IdentityType or self.MemberType).value, p_SecurityProvider or self.SecurityProvider, p_Name)
+        identity = self.Identities.get(key)
+        if identity is None:
+            identity = PermissionIdentityExpansion(p_IdentityType or self.MemberType, key[1], p_Name)
+            self.Identities[key] = identity
+        return identity
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __encodeIdentity(self, p_Type: str, p_Provider: str, p_Name: str, p_AdditionalInfo: {}):
+        return json.dumps({'type': p_Type, 'provider': p_Provider, 'name': p_Name, 'additionalInfo': p_AdditionalInfo},
+                          separators=(',', ':'), default=str).encode('utf-8')
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __encodeList(self, p_Identities, p_Type: str, p_Invalid: [], p_Provider: str = None):
+        """
+        Encodes a list of identities (names or PermissionIdentityExpansion) as one JSON array.
+        Names are identities of p_Type and p_Provider (def: the security provider).
+        Invalid values are added to p_Invalid.
+        """
+        encoded = []
+        cache = self.Encoded
+        provider = p_Provider or self.SecurityProvider
+        for value in p_Identities or []:
+            if type(value) is str and value:
+                key = (p_Type, provider, value)
+                identity = cache.get(key)
+                if identity is None:
+                    identity = cache[key] = self.__encodeIdentity(p_Type, provider, value, {})
+            elif type(value) is PermissionIdentityExpansion and value['name']:
+                additionalInfo = value['additionalInfo']
+                key = (value['type'], value['provider'], value['name'])
+                if additionalInfo:
+                    key += (json.dumps(additionalInfo, sort_keys=True, default=str),)
+                identity = cache.get(key)
+                if identity is None:
+                    identity = cache[key] = self.__encodeIdentity(value['type'], value['provider'], value['name'], additionalInfo)
+            else:
+                p_Invalid.append(value)
+                continue
+            encoded.append(identity)
+        return b'[' + b','.join(encoded) + b']'
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __check(self, p_Invalid: []):
+        if p_Invalid:
+            shown = [repr(value) for value in p_Invalid[:10]]
+            Error(self, "ExpansionBuilder: " + str(len(p_Invalid)) + " identities are empty or not a name/PermissionIdentityExpansion: " + ', '.join(shown))
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __encodeBodies(self, p_Adjacency: {}, p_Type: str, p_ListType: str, p_Attr: str, p_WellKnowns: bytes):
+        """
+        Encodes a PermissionIdentityBody for each identity of p_Adjacency (identity -> list of identities, as a dict or pairs).
+        p_Attr is the attribute (mappings or members) receiving the list, in one pass: nothing is added when invalid.
+        """
+        invalid = []
+        bodies = []
+        if isinstance(p_Adjacency, dict):
+            p_Adjacency = p_Adjacency.items()
+        for identity, identities in p_Adjacency:
+            head = self.__encodeList([identity], p_Type, invalid)[1:-1]
+            adjacent = self.__encodeList(identities, p_ListType, invalid)
+            if p_Attr == 'members':
+                bodies.append(b'{"identity":' + head + b',"mappings":[],"members":' + adjacent + b',"wellKnowns":' + p_WellKnowns + b'}')
+            else:
+                bodies.append(b'{"identity":' + head + b',"mappings":' + adjacent + b',"members":[],"wellKnowns":' + p_WellKnowns + b'}')
+        self.__check(invalid)
+        return bodies
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __encodeWellKnowns(self, p_WellKnowns: []):
+        invalid = []
+        wellKnowns = self.__encodeList(p_WellKnowns, self.GroupType.value, invalid)
+        self.__check(invalid)
+        return wellKnowns
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def AddMembers(self, p_Groups: {}, p_WellKnowns: [] = None):
+        """
+        AddMembers.
+        Adds the members of the groups.
+        :arg p_Groups: dict, group name -> list of members (names or PermissionIdentityExpansion),
+                       or list of (group, members) pairs, for groups given as PermissionIdentityExpansion
+        :arg p_WellKnowns: list of well-knowns, same for all groups (optional)
+        """
+        wellKnowns = self.__encodeWellKnowns(p_WellKnowns)
+        self.Members.extend(self.__encodeBodies(p_Groups, self.GroupType.value, self.MemberType.value, 'members', wellKnowns))
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def AddMemberEdges(self, p_Groups, p_Members, p_WellKnowns: [] = None):
+        """
+        AddMemberEdges.
+        Adds the members of the groups, given as two parallel columns (lists or NumPy arrays): one row per membership.
+        :arg p_Groups: column of groups
+        :arg p_Members: column of members, p_Members[i] is a member of p_Groups[i]
+        :arg p_WellKnowns: list of well-knowns, same for all groups (optional)
+        """
+        groups = p_Groups.tolist() if hasattr(p_Groups, 'tolist') else p_Groups
+        members = p_Members.tolist() if hasattr(p_Members, 'tolist') else p_Members
+        if len(groups) != len(members):
+            Error(self, "AddMemberEdges: " + str(len(groups)) + " groups for " + str(len(members)) + " members")
+
+        adjacency = {}
+        for group, member in zip(groups, members):
+            # PermissionIdentityExpansion is not hashable, the groups are kept by their encoded key
+            key = group if type(group) is str else json.dumps(group, sort_keys=True, default=str)
+            entry = adjacency.get(key)
+            if entry is None:
+                entry = adjacency[key] = (group, [])
+            entry[1].append(member)
+        wellKnowns = self.__encodeWellKnowns(p_WellKnowns)
+        self.Members.extend(self.__encodeBodies(list(adjacency.values()), self.GroupType.value, self.MemberType.value, 'members', wellKnowns))
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def AddMappings(self, p_Mappings: {}, p_MappingProvider: str, p_WellKnowns: [] = None,
+                    p_MappingType: Constants.PermissionIdentityType = Constants.PermissionIdentityType.User):
+        """
+        AddMappings.
+        Adds the mappings of the members (users) to the identities of another security provider.
+        :arg p_Mappings: dict, member name -> list of mapped identities (names or PermissionIdentityExpansion),
+                         or list of (member, mapped identities) pairs
+        :arg p_MappingProvider: str, Security Provider of the mapped identities given by name
+        :arg p_WellKnowns: list of well-knowns, same for all members (optional)
+        :arg p_MappingType: PermissionIdentityType of the mapped identities given by name (def: User)
+        """
+        wellKnowns = self.__encodeWellKnowns(p_WellKnowns)
+        invalid = []
+        bodies = []
+        if isinstance(p_Mappings, dict):
+            p_Mappings = p_Mappings.items()
+        mappingType = p_MappingType.value
+        for identity, mappings in p_Mappings:
+            head = self.__encodeList([identity], self.MemberType.value, invalid)[1:-1]
+            bodies.append(b'{"identity":' + head + b',"mappings":' + self.__encodeList(mappings, mappingType, invalid, p_MappingProvider) +
+                          b',"members":[],"wellKnowns":' + wellKnowns + b'}')
+        self.__check(invalid)
+        self.Mappings.extend(bodies)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def AddDeleted(self, p_Identities: [], p_IdentityType: Constants.PermissionIdentityType = None):
+        """
+        AddDeleted.
+        Adds identities to delete.
+        :arg p_Identities: list of identities (names or PermissionIdentityExpansion)
+        :arg p_IdentityType: PermissionIdentityType of the identities given by name (def: the member type)
+        """
+        invalid = []
+        identityType = (p_IdentityType or self.MemberType).value
+        bodies = [b'{"identity":' + self.__encodeList([identity], identityType, invalid)[1:-1] +
+                  b',"mappings":[],"members":[],"wellKnowns":[]}'
+                  for identity in p_Identities]
+        self.__check(invalid)
+        self.Deleted.extend(bodies)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Encode(self, p_MaxSize: int = Constants.MAXIMUM_REQUEST_SIZE_IN_BYTES):
+        """
+        Encode.
+        Returns the batches (BatchPermissions encoded as bytes), each one smaller than p_MaxSize.
+        :arg p_MaxSize: int, max size of a batch in bytes
+        """
+        batches = []
+        current = {'mappings': [], 'members': [], 'deleted': []}
+        # {"mappings":[],"members":[],"deleted":[]}
+        size = 41
+
+        def flush():
+            batches.append(b'{"mappings":[' + b','.join(current['mappings']) +
+                           b'],"members":[' + b','.join(current['members']) +
+                           b'],"deleted":[' + b','.join(current['deleted']) + b']}')
+
+        for attr, bodies in (('mappings', self.Mappings), ('members', self.Members), ('deleted', self.Deleted)):
+            for body in bodies:
+                bodySize = len(body) + 1
+                if (bodySize + 41 > p_MaxSize):
+                    Error(self, "No permission identity can be larger than " + str(p_MaxSize) + " bytes in size.")
+                if (size + bodySize > p_MaxSize):
+                    flush()
+                    current = {'mappings': [], 'members': [], 'deleted': []}
+                    size = 41
+                current[attr].append(body)
+                size += bodySize
+        if size > 41:
+            flush()
+        return batches
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Upload(self, p_Push, p_DeleteOlder: bool = False):
+        """
+        Upload.
+        Pushes the batches, then, if p_DeleteOlder, deletes the older permissions of the security provider.
+        :arg p_Push: CoveoPush.Push, used for the API calls and the max request size
+        :arg p_DeleteOlder: bool (False), if older permissions should be removed after the new push
+        returns: number of batches pushed
+        """
+        startOrderingId = p_Push.CreateOrderingId()
+        batches = self.Encode(p_Push.GetSizeMaxRequest())
+        for batch in batches:
+            p_Push.UploadPermissionsBatch(self.SecurityProvider, batch)
+        if p_DeleteOlder:
+            p_Push.DeletePermissionsOlderThan(self.SecurityProvider, startOrderingId)
+        self.logger.info('Expansion ' + self.SecurityProvider + ': ' + str(len(self.Encoded)) +
+                         ' identities, ' + str(len(batches)) + ' batches pushed')
+        return len(batches)
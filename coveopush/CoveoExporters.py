@@ -0,0 +1,388 @@
+# -------------------------------------------------------------------------------------
+# CoveoExporters
+# -------------------------------------------------------------------------------------
+# Contains the PrometheusExporter and StatsdExporter classes
+#   Export the PushMetrics of a push (see Push.EnableMetrics), for long running connectors
+#   Prometheus: text format, written to a file (textfile collector) or served on a local HTTP port
+#   StatsD: UDP packets sent to a local agent
+# -------------------------------------------------------------------------------------
+import bisect
+import logging
+import os
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .CoveoMetrics import PushMetrics
+
+
+# ---------------------------------------------------------------------------------
+def Error(log, err):
+    log.logger.info(err)
+    raise Exception(err)
+
+# ---------------------------------------------------------------------------------
+
+
+class MetricsExporter:
+    """
+    class MetricsExporter.
+    Base class of the exporters: calls Flush every p_Interval seconds on a background thread (Start/Stop).
+    Nothing is done on the push itself: when no exporter is started, there is no overhead.
+    """
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_Metrics: PushMetrics, p_Interval: float = 15):
+        """
+        MetricsExporter Constructor.
+        :arg p_Metrics: PushMetrics, as returned by Push.EnableMetrics
+        :arg p_Interval: float, seconds between two flushes
+        """
+        if not isinstance(p_Metrics, PushMetrics):
+            Error(self, "MetricsExporter: p_Metrics is not of type PushMetrics, use Push.EnableMetrics")
+        self.Metrics = p_Metrics
+        self.Interval = p_Interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Flush(self):
+        pass
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __run(self):
+        while not self.stopped.wait(self.Interval):
+            try:
+                self.Flush()
+            except Exception as e:
+                self.logger.warning('Flush failed: ' + str(e))
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def StartFlushing(self):
+        if self.thread is None:
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.__run, name='CoveoExporter', daemon=True)
+            self.thread.start()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Stop(self):
+        """
+        Stop.
+        Stops the background thread and flushes a last time.
+        """
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+        self.Flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.Stop()
+
+# ---------------------------------------------------------------------------------
+
+
+class PrometheusExporter(MetricsExporter):
+    """
+    class PrometheusExporter.
+    Exports the metrics in the Prometheus text format:
+      coveopush_phase_seconds_total, coveopush_phase_count_total, coveopush_phase_bytes_total (label phase)
+      coveopush_documents_total, coveopush_bytes_total, coveopush_batches_total (label mode)
+      coveopush_responses_total (label status), coveopush_timeouts_total
+      coveopush_retries_total, coveopush_backoff_seconds_total
+      coveopush_request_duration_seconds (histogram of the container, S3 and API calls, label phase)
+      coveopush_batches_in_flight, coveopush_queue_depth (gauges)
+
+        metrics = push.EnableMetrics()
+        exporter = PrometheusExporter(metrics, p_Labels={'source': sourceId})
+        exporter.Start(p_File='/var/lib/node_exporter/coveopush.prom')   # or p_Port=9464
+        ...
+        exporter.Stop()
+    """
+    s_Buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    s_HistogramPhases = ('container', 's3put', 'api')
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_Metrics: PushMetrics, p_Labels: {} = None, p_Prefix: str = 'coveopush', p_Interval: float = 15,
+                 p_Buckets: tuple = None):
+        """
+        PrometheusExporter Constructor.
+        :arg p_Metrics: PushMetrics, as returned by Push.EnableMetrics
+        :arg p_Labels: dict, labels added to all metrics (for example the source id)
+        :arg p_Prefix: str, prefix of the metric names
+        :arg p_Interval: float, seconds between two writes of the file
+        :arg p_Buckets: tuple, upper bounds (seconds) of the latency histogram buckets
+        """
+        MetricsExporter.__init__(self, p_Metrics, p_Interval)
+        self.logger = logging.getLogger('CoveoExporters')
+        self.Labels = tuple((p_Labels or {}).items())
+        self.Prefix = p_Prefix
+        self.Buckets = tuple(p_Buckets or self.s_Buckets)
+        self.File = None
+        self.server = None
+        self.lock = threading.Lock()
+        # phase -> [bucket counts..., +Inf count, sum]
+        self.Histograms = {}
+        p_Metrics.AddHook(self.__observe)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __observe(self, p_Phase: str, p_Seconds: float, p_Bytes: int):
+        if p_Phase not in self.s_HistogramPhases:
+            return
+        with self.lock:
+            histogram = self.Histograms.get(p_Phase)
+            if histogram is None:
+                histogram = self.Histograms[p_Phase] = [0] * (len(self.Buckets) + 1) + [0.0]
+            histogram[bisect.bisect_left(self.Buckets, p_Seconds)] += 1
+            histogram[-1] += p_Seconds
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __labels(self, p_Labels: tuple = ()):
+        labels = self.Labels + tuple(p_Labels)
+        if not labels:
+            return ''
+        escaped = [str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for __, value in labels]
+        return '{' + ','.join(name + '="' + value + '"' for (name, __), value in zip(labels, escaped)) + '}'
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Render(self):
+        """
+        Render.
+        returns: str, the metrics in the Prometheus text format
+        """
+        prefix = self.Prefix
+        phases = self.Metrics.Summary()['phases']
+        lines = []
+
+        def family(p_Name: str, p_Type: str, p_Help: str):
+            lines.append('# HELP ' + prefix + '_' + p_Name + ' ' + p_Help)
+            lines.append('# TYPE ' + prefix + '_' + p_Name + ' ' + p_Type)
+
+        for name, key, help in (('phase_seconds_total', 'seconds', 'Wall time per phase of the push.'),
+                                ('phase_count_total', 'count', 'Number of times per phase of the push.'),
+                                ('phase_bytes_total', 'bytes', 'Bytes processed per phase of the push.')):
+            family(name, 'counter', help)
+            for phase, stats in phases.items():
+                lines.append(prefix + '_' + name + self.__labels((('phase', phase),)) + ' ' + repr(stats[key]))
+
+        family('retries_total', 'counter', 'Number of retried calls (429 or timeout).')
+        lines.append(prefix + '_retries_total' + self.__labels() + ' ' + repr(phases['retry']['count']))
+        family('backoff_seconds_total', 'counter', 'Seconds slept before retries.')
+        lines.append(prefix + '_backoff_seconds_total' + self.__labels() + ' ' + repr(phases['backoff']['seconds']))
+
+        counters = {}
+        for (name, labels), value in self.Metrics.GetCounters().items():
+            counters.setdefault(name, []).append((labels, value))
+        for name in sorted(counters):
+            family(name + '_total', 'counter', 'Number of ' + name + '.')
+            for labels, value in counters[name]:
+                lines.append(prefix + '_' + name + '_total' + self.__labels(labels) + ' ' + repr(value))
+
+        for name, value in sorted(self.Metrics.GetGauges().items()):
+            family(name, 'gauge', 'Current ' + name.replace('_', ' ') + '.')
+            lines.append(prefix + '_' + name + self.__labels() + ' ' + repr(value))
+
+        with self.lock:
+            histograms = {phase: list(histogram) for phase, histogram in self.Histograms.items()}
+        if histograms:
+            family('request_duration_seconds', 'histogram', 'Duration of the container, S3 and API calls.')
+            for phase, histogram in histograms.items():
+                cumulative = 0
+                for bound, count in zip(self.Buckets + ('+Inf',), histogram):
+                    cumulative += count
+                    lines.append(prefix + '_request_duration_seconds_bucket' +
+                                 self.__labels((('phase', phase), ('le', str(bound)))) + ' ' + str(cumulative))
+                lines.append(prefix + '_request_duration_seconds_sum' + self.__labels((('phase', phase),)) + ' ' + repr(histogram[-1]))
+                lines.append(prefix + '_request_duration_seconds_count' + self.__labels((('phase', phase),)) + ' ' + str(cumulative))
+        return '\n'.join(lines) + '\n'
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def WriteFile(self, p_File: str):
+        """
+        WriteFile.
+        Writes the metrics to p_File (atomic replace, for the node_exporter textfile collector).
+        """
+        temporaryFile = p_File + '.tmp'
+        with open(temporaryFile, mode='w', encoding='utf-8') as file:
+            file.write(self.Render())
+        os.replace(temporaryFile, p_File)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Flush(self):
+        if self.File:
+            self.WriteFile(self.File)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Start(self, p_File: str = None, p_Port: int = None, p_Host: str = '127.0.0.1'):
+        """
+        Start.
+        Writes the metrics to p_File every p_Interval seconds and/or serves them on http://p_Host:p_Port/metrics.
+        :arg p_File: str, file to write (optional)
+        :arg p_Port: int, local HTTP port (optional, 0 for any free port, see Port)
+        :arg p_Host: str, address to listen on (def: localhost only)
+        """
+        if p_File is None and p_Port is None:
+            Error(self, "PrometheusExporter.Start: p_File or p_Port must be set")
+        if p_File is not None:
+            self.File = p_File
+            self.StartFlushing()
+        if p_Port is not None and self.server is None:
+            exporter = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split('?')[0] not in ('/', '/metrics'):
+                        self.send_error(404)
+                        return
+                    body = exporter.Render().encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    exporter.logger.debug(format % args)
+
+            self.server = ThreadingHTTPServer((p_Host, p_Port), Handler)
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, name='CoveoPrometheus', daemon=True).start()
+            self.logger.info('Serving metrics on http://' + p_Host + ':' + str(self.Port) + '/metrics')
+        return self
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    @property
+    def Port(self):
+        return self.server.server_address[1] if self.server is not None else None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Stop(self):
+        """
+        Stop.
+        Writes the file a last time and stops the HTTP server.
+        """
+        MetricsExporter.Stop(self)
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+# ---------------------------------------------------------------------------------
+
+
+class StatsdExporter(MetricsExporter):
+    """
+    class StatsdExporter.
+    Sends the metrics to a local StatsD agent (UDP):
+      the container, S3 and API calls as timers (ms), when they are done
+      every p_Interval seconds: the increase of the phase totals and counters (c), the gauges (g)
+
+        metrics = push.EnableMetrics()
+        exporter = StatsdExporter(metrics, p_Port=8125).Start()
+        ...
+        exporter.Stop()
+    """
+    s_TimerPhases = ('container', 's3put', 'api')
+    # Keep the packets below the usual MTU
+    s_MaxPacket = 1400
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_Metrics: PushMetrics, p_Host: str = '127.0.0.1', p_Port: int = 8125, p_Prefix: str = 'coveopush',
+                 p_Interval: float = 10):
+        """
+        StatsdExporter Constructor.
+        :arg p_Metrics: PushMetrics, as returned by Push.EnableMetrics
+        :arg p_Host: str, StatsD agent host
+        :arg p_Port: int, StatsD agent port
+        :arg p_Prefix: str, prefix of the metric names
+        :arg p_Interval: float, seconds between two flushes
+        """
+        MetricsExporter.__init__(self, p_Metrics, p_Interval)
+        self.logger = logging.getLogger('CoveoExporters')
+        self.Address = (p_Host, p_Port)
+        self.Prefix = p_Prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+        # metric -> value at the previous flush
+        self.previous = {}
+        self.started = False
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __send(self, p_Lines: []):
+        packet = b''
+        for line in p_Lines:
+            line = line.encode('utf-8')
+            if packet and len(packet) + len(line) + 1 > self.s_MaxPacket:
+                self.__sendPacket(packet)
+                packet = b''
+            packet = packet + b'\n' + line if packet else line
+        if packet:
+            self.__sendPacket(packet)
+
+    def __sendPacket(self, p_Packet: bytes):
+        try:
+            self.socket.sendto(p_Packet, self.Address)
+        except OSError as e:
+            # Metrics must never break the push
+            self.logger.debug('StatsD: ' + str(e))
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __observe(self, p_Phase: str, p_Seconds: float, p_Bytes: int):
+        if p_Phase in self.s_TimerPhases:
+            self.__send([self.Prefix + '.' + p_Phase + '.duration:' + format(p_Seconds * 1000, '.3f') + '|ms'])
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __name(self, p_Name: str, p_Labels: tuple):
+        return '.'.join([self.Prefix, p_Name] + [str(value).replace('.', '_').replace(':', '_') for __, value in p_Labels])
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Flush(self):
+        """
+        Flush.
+        Sends the increase of the totals since the previous flush, and the gauges.
+        """
+        current = {}
+        for phase, stats in self.Metrics.Summary()['phases'].items():
+            current[self.Prefix + '.' + phase + '.count'] = stats['count']
+            current[self.Prefix + '.' + phase + '.bytes'] = stats['bytes']
+            current[self.Prefix + '.' + phase + '.ms'] = int(stats['seconds'] * 1000)
+        for (name, labels), value in self.Metrics.GetCounters().items():
+            current[self.__name(name, labels)] = value
+
+        lines = []
+        for name, value in current.items():
+            delta = value - self.previous.get(name, 0)
+            # Totals go down after PushMetrics.Reset
+            if delta < 0:
+                delta = value
+            if delta:
+                lines.append(name + ':' + str(delta) + '|c')
+        self.previous = current
+        for name, value in self.Metrics.GetGauges().items():
+            lines.append(self.Prefix + '.' + name + ':' + str(value) + '|g')
+        self.__send(lines)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Start(self):
+        """
+        Start.
+        Sends the timers as they are measured and flushes every p_Interval seconds.
+        """
+        if not self.started:
+            self.Metrics.AddHook(self.__observe)
+            self.started = True
+        self.StartFlushing()
+        return self
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Stop(self):
+        """
+        Stop.
+        Flushes a last time and stops sending the timers.
+        """
+        MetricsExporter.Stop(self)
+        if self.started:
+            self.Metrics.RemoveHook(self.__observe)
+            self.started = False
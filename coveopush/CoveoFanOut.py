@@ -0,0 +1,338 @@
+# -------------------------------------------------------------------------------------
+# CoveoFanOut
+# -------------------------------------------------------------------------------------
+# Contains the FanOutPush and FanOutTarget classes
+#   Pushes the same documents to several sources/organizations (targets): each document
+#   is prepared once, the targets share a connection pool and a fair scheduler
+# -------------------------------------------------------------------------------------
+import collections
+import copy
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .CoveoConstants import Constants
+from .CoveoDocument import Document, DocumentToDelete, DocumentToUpdate, EncodeJson, Validate
+
+
+# ---------------------------------------------------------------------------------
+def Error(log, err):
+    log.logger.info(err)
+    raise Exception(err)
+
+# ---------------------------------------------------------------------------------
+
+
+def TargetName(p_Push, p_Number: int):
+    # Default name of a target: its position, organization and source
+    return str(p_Number) + ':' + p_Push.OrganizationId + '/' + p_Push.SourceId
+
+# ---------------------------------------------------------------------------------
+
+
+class FanOutTarget:
+    """
+    class FanOutTarget.
+    One target of a FanOutPush: its Push, the operations waiting for it, and its counters.
+    """
+
+    def __init__(self, p_Push, p_Name: str):
+        self.Push = p_Push
+        self.Name = p_Name
+        # (kind, item, size): kind is encoded (AddEncoded) or document (Add)
+        self.Pending = collections.deque()
+        self.PendingBytes = 0
+        self.Busy = False
+        self.Error = None
+        self.Documents = 0
+        self.Seconds = 0.0
+
+    def ToJson(self):
+        return {
+            'name': self.Name,
+            'documents': self.Documents,
+            'pending': len(self.Pending),
+            'pendingBytes': self.PendingBytes,
+            'busySeconds': round(self.Seconds, 3),
+            'error': repr(self.Error) if self.Error is not None else None
+        }
+
+# ---------------------------------------------------------------------------------
+
+
+class FanOutPush:
+    """
+    class FanOutPush.
+    Pushes the same documents to several targets (Push of other sources, organizations or endpoints) in one run:
+      - each document is validated and encoded once, the same encoded fragment is added to every target
+        (AddEncoded); documents with a payload too large for a batch are copied per target (their own file container)
+      - the targets share one connection pool (requests.Session, see Push.SetSession)
+      - a fair scheduler: p_Workers threads serve the targets round-robin, p_Slice operations at a time and one
+        thread per target at a time (the operations of a target keep their order). A slow or throttled target (429
+        retries) only holds the thread serving it; its operations wait in its queue, the other targets go on.
+      - the queues hold references to the shared fragments, up to p_MaxPendingBytes per target; when the slowest
+        target is that far behind, Add waits
+      - a target which fails is dropped (its error is in Stats), the others are pushed and ended; End then raises
+
+        fanOut = FanOutPush([pushProd, pushHipaa, pushQa])
+        fanOut.Start(True, True)
+        for document in documents:
+            fanOut.Add(document)
+        fanOut.End(True, True)
+        print(fanOut.Report())
+    """
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_Targets: [], p_Workers: int = 0, p_Slice: int = 256, p_MaxPendingBytes: int = 256 * 1024 * 1024,
+                 p_PoolSize: int = 0):
+        """
+        FanOutPush Constructor.
+        :arg p_Targets: list of CoveoPush.Push, or of (name, Push)
+        :arg p_Workers: int, threads serving the targets (def: one per target)
+        :arg p_Slice: int, operations given to a target before the next target gets its turn
+        :arg p_MaxPendingBytes: int, max bytes waiting for one target
+        :arg p_PoolSize: int, connections kept per host in the shared pool (def: the workers, plus the offload
+                           threads of each target, see Push.SetOffload)
+        """
+        self.logger = logging.getLogger('CoveoFanOut')
+        if not p_Targets:
+            Error(self, "FanOutPush: no targets")
+        self.Targets = []
+        for number, target in enumerate(p_Targets):
+            if isinstance(target, tuple):
+                name, push = target
+            else:
+                name, push = TargetName(target, number), target
+            self.Targets.append(FanOutTarget(push, name))
+        self.Workers = p_Workers if p_Workers > 0 else len(self.Targets)
+        self.Slice = max(p_Slice, 1)
+        self.MaxPendingBytes = p_MaxPendingBytes
+
+        # One connection pool for all the targets: a connection per thread which can call a host, the workers
+        # and the offload threads of each Push (all the targets can be on one host)
+        self.Session = requests.Session()
+        poolSize = p_PoolSize if p_PoolSize > 0 else self.Workers + sum(target.Push.OffloadWorkers for target in self.Targets)
+        adapter = HTTPAdapter(pool_connections=max(len(self.Targets) * 2, 10), pool_maxsize=poolSize)
+        self.Session.mount('https://', adapter)
+        self.Session.mount('http://', adapter)
+        for target in self.Targets:
+            target.Push.SetSession(self.Session)
+
+        self.changed = threading.Condition()
+        self.next = 0
+        self.stopping = False
+        self.threads = []
+        self.startTime = None
+        self.endTime = None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __healthy(self):
+        return [target for target in self.Targets if target.Error is None]
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __each(self, p_Call):
+        # Calls p_Call(target) for the healthy targets in parallel, a target which fails is dropped
+        targets = self.__healthy()
+        if not targets:
+            # All the targets failed: End raises with their errors
+            return
+        with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+            futures = [(target, executor.submit(p_Call, target)) for target in targets]
+        for target, future in futures:
+            if future.exception() is not None:
+                self.__fail(target, future.exception())
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __fail(self, p_Target: FanOutTarget, p_Error):
+        with self.changed:
+            p_Target.Error = p_Error
+            p_Target.Pending.clear()
+            p_Target.PendingBytes = 0
+            self.changed.notify_all()
+        self.logger.error('Target ' + p_Target.Name + ' failed, dropped: ' + repr(p_Error))
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Start(self, p_UpdateStatus: bool = True, p_DeleteOlder: bool = False):
+        """
+        Start.
+        Starts the batch session of each target (in parallel) and the workers.
+        """
+        self.startTime = time.perf_counter()
+        self.endTime = None
+        self.stopping = False
+        self.__each(lambda target: target.Push.Start(p_UpdateStatus, p_DeleteOlder))
+        self.threads = [threading.Thread(target=self.__work, name='CoveoFanOut-' + str(number), daemon=True)
+                        for number in range(self.Workers)]
+        for thread in self.threads:
+            thread.start()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __enqueue(self, p_Kind: str, p_Item, p_Size: int, p_CopyPerTarget: bool = False):
+        with self.changed:
+            if not self.threads:
+                Error(self, "FanOutPush: Start was not called")
+            # Waits while a target is too far behind
+            while any(target.Pending and target.PendingBytes + p_Size > self.MaxPendingBytes for target in self.__healthy()):
+                self.changed.wait()
+            for target in self.__healthy():
+                target.Pending.append((p_Kind, copy.copy(p_Item) if p_CopyPerTarget else p_Item, p_Size))
+                target.PendingBytes += p_Size
+            self.changed.notify_all()
+            if not self.__healthy():
+                Error(self, "FanOutPush: all targets failed")
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Add(self, p_CoveoDocument):
+        """
+        Add.
+        Validates and encodes the document once, and adds it to every target.
+        :arg p_CoveoDocument: CoveoDocument or CoveoDocumentToDelete or CoveoDocumentToUpdate
+        """
+        if not p_CoveoDocument:
+            Error(self, "Add: p_CoveoDocument is empty")
+
+        if type(p_CoveoDocument) is DocumentToDelete or type(p_CoveoDocument) is DocumentToUpdate:
+            self.__enqueue('document', p_CoveoDocument, len(EncodeJson(p_CoveoDocument.ToJson())))
+            return
+
+        valid, error = Validate(p_CoveoDocument)
+        if not valid:
+            Error(self, "Add: " + p_CoveoDocument.DocumentId + ", " + error)
+        size = len(p_CoveoDocument.Data) + len(p_CoveoDocument.CompressedBinaryData)
+        if type(p_CoveoDocument) is Document and size > Constants.COMPRESSED_DATA_MAX_SIZE_IN_BYTES:
+            # Uploaded to a file container of each target, which changes the document: a copy per target
+            self.__enqueue('document', p_CoveoDocument, size, True)
+            return
+        self.AddEncoded(p_CoveoDocument.ToEncodedJson())
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def AddJson(self, p_Json):
+        """
+        AddJson.
+        Encodes the JSON document once, and adds it to every target.
+        """
+        self.AddEncoded(EncodeJson(p_Json))
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def AddEncoded(self, p_Encoded: bytes):
+        """
+        AddEncoded.
+        Adds an encoded document (JSON as utf-8 bytes) to every target, the same bytes are shared by the targets.
+        """
+        self.__enqueue('encoded', p_Encoded, len(p_Encoded) + 1)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __take(self):
+        # Next target round-robin which has operations and is not served (under self.changed), None if there is none
+        count = len(self.Targets)
+        for offset in range(count):
+            target = self.Targets[(self.next + offset) % count]
+            if target.Pending and not target.Busy and target.Error is None:
+                self.next = (self.next + offset + 1) % count
+                return target
+        return None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __work(self):
+        while True:
+            with self.changed:
+                target = self.__take()
+                while target is None:
+                    if self.stopping and not any(other.Pending or other.Busy for other in self.__healthy()):
+                        return
+                    self.changed.wait()
+                    target = self.__take()
+                target.Busy = True
+                operations = [target.Pending.popleft() for __ in range(min(self.Slice, len(target.Pending)))]
+                target.PendingBytes -= sum(size for __, __, size in operations)
+                self.changed.notify_all()
+
+            start = time.perf_counter()
+            error = None
+            done = 0
+            try:
+                for kind, item, __ in operations:
+                    if kind == 'encoded':
+                        target.Push.AddEncoded(item)
+                    else:
+                        target.Push.Add(item)
+                    done += 1
+            except Exception as e:
+                error = e
+            with self.changed:
+                target.Busy = False
+                target.Documents += done
+                target.Seconds += time.perf_counter() - start
+                self.changed.notify_all()
+            if error is not None:
+                self.__fail(target, error)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __abandon(self, p_Target: FanOutTarget, p_UpdateStatus: bool):
+        # Best effort for a failed target: its source does not stay in Rebuild (Push mode). Its stream (Stream mode)
+        # is left open, closed it would replace the content of the source with the documents pushed so far
+        push = p_Target.Push
+        if push.Mode == Constants.Mode.Stream:
+            self.logger.warning('Target ' + p_Target.Name + ': stream left open')
+        if not p_UpdateStatus or push.Mode != Constants.Mode.Push:
+            return
+        try:
+            push.UpdateSourceStatus(Constants.SourceStatusType.Idle)
+        except Exception as e:
+            self.logger.error('Target ' + p_Target.Name + ': status not set to Idle, ' + repr(e))
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def End(self, p_UpdateStatus: bool = True, p_DeleteOlder: bool = False):
+        """
+        End.
+        Waits until every target got its operations, then ends the batch session of each target (in parallel).
+        The failed targets are not ended: their source status is set back to Idle (best effort, Push mode),
+        the older documents are not deleted.
+        returns: dict, the statistics (see Stats); raises when a target failed, after the others were ended
+        """
+        with self.changed:
+            self.stopping = True
+            self.changed.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        self.__each(lambda target: target.Push.End(p_UpdateStatus, p_DeleteOlder))
+        for target in self.Targets:
+            if target.Error is not None:
+                self.__abandon(target, p_UpdateStatus)
+        self.endTime = time.perf_counter()
+
+        stats = self.Stats()
+        failed = [target.Name + ': ' + repr(target.Error) for target in self.Targets if target.Error is not None]
+        if failed:
+            Error(self, "FanOutPush: targets failed, " + '; '.join(failed))
+        return stats
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Stats(self):
+        """
+        Stats.
+        returns: dict, wall seconds and per target: documents given to its Push, pending operations and bytes,
+                 busy seconds and error. Can be called while the targets are pushed.
+        """
+        wall = ((self.endTime or time.perf_counter()) - self.startTime) if self.startTime is not None else 0.0
+        with self.changed:
+            return {'wallSeconds': round(wall, 3), 'targets': [target.ToJson() for target in self.Targets]}
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Report(self):
+        """
+        Report.
+        returns: str, one line per target
+        """
+        stats = self.Stats()
+        lines = ['wall: {:.3f}s'.format(stats['wallSeconds'])]
+        for target in stats['targets']:
+            lines.append('{}: {} documents, {} pending, {:.3f}s busy{}'.format(
+                target['name'], target['documents'], target['pending'], target['busySeconds'],
+                ', failed: ' + target['error'] if target['error'] else ''))
+        return '\n'.join(lines)
@@ -0,0 +1,251 @@
+# -------------------------------------------------------------------------------------
+# CoveoJournal
+# -------------------------------------------------------------------------------------
+# Contains the PushJournal class
+#   Checkpoint journal of a batch session (Start/Add/End) on local disk, so that a session
+#   which was interrupted (crash, killed worker) is resumed instead of restarted
+# -------------------------------------------------------------------------------------
+import json
+import logging
+import os
+import time
+
+
+# ---------------------------------------------------------------------------------
+def Error(log, err):
+    log.logger.info(err)
+    raise Exception(err)
+
+# ---------------------------------------------------------------------------------
+
+
+class PushJournal:
+    """
+    class PushJournal.
+    Journal (JSON lines, flushed and synced after each record) of a batch session:
+      start:  source, mode and StartOrderingId of the session
+      stream: stream id (Stream mode)
+      batch:  each batch acknowledged by the Push API, with the documents and the input position so far
+      rejected: each document rejected as too large (see Push.Rejected), restored by a resumed session
+      step:   the steps of End which are done (close of the stream, delete of the older documents, status)
+    When Push.Start finds an unfinished session of the same source and mode, it is resumed:
+    the same StartOrderingId (so the final DeleteOlderThan is right) and the same stream are used.
+    The caller skips the input which was acknowledged (Documents or Position), End only runs the
+    steps which are not done yet, and removes the journal. When documents were rejected, End does not
+    delete the older documents and keeps the journal: remove it (Complete) once the rejected documents are handled.
+
+        journal = push.SetJournal(PushJournal('mysource.journal'))
+        push.Start(True, True)
+        for nr, document in enumerate(documents):
+            if nr < journal.Documents:
+                continue
+            push.Add(document)
+        push.End(True, True)
+
+    Or with your own input position (for example a file offset or a database key):
+
+        push.Start(True, True)
+        reader.Seek(journal.Position or 0)
+        for document, position in reader:
+            push.Add(document)
+            journal.Mark(position)
+        push.End(True, True)
+
+    A batch which was uploaded but not acknowledged in the journal (crash during the call) is pushed again:
+    the documents are replaced by the same content.
+    """
+    version = 1
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_File: str, p_Sync: bool = True):
+        """
+        PushJournal Constructor.
+        :arg p_File: str, journal file (created by the first Start, removed by End)
+        :arg p_Sync: bool (True), fsync after each record
+        """
+        self.File = p_File
+        self.Sync = p_Sync
+        self.logger = logging.getLogger('CoveoJournal')
+        self.file = None
+        self.Load()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __clear(self):
+        self.SourceId = None
+        self.Mode = None
+        self.OrderingId = None
+        self.StreamId = None
+        self.Documents = 0
+        self.Position = None
+        self.Batches = 0
+        self.Steps = set()
+        self.Rejected = []
+        self.Resumed = False
+        self.mark = None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Load(self):
+        """
+        Load.
+        Reads the journal of an unfinished session (when the file exists).
+        returns: bool, if there is an unfinished session
+        """
+        self.__clear()
+        if not os.path.isfile(self.File):
+            return False
+
+        with open(self.File, mode='r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Last record not completely written
+                    self.logger.warning('Journal ' + self.File + ': incomplete record ignored')
+                    break
+                kind = record.get('type')
+                if kind == 'start':
+                    if record.get('version') != self.version:
+                        Error(self, 'Journal ' + self.File + ': unknown version ' + str(record.get('version')))
+                    self.SourceId = record['sourceId']
+                    self.Mode = record['mode']
+                    self.OrderingId = record['orderingId']
+                elif kind == 'stream':
+                    self.StreamId = record['streamId']
+                elif kind == 'batch':
+                    self.Batches += 1
+                    self.Documents = record['documents']
+                    self.Position = record.get('position')
+                elif kind == 'step':
+                    self.Steps.add(record['step'])
+                elif kind == 'rejected':
+                    # A batch pushed again after a crash can reject the same document again
+                    if record['rejected'] not in self.Rejected:
+                        self.Rejected.append(record['rejected'])
+
+        if self.OrderingId is None:
+            self.__clear()
+            return False
+        self.logger.info('Journal ' + self.File + ': unfinished session ' + str(self.OrderingId) +
+                         ', ' + str(self.Batches) + ' batches, ' + str(self.Documents) + ' documents')
+        return True
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def CanResume(self, p_SourceId: str, p_Mode: str):
+        """
+        CanResume.
+        returns: bool, if the journal holds an unfinished session of this source and mode
+        """
+        if self.OrderingId is None:
+            return False
+        if self.SourceId != p_SourceId or self.Mode != p_Mode:
+            Error(self, 'Journal ' + self.File + ' is of source ' + str(self.SourceId) + ' (' + str(self.Mode) +
+                  '), not of ' + p_SourceId + ' (' + p_Mode + ')')
+        return True
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __write(self, p_Record: {}):
+        if self.file is None:
+            self.file = open(self.File, mode='a', encoding='utf-8')
+        self.file.write(json.dumps(p_Record) + '\n')
+        self.file.flush()
+        if self.Sync:
+            os.fsync(self.file.fileno())
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Begin(self, p_SourceId: str, p_Mode: str, p_OrderingId: int):
+        """
+        Begin.
+        Starts the journal of a new session (called by Push.Start).
+        """
+        self.Close()
+        self.__clear()
+        self.SourceId = p_SourceId
+        self.Mode = p_Mode
+        self.OrderingId = p_OrderingId
+        self.file = open(self.File, mode='w', encoding='utf-8')
+        self.__write({'type': 'start', 'version': self.version, 'sourceId': p_SourceId, 'mode': p_Mode,
+                      'orderingId': p_OrderingId, 'time': time.time()})
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Resume(self):
+        """
+        Resume.
+        Continues the journal of the unfinished session (called by Push.Start).
+        """
+        self.Resumed = True
+        self.mark = self.Position
+        self.logger.info('Resuming session ' + str(self.OrderingId) + ' after ' + str(self.Documents) + ' documents')
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def SetStream(self, p_StreamId: str):
+        """
+        SetStream.
+        Records the stream id of the session (Stream mode).
+        """
+        self.StreamId = p_StreamId
+        self.__write({'type': 'stream', 'streamId': p_StreamId})
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Mark(self, p_Position):
+        """
+        Mark.
+        Sets the input position after the last added document (any JSON value), it is recorded with the next acknowledged batch.
+        """
+        self.mark = p_Position
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Acknowledge(self, p_Documents: int):
+        """
+        Acknowledge.
+        Records a batch accepted by the Push API (called by Push.UploadBatch).
+        :arg p_Documents: int, documents in the batch
+        """
+        self.Batches += 1
+        self.Documents += p_Documents
+        self.Position = self.mark
+        self.__write({'type': 'batch', 'documents': self.Documents, 'position': self.Position})
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Reject(self, p_Rejected: {}):
+        """
+        Reject.
+        Records a document rejected as too large (called by Push.UploadBatch).
+        :arg p_Rejected: dict, documentId, operation, bytes, status
+        """
+        self.Rejected.append(p_Rejected)
+        self.__write({'type': 'rejected', 'rejected': p_Rejected})
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def IsDone(self, p_Step: str):
+        """
+        IsDone.
+        returns: bool, if the step of End (close, deleteolder, idle) was done
+        """
+        return p_Step in self.Steps
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Done(self, p_Step: str):
+        """
+        Done.
+        Records a step of End.
+        """
+        self.Steps.add(p_Step)
+        self.__write({'type': 'step', 'step': p_Step})
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Complete(self):
+        """
+        Complete.
+        The session is finished: removes the journal (called by Push.End).
+        """
+        self.Close()
+        if os.path.isfile(self.File):
+            os.remove(self.File)
+        self.logger.info('Session ' + str(self.OrderingId) + ' completed, ' + str(self.Documents) + ' documents')
+        self.__clear()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,117 @@
+# -------------------------------------------------------------------------------------
+# CoveoJsonLines
+# -------------------------------------------------------------------------------------
+# Contains the JsonLinesLoader class
+#   Streams a NDJSON/JSONL file (Push API format) into a batch push
+# -------------------------------------------------------------------------------------
+import logging
+import re
+from urllib.parse import urlparse
+
+
+# ---------------------------------------------------------------------------------
+def Error(log, err):
+    log.logger.info(err)
+    raise Exception(err)
+
+# ---------------------------------------------------------------------------------
+
+
+# Matches the documentId (case-insensitive) in an encoded document, without parsing the JSON
+s_DocumentIdPattern = re.compile(rb'"documentid"\s*:\s*"((?:[^"\\]|\\.)*)"', re.IGNORECASE)
+
+
+def ValidateJsonLine(p_Line: bytes):
+    """
+    ValidateJsonLine.
+    Light validation of an encoded document: the documentId must be present and be a valid URL.
+    The line itself is not parsed.
+    Returns True/False, Error
+    """
+    match = s_DocumentIdPattern.search(p_Line)
+    if not match:
+        return False, 'documentId is missing'
+
+    documentId = match.group(1).decode('utf-8', errors='replace')
+    if documentId == '':
+        return False, 'documentId is empty'
+
+    parsed_url = urlparse(documentId)
+    if not parsed_url.scheme:
+        return False, 'documentId is not a valid URL format [missing scheme]: ' + documentId
+    if not (parsed_url.netloc or parsed_url.path):
+        return False, 'documentId is not a valid URL format [missing path]: ' + documentId
+
+    return True, ''
+
+# ---------------------------------------------------------------------------------
+
+
+class JsonLinesLoader:
+    """
+    class JsonLinesLoader.
+    Streams NDJSON/JSONL (one document in the Push API format per line) into a batch push.
+    Every line is added as is (bytes) to the batch, no parse/dump round trip is done.
+
+        push = CoveoPush.Push(sourceId, orgId, apiKey)
+        push.Start(updateSourceStatus, deleteOlder)
+        loader = JsonLinesLoader(push, p_ValidateDocumentId=True)
+        loader.Load('documents.jsonl')
+        push.End(updateSourceStatus, deleteOlder)
+    """
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_Push, p_ValidateDocumentId: bool = False, p_BufferSize: int = 1024*1024):
+        """
+        JsonLinesLoader Constructor.
+        :arg p_Push: CoveoPush.Push, the push client (Start must be called before Load)
+        :arg p_ValidateDocumentId: bool (False), check that every line holds a valid documentId
+        :arg p_BufferSize: int, read buffer size in bytes
+        """
+        self.Push = p_Push
+        self.ValidateDocumentId = p_ValidateDocumentId
+        self.BufferSize = p_BufferSize
+        self.logger = logging.getLogger('CoveoJsonLines')
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def LoadLines(self, p_Lines):
+        """
+        LoadLines.
+        Adds every (non empty) line to the batch.
+        :arg p_Lines: iterable of bytes, for example a file opened in binary mode
+        returns: number of documents added
+        """
+        count = 0
+        lineNr = 0
+        for line in p_Lines:
+            lineNr += 1
+            line = line.strip()
+            if not line:
+                continue
+            if lineNr == 1 and line.startswith(b'\xef\xbb\xbf'):
+                line = line[3:]
+
+            if self.ValidateDocumentId:
+                valid, error = ValidateJsonLine(line)
+                if not valid:
+                    Error(self, "LoadLines: line " + str(lineNr) + ", " + error)
+
+            self.Push.AddEncoded(line)
+            count += 1
+
+        return count
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Load(self, p_FilePath: str):
+        """
+        Load.
+        Streams the NDJSON/JSONL file into the batch.
+        :arg p_FilePath: str, NDJSON/JSONL file
+        returns: number of documents added
+        """
+        self.logger.info('Loading ' + p_FilePath)
+        with open(p_FilePath, mode='rb', buffering=self.BufferSize) as file:
+            count = self.LoadLines(file)
+
+        self.logger.info('Loaded ' + str(count) + ' documents from ' + p_FilePath)
+        return count
@@ -0,0 +1,192 @@
+# -------------------------------------------------------------------------------------
+# CoveoMembershipDelta
+# -------------------------------------------------------------------------------------
+# Contains the MembershipDelta class
+#   Compares the membership graph of a security provider with the one of the previous run
+#   (stored locally) and only pushes the changed identities
+# -------------------------------------------------------------------------------------
+import hashlib
+import json
+import logging
+import os
+from .CoveoPermissions import PermissionIdentityBody
+from .CoveoPermissions import PermissionIdentityExpansion
+
+
+# ---------------------------------------------------------------------------------
+def Error(log, err):
+    log.logger.info(err)
+    raise Exception(err)
+
+# ---------------------------------------------------------------------------------
+
+
+class MembershipDelta:
+    """
+    class MembershipDelta.
+    Computes the delta between the membership graph of the previous run and the current one.
+    The previous graph is stored in a local state file, as one digest of the members, mappings and
+    well-knowns for each identity. Identities are passed one by one (streaming): only new or changed
+    identities are sent to the sink, identities which are gone are sent as deleted by End.
+
+        push.StartExpansion(mysecprovidername)
+        delta = MembershipDelta('provider.state', push.AddExpansion)
+        for group in groups:
+            delta.AddExpansionMember(group, members, [], [])
+        for user in users:
+            delta.AddExpansionMapping(user, [], mappings, wellknowns)
+        delta.End()
+        push.EndExpansion(mysecprovidername)
+        delta.Save()
+
+    Do not delete the older permissions (p_DeleteOlder) when pushing a delta:
+    the unchanged identities are not sent again.
+    """
+    version = 1
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_StateFile: str, p_Sink):
+        """
+        MembershipDelta Constructor.
+        :arg p_StateFile: str, file holding the graph of the previous run (created by Save)
+        :arg p_Sink: callable(PermissionIdentityBody, attr) receiving the changes, attr is members, mappings or deleted.
+                     For example Push.AddExpansion (between StartExpansion/EndExpansion).
+        """
+        self.StateFile = p_StateFile
+        self.Sink = p_Sink
+        self.logger = logging.getLogger('CoveoMembershipDelta')
+        # identity key -> (identity, digest)
+        self.Previous = self.Load(p_StateFile)
+        self.Current = {}
+        self.Added = 0
+        self.Changed = 0
+        self.Unchanged = 0
+        self.Deleted = 0
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Load(self, p_StateFile: str):
+        """
+        Load.
+        Loads the state file, returns an empty graph when the file does not exist (first run).
+        returns: dict, identity key -> (identity, digest)
+        """
+        if not os.path.isfile(p_StateFile):
+            self.logger.info('No previous state ' + p_StateFile + ', all identities will be pushed')
+            return {}
+
+        with open(p_StateFile, mode='r', encoding='utf-8') as file:
+            state = json.load(file)
+        if state.get('version') != self.version:
+            Error(self, "MembershipDelta: unknown state version in " + p_StateFile)
+
+        previous = {}
+        for identity, digest in state['identities']:
+            previous[self.__key(identity)] = (identity, digest)
+        self.logger.info('Loaded ' + str(len(previous)) + ' identities from ' + p_StateFile)
+        return previous
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Save(self, p_StateFile: str = None):
+        """
+        Save.
+        Saves the current graph as the state for the next run. Call it after a successful push.
+        :arg p_StateFile: str, def: the state file given to the constructor
+        """
+        stateFile = p_StateFile or self.StateFile
+        state = {
+            'version': self.version,
+            'identities': [[identity, digest] for identity, digest in self.Current.values()]
+        }
+        temporaryFile = stateFile + '.tmp'
+        with open(temporaryFile, mode='w', encoding='utf-8') as file:
+            json.dump(state, file, separators=(',', ':'))
+        os.replace(temporaryFile, stateFile)
+        self.logger.info('Saved ' + str(len(self.Current)) + ' identities to ' + stateFile)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __key(self, p_Identity):
+        additionalInfo = p_Identity['additionalInfo']
+        return '\x1f'.join((p_Identity['type'], p_Identity['provider'], p_Identity['name'],
+                            json.dumps(additionalInfo, sort_keys=True, default=str) if additionalInfo else ''))
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __digest(self, p_Attr: str, p_Members: [], p_Mappings: [], p_WellKnowns: []):
+        # Order independent: the adjacency sets are sorted before hashing
+        digest = hashlib.blake2b(p_Attr.encode('ascii'), digest_size=16)
+        for identities in (p_Members, p_Mappings, p_WellKnowns):
+            digest.update(b'\x1d')
+            for key in sorted(set([self.__key(identity) for identity in identities or []])):
+                digest.update(key.encode('utf-8'))
+                digest.update(b'\x1e')
+        return digest.hexdigest()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Add(self, p_Attr: str, p_Identity: PermissionIdentityExpansion, p_Members: [], p_Mappings: [], p_WellKnowns: []):
+        """
+        Add.
+        Adds an identity of the current graph, it is sent to the sink when new or changed.
+        :arg p_Attr: str, members or mappings
+        :arg p_Identity: PermissionIdentityExpansion.
+        :arg p_Members: list of PermissionIdentityExpansion.
+        :arg p_Mappings: list of PermissionIdentityExpansion.
+        :arg p_WellKnowns: list of PermissionIdentityExpansion.
+        """
+        if not (type(p_Identity) is PermissionIdentityExpansion):
+            Error(self, "Add: value is not of type PermissionIdentityExpansion")
+        if p_Attr not in ('members', 'mappings'):
+            Error(self, "Add: " + p_Attr + " must be members or mappings")
+
+        key = self.__key(p_Identity)
+        digest = self.__digest(p_Attr, p_Members, p_Mappings, p_WellKnowns)
+        self.Current[key] = (dict(p_Identity), digest)
+
+        previous = self.Previous.get(key)
+        if previous is not None and previous[1] == digest:
+            self.Unchanged += 1
+            return
+
+        if previous is None:
+            self.Added += 1
+        else:
+            self.Changed += 1
+
+        permissionIdentityBody = PermissionIdentityBody(p_Identity)
+        permissionIdentityBody.AddMembers(p_Members)
+        permissionIdentityBody.AddMappings(p_Mappings)
+        permissionIdentityBody.AddWellKnowns(p_WellKnowns)
+        self.Sink(permissionIdentityBody, p_Attr)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def AddExpansionMember(self, p_Identity: PermissionIdentityExpansion, p_Members: [], p_Mappings: [], p_WellKnowns: []):
+        """
+        AddExpansionMember.
+        Same as Push.AddExpansionMember, only sent when new or changed.
+        """
+        self.Add('members', p_Identity, p_Members, p_Mappings, p_WellKnowns)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def AddExpansionMapping(self, p_Identity: PermissionIdentityExpansion, p_Members: [], p_Mappings: [], p_WellKnowns: []):
+        """
+        AddExpansionMapping.
+        Same as Push.AddExpansionMapping, only sent when new or changed.
+        """
+        self.Add('mappings', p_Identity, p_Members, p_Mappings, p_WellKnowns)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def End(self):
+        """
+        End.
+        Sends the identities of the previous graph which are not in the current graph as deleted.
+        returns: dict with the number of added, changed, unchanged and deleted identities
+        """
+        for key, (identity, __) in self.Previous.items():
+            if key in self.Current:
+                continue
+            self.Deleted += 1
+            deletedIdentity = PermissionIdentityExpansion.__new__(PermissionIdentityExpansion)
+            dict.update(deletedIdentity, identity)
+            self.Sink(PermissionIdentityBody(deletedIdentity), 'deleted')
+
+        stats = {'added': self.Added, 'changed': self.Changed, 'unchanged': self.Unchanged, 'deleted': self.Deleted}
+        self.logger.info('MembershipDelta: ' + json.dumps(stats))
+        return stats
@@ -0,0 +1,228 @@
+# -------------------------------------------------------------------------------------
+# CoveoMetrics
+# -------------------------------------------------------------------------------------
+# Contains the PushMetrics class
+#   Records the wall time and the bytes of each phase of a push (see Push.EnableMetrics)
+#   and the counters/gauges used by the exporters (see CoveoExporters)
+# -------------------------------------------------------------------------------------
+import logging
+import threading
+import time
+
+
+# ---------------------------------------------------------------------------------
+class PhaseStats:
+    """
+    class PhaseStats.
+    Totals of one phase: number of times, seconds (total and max) and bytes.
+    """
+    __slots__ = ('Count', 'Seconds', 'MaxSeconds', 'Bytes')
+
+    def __init__(self):
+        self.Count = 0
+        self.Seconds = 0.0
+        self.MaxSeconds = 0.0
+        self.Bytes = 0
+
+    def ToJson(self):
+        return {'count': self.Count, 'seconds': self.Seconds, 'maxSeconds': self.MaxSeconds, 'bytes': self.Bytes}
+
+# ---------------------------------------------------------------------------------
+
+
+class PushMetrics:
+    """
+    class PushMetrics.
+    Wall time and bytes for each phase of a push:
+      validation:    Validate of the documents
+      tojson:        encoding of the documents (bytes: size of the JSON)
+      sizing:        batch size accounting
+      serialization: encoding of the batches (bytes: size of the batch)
+      container:     file container calls
+      s3put:         uploads to S3 (bytes: size of the upload)
+      api:           other Push API calls (source status, batch/stream calls, deletes, security)
+      retry:         failed attempts (429 or timeout), which are retried
+      backoff:       sleeps before a retry (seconds slept)
+      batch:         whole batch uploads, container to Push API call (overlaps the phases above)
+    Hooks are called after each recorded phase: hook(phase, seconds, bytes).
+    Counters (for example documents and bytes pushed, by mode, or 429 responses) have labels,
+    gauges (for example batches in flight) are values or functions read by the exporters.
+
+        metrics = push.EnableMetrics()
+        metrics.AddHook(lambda phase, seconds, size: print(phase, seconds, size))
+        push.Start()
+        ...
+        push.End()
+        print(metrics.Report())
+    """
+    s_Phases = ('validation', 'tojson', 'sizing', 'serialization', 'container', 's3put', 'api', 'retry', 'backoff', 'batch')
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self):
+        self.logger = logging.getLogger('CoveoMetrics')
+        self.Hooks = []
+        # gauge name -> callable returning the value
+        self.GaugeFunctions = {}
+        self.lock = threading.Lock()
+        self.Reset()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Reset(self):
+        """
+        Reset.
+        Clears the totals and counters, the hooks and gauge functions are kept.
+        """
+        with self.lock:
+            self.Phases = {phase: PhaseStats() for phase in self.s_Phases}
+            # (name, labels) -> value, labels is a tuple of (label, value) pairs
+            self.Counters = {}
+            # name -> value
+            self.Gauges = {}
+            self.StartTime = None
+            self.EndTime = None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def AddHook(self, p_Hook):
+        """
+        AddHook.
+        :arg p_Hook: callable(phase: str, seconds: float, bytes: int), called after each recorded phase
+        """
+        self.Hooks.append(p_Hook)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def RemoveHook(self, p_Hook):
+        self.Hooks.remove(p_Hook)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Begin(self):
+        """
+        Begin.
+        Marks the start of a push session (called by Push.Start).
+        """
+        self.StartTime = time.perf_counter()
+        self.EndTime = None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Finish(self):
+        """
+        Finish.
+        Marks the end of a push session (called by Push.End).
+        """
+        self.EndTime = time.perf_counter()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Record(self, p_Phase: str, p_Seconds: float, p_Bytes: int = 0):
+        """
+        Record.
+        Adds a measure to the phase and calls the hooks.
+        :arg p_Phase: str, one of s_Phases (other names are added as new phases)
+        :arg p_Seconds: float, wall time
+        :arg p_Bytes: int, bytes processed
+        """
+        with self.lock:
+            stats = self.Phases.get(p_Phase)
+            if stats is None:
+                stats = self.Phases[p_Phase] = PhaseStats()
+            stats.Count += 1
+            stats.Seconds += p_Seconds
+            stats.Bytes += p_Bytes
+            if p_Seconds > stats.MaxSeconds:
+                stats.MaxSeconds = p_Seconds
+        for hook in self.Hooks:
+            hook(p_Phase, p_Seconds, p_Bytes)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Increment(self, p_Name: str, p_Value=1, p_Labels: tuple = ()):
+        """
+        Increment.
+        Adds p_Value to the counter.
+        :arg p_Name: str, counter name (for example documents)
+        :arg p_Value: int or float
+        :arg p_Labels: tuple of (label, value) pairs, for example (('mode', 'PUSH'),)
+        """
+        key = (p_Name, p_Labels)
+        with self.lock:
+            self.Counters[key] = self.Counters.get(key, 0) + p_Value
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def ChangeGauge(self, p_Name: str, p_Delta):
+        """
+        ChangeGauge.
+        Adds p_Delta (can be negative) to the gauge, for example +1/-1 around an upload.
+        """
+        with self.lock:
+            self.Gauges[p_Name] = self.Gauges.get(p_Name, 0) + p_Delta
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def AddGauge(self, p_Name: str, p_Function):
+        """
+        AddGauge.
+        Registers a gauge which is only read by the exporters, for example the queue depth.
+        :arg p_Function: callable() returning the value
+        """
+        self.GaugeFunctions[p_Name] = p_Function
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def GetCounters(self):
+        """
+        GetCounters.
+        returns: dict, (name, labels) -> value
+        """
+        with self.lock:
+            return dict(self.Counters)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def GetGauges(self):
+        """
+        GetGauges.
+        returns: dict, name -> value, of the gauges and the gauge functions
+        """
+        with self.lock:
+            gauges = dict(self.Gauges)
+        for name, function in list(self.GaugeFunctions.items()):
+            try:
+                gauges[name] = function()
+            except Exception as e:
+                self.logger.debug('Gauge ' + name + ': ' + str(e))
+        return gauges
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Lap(self, p_Phase: str, p_Start: float, p_Bytes: int = 0):
+        """
+        Lap.
+        Records the time since p_Start (time.perf_counter) for the phase.
+        returns: the current time.perf_counter, start of the next phase
+        """
+        now = time.perf_counter()
+        self.Record(p_Phase, now - p_Start, p_Bytes)
+        return now
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Summary(self):
+        """
+        Summary.
+        returns: dict, phase -> {count, seconds, maxSeconds, bytes}, and the wall time of the session (wallSeconds)
+        """
+        with self.lock:
+            summary = {'phases': {phase: stats.ToJson() for phase, stats in self.Phases.items()}}
+        wallSeconds = None
+        if self.StartTime is not None:
+            wallSeconds = (self.EndTime or time.perf_counter()) - self.StartTime
+        summary['wallSeconds'] = wallSeconds
+        return summary
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Report(self):
+        """
+        Report.
+        returns: str, one line per phase which was recorded
+        """
+        summary = self.Summary()
+        lines = []
+        if summary['wallSeconds'] is not None:
+            lines.append('wall: {:.3f}s'.format(summary['wallSeconds']))
+        for phase, stats in summary['phases'].items():
+            if stats['count']:
+                lines.append('{}: {} x, {:.3f}s (max {:.3f}s), {} bytes'.format(
+                    phase, stats['count'], stats['seconds'], stats['maxSeconds'], stats['bytes']))
+        return '\n'.join(lines)
@@ -0,0 +1,246 @@
+# -------------------------------------------------------------------------------------
+# CoveoMockServer
+# -------------------------------------------------------------------------------------
+# Contains the MockPushApi class
+#   Local stand-in of the Push API and of the S3 (presigned PUT) file containers,
+#   with configurable latency, bandwidth and 429/5xx injection. For benchmarks and
+#   tests without an organization (see examples/benchmark_push.py)
+# -------------------------------------------------------------------------------------
+import json
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+
+# ---------------------------------------------------------------------------------
+class MockPushApi:
+    """
+    class MockPushApi.
+    Serves the Push API paths (Constants.PushApiPaths) and the S3 uploads on http://127.0.0.1:port.
+    Uploaded files are not kept, only counted (bytes and requests, per route).
+
+        with MockPushApi(p_Latency=0.02, p_Bandwidth=50*1024*1024) as server:
+            push = CoveoPush.Push(sourceId, orgId, apiKey, p_Endpoint=server.Endpoint)
+            ...
+            print(server.Stats())
+
+    Faults (429 and 5xx) are injected on the routes which the SDK retries (p_FaultRoutes):
+    s3 uploads, batch/stream calls and security calls.
+    With p_MaxUploadSize, larger S3 uploads are rejected with 413 (EntityTooLarge).
+    """
+    s_Routes = [
+        ('PUT', 's3', r'/s3/(?P<file_id>[^/]+)$'),
+        ('POST', 'files', r'/organizations/[^/]+/files$'),
+        ('POST', 'status', r'/organizations/[^/]+/sources/[^/]+/status$'),
+        ('PUT', 'batch', r'/organizations/[^/]+/sources/[^/]+/documents/batch$'),
+        ('DELETE', 'olderthan', r'/organizations/[^/]+/sources/[^/]+/documents/olderthan$'),
+        ('PUT', 'document', r'/organizations/[^/]+/sources/[^/]+/documents$'),
+        ('DELETE', 'document', r'/organizations/[^/]+/sources/[^/]+/documents$'),
+        ('POST', 'streamopen', r'/organizations/[^/]+/sources/[^/]+/stream/open$'),
+        ('POST', 'streamchunk', r'/organizations/[^/]+/sources/[^/]+/stream/(?P<stream_id>[^/]+)/chunk$'),
+        ('POST', 'streamclose', r'/organizations/[^/]+/sources/[^/]+/stream/(?P<stream_id>[^/]+)/close$'),
+        ('PUT', 'streamupdate', r'/organizations/[^/]+/sources/[^/]+/stream/update$'),
+        ('PUT', 'permissionsbatch', r'/organizations/[^/]+/providers/[^/]+/permissions/batch$'),
+        ('DELETE', 'permissionsolderthan', r'/organizations/[^/]+/providers/[^/]+/permissions/olderthan$'),
+        ('PUT', 'permissions', r'/organizations/[^/]+/providers/[^/]+/permissions$'),
+        ('DELETE', 'permissions', r'/organizations/[^/]+/providers/[^/]+/permissions$'),
+        ('PUT', 'mappings', r'/organizations/[^/]+/providers/[^/]+/mappings$'),
+    ]
+    s_FaultRoutes = ('s3', 'batch', 'streamopen', 'streamchunk', 'streamclose', 'streamupdate', 'document',
+                     'olderthan', 'permissionsbatch', 'permissions', 'permissionsolderthan', 'mappings')
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_Latency: float = 0.0, p_Bandwidth: float = 0, p_Rate429: float = 0.0, p_Rate5xx: float = 0.0,
+                 p_FaultRoutes: tuple = None, p_Seed: int = None, p_Port: int = 0, p_MaxUploadSize: int = 0):
+        """
+        MockPushApi Constructor.
+        :arg p_Latency: float, seconds added to each request
+        :arg p_Bandwidth: float, bytes per second of the request bodies (0: unlimited)
+        :arg p_Rate429: float, 0..1, part of the requests answered with 429 (Too many requests)
+        :arg p_Rate5xx: float, 0..1, part of the requests answered with 503
+        :arg p_FaultRoutes: tuple of route names where faults are injected (def: s_FaultRoutes)
+        :arg p_Seed: int, seed of the fault injection (optional)
+        :arg p_Port: int, port to listen on (def: any free port)
+        :arg p_MaxUploadSize: int, bytes, larger S3 uploads are rejected (def: 0, no limit)
+        """
+        self.logger = logging.getLogger('CoveoMockServer')
+        self.Latency = p_Latency
+        self.Bandwidth = p_Bandwidth
+        self.Rate429 = p_Rate429
+        self.Rate5xx = p_Rate5xx
+        self.MaxUploadSize = p_MaxUploadSize
+        self.FaultRoutes = tuple(p_FaultRoutes if p_FaultRoutes is not None else self.s_FaultRoutes)
+        self.random = random.Random(p_Seed)
+        self.routes = [(method, name, re.compile(pattern)) for method, name, pattern in self.s_Routes]
+        self.lock = threading.Lock()
+        self.Reset()
+
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                mock.Handle(self, 'GET')
+
+            def do_POST(self):
+                mock.Handle(self, 'POST')
+
+            def do_PUT(self):
+                mock.Handle(self, 'PUT')
+
+            def do_DELETE(self):
+                mock.Handle(self, 'DELETE')
+
+            def log_message(self, format, *args):
+                mock.logger.debug(format % args)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', p_Port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name='CoveoMockServer', daemon=True)
+        self.thread.start()
+        self.Url = 'http://127.0.0.1:' + str(self.server.server_address[1])
+        # Use as p_Endpoint of the Push
+        self.Endpoint = self.Url + '/push/v1'
+        self.logger.info('Mock Push API on ' + self.Endpoint)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Reset(self):
+        """
+        Reset.
+        Clears the statistics.
+        """
+        with self.lock:
+            self.Requests = {}
+            self.Faults = {}
+            self.BytesReceived = 0
+            self.Uploads = 0
+            self.Batches = 0
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Stats(self):
+        """
+        Stats.
+        returns: dict with the requests per route, the injected faults per status, the bytes uploaded,
+                 the number of uploads and batches (documents, stream chunks and permissions)
+        """
+        with self.lock:
+            return {
+                'requests': dict(self.Requests),
+                'totalRequests': sum(self.Requests.values()),
+                'faults': dict(self.Faults),
+                'bytesReceived': self.BytesReceived,
+                'uploads': self.Uploads,
+                'batches': self.Batches
+            }
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __container(self):
+        fileId = str(uuid.uuid4())
+        return {'uploadUri': self.Url + '/s3/' + fileId, 'fileId': fileId}
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __reply(self, p_Handler, p_Status: int, p_Body: {} = None):
+        body = json.dumps(p_Body).encode('utf-8') if p_Body is not None else b''
+        p_Handler.send_response(p_Status)
+        p_Handler.send_header('Content-Type', 'application/json')
+        p_Handler.send_header('Content-Length', str(len(body)))
+        p_Handler.end_headers()
+        p_Handler.wfile.write(body)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __readBody(self, p_Handler):
+        length = int(p_Handler.headers.get('Content-Length') or 0)
+        remaining = length
+        while remaining > 0:
+            chunk = p_Handler.rfile.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+        if self.Bandwidth:
+            time.sleep(length / self.Bandwidth)
+        return length
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Handle(self, p_Handler, p_Method: str):
+        """
+        Handle.
+        Answers one request (called by the HTTP server threads).
+        """
+        path = urlparse(p_Handler.path).path
+        if path.startswith('/push/v1'):
+            path = path[len('/push/v1'):]
+        name = None
+        match = None
+        for method, routeName, pattern in self.routes:
+            if method == p_Method:
+                match = pattern.search(path)
+                if match:
+                    name = routeName
+                    break
+
+        length = self.__readBody(p_Handler)
+        if self.Latency:
+            time.sleep(self.Latency)
+
+        if name is None:
+            self.__reply(p_Handler, 404, {'message': 'Unknown path ' + p_Method + ' ' + path})
+            return
+
+        status = 0
+        if name in self.FaultRoutes and (self.Rate429 or self.Rate5xx):
+            with self.lock:
+                draw = self.random.random()
+            if draw < self.Rate429:
+                status = 429
+            elif draw < self.Rate429 + self.Rate5xx:
+                status = 503
+        if name == 's3' and self.MaxUploadSize and length > self.MaxUploadSize:
+            status = 413
+
+        with self.lock:
+            self.Requests[name] = self.Requests.get(name, 0) + 1
+            if status:
+                self.Faults[str(status)] = self.Faults.get(str(status), 0) + 1
+            else:
+                if name == 's3':
+                    self.BytesReceived += length
+                    self.Uploads += 1
+                elif name in ('batch', 'streamchunk', 'streamupdate', 'permissionsbatch'):
+                    # In Stream mode, a new chunk is asked after each upload
+                    self.Batches += 1
+
+        if status == 413:
+            self.__reply(p_Handler, status, {'code': 'EntityTooLarge', 'message': 'Your proposed upload exceeds the maximum allowed size'})
+        elif status:
+            self.__reply(p_Handler, status, {'message': 'Injected fault'})
+        elif name in ('files', 'streamchunk'):
+            self.__reply(p_Handler, 200, self.__container())
+        elif name == 'streamopen':
+            body = self.__container()
+            body['streamId'] = str(uuid.uuid4())
+            self.__reply(p_Handler, 200, body)
+        elif name == 's3':
+            self.__reply(p_Handler, 200)
+        else:
+            self.__reply(p_Handler, 202, {})
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Close(self):
+        """
+        Close.
+        Stops the server.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.Close()
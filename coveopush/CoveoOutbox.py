@@ -0,0 +1,462 @@
+# -------------------------------------------------------------------------------------
+# CoveoOutbox
+# -------------------------------------------------------------------------------------
+# Contains the Outbox and OutboxUploader classes
+#   Durable local queue between the producers of documents (Push.Add with SetOutbox) and
+#   the upload to the Push API: operations are appended to segment files (group commit),
+#   an uploader drains them into batches and removes the segments once acknowledged
+# -------------------------------------------------------------------------------------
+import glob
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+from .CoveoDocument import Document, DocumentToDelete, DocumentToUpdate, EncodeJson, Validate
+
+
+# ---------------------------------------------------------------------------------
+def Error(log, err):
+    log.logger.info(err)
+    raise Exception(err)
+
+# ---------------------------------------------------------------------------------
+
+
+class Outbox:
+    """
+    class Outbox.
+    Append-only queue of encoded operations (add, delete, update) in a directory:
+      <N>.seg:     segment files, records of [operation (1 byte), length (4 bytes), crc32 (4 bytes), JSON]
+      cursor.json: position (segment, offset) of the first operation which is not acknowledged yet
+    Appends are buffered and written by a commit thread: one write and one fsync for all the operations
+    appended in the mean time (group commit). Append(p_Wait=True), or Sync after a series of Append,
+    returns once the operations are on disk.
+    When opened, a torn record at the end of the last segment (crash during a write) is cut off.
+
+        outbox = Outbox('outbox')
+        push.SetOutbox(outbox)
+        uploader = OutboxUploader(outbox, CoveoPush.Push(sourceId, orgId, apiKey)).Start()
+        for event in events:
+            push.Add(document(event))
+        outbox.Sync()  # before acknowledging the events
+        ...
+        uploader.Stop()
+        outbox.Close()
+    """
+    s_Header = struct.Struct('>BII')
+    s_Operations = {'add': 1, 'delete': 2, 'update': 3}
+    s_Cursor = 'cursor.json'
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_Directory: str, p_SegmentSize: int = 64 * 1024 * 1024, p_MaxPendingBytes: int = 64 * 1024 * 1024,
+                 p_Sync: bool = True):
+        """
+        Outbox Constructor.
+        :arg p_Directory: str, directory of the queue (created when needed)
+        :arg p_SegmentSize: int, size after which a new segment file is started
+        :arg p_MaxPendingBytes: int, appends wait when more bytes are waiting for the commit thread
+        :arg p_Sync: bool (True), fsync each commit (False: only written to the OS, survives a crash of the process but not of the machine)
+        """
+        self.logger = logging.getLogger('CoveoOutbox')
+        self.Directory = p_Directory
+        self.SegmentSize = p_SegmentSize
+        self.MaxPendingBytes = p_MaxPendingBytes
+        self.SyncCommits = p_Sync
+        os.makedirs(p_Directory, exist_ok=True)
+
+        self.condition = threading.Condition()
+        # Appended, not yet written records
+        self.pending = []
+        self.pendingBytes = 0
+        self.appended = 0
+        self.committed = 0
+        self.closing = False
+        self.error = None
+
+        self.__recover()
+        self.thread = threading.Thread(target=self.__commitLoop, name='CoveoOutbox', daemon=True)
+        self.thread.start()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __segmentFile(self, p_Segment: int):
+        return os.path.join(self.Directory, '%012d.seg' % p_Segment)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __segments(self):
+        return sorted(int(os.path.basename(path)[:-4]) for path in glob.glob(os.path.join(self.Directory, '*.seg')))
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __scan(self, p_Data: bytes, p_Offset: int = 0):
+        # Offset after the last complete record
+        header = self.s_Header
+        offset = p_Offset
+        while offset + header.size <= len(p_Data):
+            __, length, crc = header.unpack_from(p_Data, offset)
+            end = offset + header.size + length
+            if end > len(p_Data) or zlib.crc32(p_Data[offset + header.size:end]) != crc:
+                break
+            offset = end
+        return offset
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __recover(self):
+        segments = self.__segments()
+        cursorFile = os.path.join(self.Directory, self.s_Cursor)
+        if os.path.isfile(cursorFile):
+            with open(cursorFile, mode='r', encoding='utf-8') as file:
+                cursor = json.load(file)
+            self.Cursor = (cursor['segment'], cursor['offset'])
+        else:
+            self.Cursor = (segments[0] if segments else 1, 0)
+
+        if segments:
+            segment = segments[-1]
+            with open(self.__segmentFile(segment), mode='rb') as file:
+                data = file.read()
+            end = self.__scan(data)
+            if end < len(data):
+                self.logger.warning('Outbox ' + self.Directory + ': ' + str(len(data) - end) + ' bytes of an incomplete record removed')
+                with open(self.__segmentFile(segment), mode='r+b') as file:
+                    file.truncate(end)
+        else:
+            segment = self.Cursor[0]
+            end = 0
+        self.segment = segment
+        self.file = open(self.__segmentFile(segment), mode='ab')
+        self.offset = end
+        # Position up to which the records are on disk
+        self.CommittedPosition = (segment, end)
+        self.readPosition = self.Cursor
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Append(self, p_Operation: str, p_Encoded: bytes, p_Wait: bool = False):
+        """
+        Append.
+        Appends an operation.
+        :arg p_Operation: str, add, delete or update
+        :arg p_Encoded: bytes, JSON of the document (Document.ToEncodedJson, EncodeJson)
+        :arg p_Wait: bool (False), wait until the operation is on disk
+        returns: int, sequence number of the operation (see Sync)
+        """
+        record = self.s_Header.pack(self.s_Operations[p_Operation], len(p_Encoded), zlib.crc32(p_Encoded)) + p_Encoded
+        with self.condition:
+            if self.error is not None:
+                Error(self, 'Outbox: commit failed, ' + str(self.error))
+            if self.closing:
+                Error(self, 'Outbox: closed')
+            while self.pendingBytes > self.MaxPendingBytes and self.error is None:
+                self.condition.wait()
+            self.pending.append(record)
+            self.pendingBytes += len(record)
+            self.appended += 1
+            sequence = self.appended
+            if len(self.pending) == 1:
+                self.condition.notify_all()
+        if p_Wait:
+            self.Sync(sequence)
+        return sequence
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Add(self, p_Document, p_Wait: bool = False):
+        """
+        Add.
+        Appends a Document (add), DocumentToDelete (delete) or DocumentToUpdate (update), or a JSON document (dict, add).
+        """
+        if type(p_Document) is DocumentToDelete:
+            return self.Append('delete', EncodeJson(p_Document.ToJson()), p_Wait)
+        if type(p_Document) is DocumentToUpdate:
+            return self.Append('update', EncodeJson(p_Document.ToJson()), p_Wait)
+        if isinstance(p_Document, Document):
+            valid, error = Validate(p_Document)
+            if not valid:
+                Error(self, "Add: " + p_Document.DocumentId + ", " + error)
+            return self.Append('add', p_Document.ToEncodedJson(), p_Wait)
+        return self.Append('add', EncodeJson(p_Document), p_Wait)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Sync(self, p_Sequence: int = None):
+        """
+        Sync.
+        Waits until the operations appended so far (or up to sequence p_Sequence) are on disk.
+        """
+        with self.condition:
+            sequence = self.appended if p_Sequence is None else p_Sequence
+            while self.committed < sequence and self.error is None:
+                self.condition.wait()
+            if self.error is not None:
+                Error(self, 'Outbox: commit failed, ' + str(self.error))
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __commitLoop(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closing:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                records = self.pending
+                sequence = self.appended
+                self.pending = []
+                self.pendingBytes = 0
+                self.condition.notify_all()
+            try:
+                self.__write(records)
+            except Exception as e:
+                self.logger.error('Outbox: commit failed, ' + str(e))
+                with self.condition:
+                    self.error = e
+                    self.condition.notify_all()
+                return
+            with self.condition:
+                self.committed = sequence
+                self.CommittedPosition = (self.segment, self.offset)
+                self.condition.notify_all()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __write(self, p_Records: []):
+        start = 0
+        size = 0
+        for nr, record in enumerate(p_Records):
+            if self.offset + size > 0 and self.offset + size + len(record) > self.SegmentSize:
+                # Next segment, the current one is complete
+                self.__flush(p_Records[start:nr], size)
+                self.file.close()
+                self.segment += 1
+                self.offset = 0
+                self.file = open(self.__segmentFile(self.segment), mode='ab')
+                start = nr
+                size = 0
+            size += len(record)
+        self.__flush(p_Records[start:], size)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __flush(self, p_Records: [], p_Size: int):
+        if p_Records:
+            self.file.write(b''.join(p_Records))
+        self.file.flush()
+        if self.SyncCommits:
+            os.fsync(self.file.fileno())
+        self.offset += p_Size
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Wait(self, p_Timeout: float = None):
+        """
+        Wait.
+        Waits until there are operations to read.
+        returns: bool, if there are operations to read
+        """
+        with self.condition:
+            if self.CommittedPosition == self.readPosition:
+                self.condition.wait(p_Timeout)
+            return self.CommittedPosition != self.readPosition
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Read(self, p_MaxBytes: int):
+        """
+        Read.
+        Reads the next operations which are on disk, from the last read (or acknowledged) position.
+        :arg p_MaxBytes: int, operations are returned until their JSON (with a separator) would exceed p_MaxBytes
+        returns: (list of (operation, bytes), position to acknowledge once the operations are uploaded)
+        """
+        header = self.s_Header
+        names = {value: name for name, value in self.s_Operations.items()}
+        with self.condition:
+            committed = self.CommittedPosition
+        segment, offset = self.readPosition
+        operations = []
+        size = 0
+        while (segment, offset) < committed:
+            path = self.__segmentFile(segment)
+            limit = committed[1] if segment == committed[0] else os.path.getsize(path)
+            if offset >= limit:
+                segment += 1
+                offset = 0
+                continue
+            full = False
+            with open(path, mode='rb') as file:
+                file.seek(offset)
+                while offset < limit:
+                    operation, length, __ = header.unpack(file.read(header.size))
+                    if operations and size + length + 1 > p_MaxBytes:
+                        full = True
+                        break
+                    operations.append((names[operation], file.read(length)))
+                    size += length + 1
+                    offset += header.size + length
+            if full:
+                break
+        self.readPosition = (segment, offset)
+        return operations, (segment, offset)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Acknowledge(self, p_Position: tuple):
+        """
+        Acknowledge.
+        The operations before p_Position (returned by Read) were uploaded: records the cursor and
+        removes the segments which were completely uploaded.
+        """
+        cursorFile = os.path.join(self.Directory, self.s_Cursor)
+        temporaryFile = cursorFile + '.tmp'
+        with open(temporaryFile, mode='w', encoding='utf-8') as file:
+            json.dump({'segment': p_Position[0], 'offset': p_Position[1]}, file)
+            file.flush()
+            if self.SyncCommits:
+                os.fsync(file.fileno())
+        os.replace(temporaryFile, cursorFile)
+        self.Cursor = p_Position
+        for segment in self.__segments():
+            if segment < p_Position[0]:
+                os.remove(self.__segmentFile(segment))
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Rewind(self):
+        """
+        Rewind.
+        Reads again from the acknowledged position (after a failed upload).
+        """
+        self.readPosition = self.Cursor
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Pending(self):
+        """
+        Pending.
+        returns: int, bytes on disk which are not acknowledged yet
+        """
+        with self.condition:
+            committed = self.CommittedPosition
+        total = 0
+        for segment in self.__segments():
+            if segment < self.Cursor[0] or segment > committed[0]:
+                continue
+            size = committed[1] if segment == committed[0] else os.path.getsize(self.__segmentFile(segment))
+            total += size - (self.Cursor[1] if segment == self.Cursor[0] else 0)
+        return total
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Close(self):
+        """
+        Close.
+        Writes the pending operations and stops the commit thread.
+        """
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.Close()
+
+# ---------------------------------------------------------------------------------
+
+
+class OutboxUploader:
+    """
+    class OutboxUploader.
+    Drains an Outbox into batches of a Push (Push or UpdateStream mode, or Stream mode between Start and End),
+    in a background thread. A batch is uploaded when it is full or when its first operation waited p_MaxDelay;
+    the operations are acknowledged (removed from the outbox) once the Push API accepted the batch.
+    A failed upload is retried after p_RetryDelay: the operations stay in the outbox, also when the process stops.
+    """
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_Outbox: Outbox, p_Push, p_MaxDelay: float = 1.0, p_RetryDelay: float = 30.0):
+        """
+        OutboxUploader Constructor.
+        :arg p_Outbox: Outbox
+        :arg p_Push: CoveoPush.Push, the batches are uploaded with its UploadBatch
+        :arg p_MaxDelay: float, seconds an operation can wait for a batch to fill
+        :arg p_RetryDelay: float, seconds before a failed batch is uploaded again
+        """
+        self.logger = logging.getLogger('CoveoOutbox')
+        self.Outbox = p_Outbox
+        self.Push = p_Push
+        self.MaxDelay = p_MaxDelay
+        self.RetryDelay = p_RetryDelay
+        self.Batches = 0
+        self.Operations = 0
+        self.Errors = 0
+        self.stopping = threading.Event()
+        self.thread = None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Drain(self):
+        """
+        Drain.
+        Uploads all operations which are on disk now (in the calling thread).
+        returns: int, operations uploaded
+        """
+        uploaded = 0
+        while True:
+            operations, position = self.Outbox.Read(self.Push.GetSizeMaxBatch())
+            if not operations:
+                return uploaded
+            self.__upload(operations, position)
+            uploaded += len(operations)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __upload(self, p_Operations: [], p_Position: tuple):
+        batch = {'add': [], 'delete': [], 'update': []}
+        for operation, encoded in p_Operations:
+            batch[operation].append(encoded)
+        try:
+            self.Push.UploadBatch(batch['add'], batch['delete'], batch['update'])
+        except Exception:
+            self.Outbox.Rewind()
+            raise
+        self.Outbox.Acknowledge(p_Position)
+        self.Batches += 1
+        self.Operations += len(p_Operations)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __loop(self):
+        maxBytes = self.Push.GetSizeMaxBatch()
+        while not self.stopping.is_set():
+            if not self.Outbox.Wait(self.MaxDelay):
+                continue
+            # Let the batch fill, unless it is already full
+            deadline = time.monotonic() + self.MaxDelay
+            while not self.stopping.is_set() and time.monotonic() < deadline and self.Outbox.Pending() < maxBytes:
+                self.stopping.wait(min(0.05, self.MaxDelay))
+            operations, position = self.Outbox.Read(maxBytes)
+            if not operations:
+                continue
+            try:
+                self.__upload(operations, position)
+            except Exception as e:
+                self.Errors += 1
+                self.logger.error('OutboxUploader: upload failed, retrying in ' + str(self.RetryDelay) + 's: ' + str(e))
+                self.stopping.wait(self.RetryDelay)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Start(self):
+        """
+        Start.
+        Starts the background upload.
+        """
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.__loop, name='CoveoOutboxUploader', daemon=True)
+        self.thread.start()
+        return self
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Stop(self, p_Drain: bool = True):
+        """
+        Stop.
+        Stops the background upload.
+        :arg p_Drain: bool (True), then uploads the operations which are left (written before Stop)
+        """
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if p_Drain:
+            self.Outbox.Sync()
+            self.Drain()
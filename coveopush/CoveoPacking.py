@@ -0,0 +1,197 @@
+# -------------------------------------------------------------------------------------
+# CoveoPacking
+# -------------------------------------------------------------------------------------
+# Contains the BatchPacker class
+#   Packs the documents of a batch push into fewer, fuller batches (see Push.SetPacking):
+#   best-fit over a few open batches, or first-fit-decreasing over a lookahead window
+# -------------------------------------------------------------------------------------
+import logging
+
+from .CoveoJsonLines import s_DocumentIdPattern
+
+
+# ---------------------------------------------------------------------------------
+def Error(log, err):
+    log.logger.info(err)
+    raise Exception(err)
+
+# ---------------------------------------------------------------------------------
+
+
+class PackedBatch:
+    """
+    class PackedBatch.
+    An open batch: encoded documents per operation, size and document ids.
+    """
+    __slots__ = ('Add', 'Delete', 'Update', 'Size', 'Ids')
+
+    def __init__(self):
+        self.Add = []
+        self.Delete = []
+        self.Update = []
+        self.Size = 0
+        self.Ids = set()
+
+    def Count(self):
+        return len(self.Add) + len(self.Delete) + len(self.Update)
+
+# ---------------------------------------------------------------------------------
+
+
+class BatchPacker:
+    """
+    class BatchPacker.
+    Places the documents into up to p_Bins open batches instead of flushing in arrival order:
+      bestfit: each document goes into the open batch it fills the most
+      ffd:     the documents are kept in a window of p_Window documents, which is placed largest first (first-fit-decreasing)
+    When a document fits in no open batch and p_Bins batches are open, the fullest batch is closed.
+    A document with the same DocumentId as a document which is still pending (an earlier add, delete or update)
+    is only placed after the batch holding the earlier one was closed: operations on one document keep their order,
+    as long as the closed batches are uploaded in the order they are returned.
+    The packer does not upload: Add and Flush return the closed batches, which the caller uploads (outside of its lock).
+    Used by Push.Add/AddJson/AddEncoded/ProcessAndUploadBatch after Push.SetPacking.
+    """
+    s_Strategies = ('bestfit', 'ffd')
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_Push, p_Strategy: str = 'bestfit', p_Bins: int = 4, p_Window: int = 1000):
+        """
+        BatchPacker Constructor.
+        :arg p_Push: CoveoPush.Push, gives the max size (GetSizeMaxBatch)
+        :arg p_Strategy: str, bestfit or ffd
+        :arg p_Bins: int, max number of open batches (memory: p_Bins times the max request size)
+        :arg p_Window: int, documents in the lookahead window (ffd)
+        """
+        self.logger = logging.getLogger('CoveoPacking')
+        if p_Strategy not in self.s_Strategies:
+            Error(self, "BatchPacker: unknown strategy " + str(p_Strategy) + ", use one of " + ', '.join(self.s_Strategies))
+        if p_Bins < 1:
+            Error(self, "BatchPacker: p_Bins must be at least 1")
+        self.Push = p_Push
+        self.Strategy = p_Strategy
+        self.MaxBins = p_Bins
+        self.WindowSize = max(p_Window, 1)
+        self.Bins = []
+        # (operation, documentId, encoded) waiting to be placed (ffd)
+        self.Window = []
+        self.windowIds = set()
+        # Closed batches, not returned yet
+        self.closed = []
+        self.Batches = 0
+        self.Bytes = 0
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    @staticmethod
+    def GetDocumentId(p_Encoded: bytes):
+        """
+        GetDocumentId.
+        returns: str, the documentId of an encoded document, or None
+        """
+        match = s_DocumentIdPattern.search(p_Encoded)
+        return match.group(1).decode('utf-8', errors='replace') if match else None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __fits(self, p_Batch: PackedBatch, p_Size: int, p_MaxSize: int):
+        # Same accounting as Push.Add: the documents with one separator each (see Push.GetSizeMaxBatch)
+        return p_Batch.Size + p_Size <= p_MaxSize
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __close(self, p_Batch: PackedBatch):
+        self.Bins.remove(p_Batch)
+        self.Batches += 1
+        self.Bytes += p_Batch.Size
+        self.closed.append(p_Batch)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __takeClosed(self):
+        closed = self.closed
+        self.closed = []
+        return closed
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __place(self, p_Operation: str, p_DocumentId, p_Encoded: bytes, p_FirstFit: bool):
+        size = len(p_Encoded) + 1
+        maxSize = self.Push.GetSizeMaxBatch()
+        if size > maxSize:
+            Error(self, "No document can be larger than " + str(maxSize) + " bytes in size.")
+
+        if p_DocumentId is not None:
+            for batch in self.Bins:
+                if p_DocumentId in batch.Ids:
+                    # The earlier operation on this document goes first
+                    self.__close(batch)
+                    break
+
+        target = None
+        for batch in self.Bins:
+            if self.__fits(batch, size, maxSize) and (target is None or batch.Size > target.Size):
+                target = batch
+                if p_FirstFit:
+                    break
+        if target is None:
+            if len(self.Bins) >= self.MaxBins:
+                self.__close(max(self.Bins, key=lambda batch: batch.Size))
+            target = PackedBatch()
+            self.Bins.append(target)
+
+        if p_Operation == 'delete':
+            target.Delete.append(p_Encoded)
+        elif p_Operation == 'update':
+            target.Update.append(p_Encoded)
+        else:
+            target.Add.append(p_Encoded)
+        target.Size += size
+        if p_DocumentId is not None:
+            target.Ids.add(p_DocumentId)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __placeWindow(self):
+        # Largest first; sorted is stable, so equal sizes keep their order
+        for operation, documentId, encoded in sorted(self.Window, key=lambda item: len(item[2]), reverse=True):
+            self.__place(operation, documentId, encoded, True)
+        self.Window = []
+        self.windowIds = set()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Add(self, p_Operation: str, p_DocumentId, p_Encoded: bytes):
+        """
+        Add.
+        Adds an encoded document.
+        :arg p_Operation: str, add, delete or update
+        :arg p_DocumentId: the document id (None when unknown: no ordering check)
+        :arg p_Encoded: bytes, JSON of the document
+        returns: list of PackedBatch, the batches closed by this document, to upload in this order
+        """
+        if self.Strategy == 'bestfit':
+            self.__place(p_Operation, p_DocumentId, p_Encoded, False)
+            return self.__takeClosed()
+
+        if p_DocumentId is not None and p_DocumentId in self.windowIds:
+            # The window is placed first, then the earlier operation is uploaded when placing this one
+            self.__placeWindow()
+        self.Window.append((p_Operation, p_DocumentId, p_Encoded))
+        if p_DocumentId is not None:
+            self.windowIds.add(p_DocumentId)
+        if len(self.Window) >= self.WindowSize:
+            self.__placeWindow()
+        return self.__takeClosed()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Flush(self):
+        """
+        Flush.
+        Places the window and closes all open batches.
+        returns: list of PackedBatch, the closed batches, to upload in this order
+        """
+        self.__placeWindow()
+        while self.Bins:
+            self.__close(self.Bins[0])
+        return self.__takeClosed()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Pending(self):
+        """
+        Pending.
+        returns: int, documents which are not in a closed batch yet
+        """
+        return len(self.Window) + sum(batch.Count() for batch in self.Bins)
@@ -4,6 +4,7 @@
 # Contains the Permissions which are used inside the CoveoDocument
 #   PermissionSets, PermisionLevels and Permissions
 # -------------------------------------------------------------------------------------
+import json
 from enum import Enum
 from .CoveoConstants import Constants
 
@@ -381,3 +382,99 @@ class SecurityProvider:
     type = ''
     referencedBy = []
     cascadingSecurityProviders = {}
+
+
+# ---------------------------------------------------------------------------------
+class PermissionModel:
+    """
+    class PermissionModel.
+    Holds a permission model (list of DocumentPermissionLevel) and its encoded JSON.
+    A model is shared by all documents using it (see PermissionModelRegistry), it must not be changed.
+    """
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_Levels: []):
+        """
+        class PermissionModel constructor.
+        :arg p_Levels: list of DocumentPermissionLevel
+        """
+        self.Levels = p_Levels
+        self.Encoded = json.dumps(p_Levels, default=str).encode('utf-8')
+
+
+# ---------------------------------------------------------------------------------
+class PermissionModelRegistry:
+    """
+    class PermissionModelRegistry.
+    Interns permission models: identical models are only created and encoded once.
+    Documents reference the shared model with Document.SetPermissionModel.
+
+        registry = PermissionModelRegistry()
+        mydoc.SetPermissionModel(registry.GetModel([myperm], [], True))
+    """
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self):
+        self.Models = {}
+        self.Hits = 0
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __len__(self):
+        return len(self.Models)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __identityKey(self, p_Identity: PermissionIdentity):
+        additionalInfo = p_Identity['AdditionalInfo']
+        return (p_Identity['identityType'], p_Identity['securityProvider'], p_Identity['identity'],
+                json.dumps(additionalInfo, sort_keys=True, default=str) if additionalInfo else '')
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def GetModel(self, p_AllowedPermissions: [], p_DeniedPermissions: [], p_AllowAnonymous: bool = False):
+        """
+        GetModel.
+        Returns the shared model for the permissions (same model as Document.SetAllowedAndDeniedPermissions).
+        The order of the identities does not matter.
+        :arg p_AllowedPermissions: list of PermissionIdentities which have access
+        :arg p_DeniedPermissions: list of PermissionIdentities which do NOT have access
+        :arg p_AllowAnonymous: (def: False) if Anonymous access is allowed
+        returns: PermissionModel
+        """
+        if (p_AllowedPermissions == None):
+            Error(self, "GetModel: AllowedPermissions not set")
+        if (p_DeniedPermissions == None):
+            Error(self, "GetModel: DeniedPermissions not set")
+
+        key = (bool(p_AllowAnonymous),
+               frozenset([self.__identityKey(identity) for identity in p_AllowedPermissions]),
+               frozenset([self.__identityKey(identity) for identity in p_DeniedPermissions]))
+        model = self.Models.get(key)
+        if model is not None:
+            self.Hits += 1
+            return model
+
+        simplePermissionLevel = DocumentPermissionLevel('Level1')
+
+        simplePermissionSet = DocumentPermissionSet('Set1')
+        simplePermissionSet.AddAllowedPermissions(list(p_AllowedPermissions))
+        simplePermissionSet.AddDeniedPermissions(list(p_DeniedPermissions))
+        simplePermissionSet.SetAnonymousPermissions(p_AllowAnonymous)
+
+        simplePermissionLevel.AddPermissionSet(simplePermissionSet)
+
+        return self.Models.setdefault(key, PermissionModel([simplePermissionLevel]))
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Intern(self, p_Levels: []):
+        """
+        Intern.
+        Returns the shared model for a complex permission model (list of DocumentPermissionLevel).
+        :arg p_Levels: list of DocumentPermissionLevel
+        returns: PermissionModel
+        """
+        key = json.dumps(p_Levels, sort_keys=True, default=str)
+        model = self.Models.get(key)
+        if model is not None:
+            self.Hits += 1
+            return model
+
+        return self.Models.setdefault(key, PermissionModel(p_Levels))
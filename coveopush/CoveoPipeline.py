@@ -0,0 +1,370 @@
+# -------------------------------------------------------------------------------------
+# CoveoPipeline
+# -------------------------------------------------------------------------------------
+# Contains the Pipeline and PipelineStage classes
+#   Document preparation in stages (read, build, compress, serialize...) connected by
+#   bounded queues, each stage with its own thread or process pool, a Push as the sink
+# -------------------------------------------------------------------------------------
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .CoveoConstants import Constants
+from .CoveoDocument import Document, Validate
+from .CoveoPush import Push
+
+
+# ---------------------------------------------------------------------------------
+def Error(log, err):
+    log.logger.info(err)
+    raise Exception(err)
+
+# ---------------------------------------------------------------------------------
+
+
+def SerializeDocument(p_Document):
+    """
+    SerializeDocument.
+    Stage function (can run in a process pool): validates and encodes a Document, the Push sink adds it with AddEncoded.
+    Deletes, updates and documents with a payload too large for a batch (see Push.SetOffload) are returned as is.
+    """
+    if type(p_Document) is not Document or \
+            len(p_Document.Data) + len(p_Document.CompressedBinaryData) > Constants.COMPRESSED_DATA_MAX_SIZE_IN_BYTES:
+        return p_Document
+    valid, error = Validate(p_Document)
+    if not valid:
+        raise Exception("SerializeDocument: " + p_Document.DocumentId + ", " + error)
+    return p_Document.ToEncodedJson()
+
+
+def PushSink(p_Push: Push):
+    """
+    PushSink.
+    returns: a sink which adds the items to the batch of p_Push: bytes with AddEncoded, dict with AddJson, documents with Add
+    """
+    def sink(p_Item):
+        if isinstance(p_Item, bytes):
+            p_Push.AddEncoded(p_Item)
+        elif isinstance(p_Item, dict):
+            p_Push.AddJson(p_Item)
+        else:
+            p_Push.Add(p_Item)
+    return sink
+
+# ---------------------------------------------------------------------------------
+
+
+class PipelineStage:
+    """
+    class PipelineStage.
+    A stage of a Pipeline: p_Function applied to each item by p_Workers threads, or by a pool of p_Workers
+    processes (CPU bound work: zlib, hashing, JSON; the function and the items must be picklable).
+    The function returns the next item, None to drop the item, or with p_Many an iterable of items.
+    Counters: items in and out, errors, busy seconds (summed over the workers).
+    """
+    s_Kinds = ('thread', 'process')
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_Name: str, p_Function, p_Workers: int = 1, p_Kind: str = 'thread', p_Many: bool = False):
+        """
+        PipelineStage Constructor.
+        :arg p_Name: str, name of the stage (in the statistics)
+        :arg p_Function: callable(item), returns the next item, None, or an iterable of items (p_Many)
+        :arg p_Workers: int, threads or processes
+        :arg p_Kind: str, thread (I/O bound) or process (CPU bound)
+        :arg p_Many: bool, if the function returns an iterable of items
+        """
+        self.logger = logging.getLogger('CoveoPipeline')
+        if p_Kind not in self.s_Kinds:
+            Error(self, "PipelineStage: unknown kind " + str(p_Kind) + ", use one of " + ', '.join(self.s_Kinds))
+        if p_Workers < 1:
+            Error(self, "PipelineStage: p_Workers must be at least 1")
+        self.Name = p_Name
+        self.Function = p_Function
+        self.Workers = p_Workers
+        self.Kind = p_Kind
+        self.Many = p_Many
+        self.lock = threading.Lock()
+        self.Reset()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Reset(self):
+        with self.lock:
+            self.In = 0
+            self.Out = 0
+            self.Errors = 0
+            self.Seconds = 0.0
+            self.finished = 0
+        self.Queue = None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Count(self, p_In: int, p_Out: int, p_Errors: int, p_Seconds: float):
+        with self.lock:
+            self.In += p_In
+            self.Out += p_Out
+            self.Errors += p_Errors
+            self.Seconds += p_Seconds
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def ToJson(self, p_WallSeconds: float):
+        with self.lock:
+            return {
+                'name': self.Name,
+                'kind': self.Kind,
+                'workers': self.Workers,
+                'in': self.In,
+                'out': self.Out,
+                'errors': self.Errors,
+                'busySeconds': round(self.Seconds, 3),
+                'itemsPerSecond': round(self.In / p_WallSeconds, 1) if p_WallSeconds > 0 else 0.0,
+                # Items waiting for this stage: a full queue shows the bottleneck is here (or after)
+                'queued': self.Queue.qsize() if self.Queue is not None else 0
+            }
+
+# ---------------------------------------------------------------------------------
+
+
+class Pipeline:
+    """
+    class Pipeline.
+    Stages connected by bounded queues (p_QueueSize items), the source is read by a thread, the sink runs in the
+    thread calling Run. A full queue blocks the stage before it, so memory stays bounded.
+
+        pipeline = Pipeline()
+        pipeline.AddStage('read', readFile, p_Workers=8)
+        pipeline.AddStage('build', buildDocument, p_Workers=2)
+        pipeline.AddStage('compress', compressDocument, p_Workers=4, p_Kind='process')
+        pipeline.AddStage('serialize', SerializeDocument, p_Workers=4, p_Kind='process')
+        push.Start()
+        pipeline.Run(paths, push)
+        push.End()
+        print(pipeline.Report())
+
+    With more than one worker, a stage does not keep the order of the items.
+    Errors: with p_OnError='raise', the first error cancels the pipeline and is raised by Run;
+    with 'skip', the item is dropped and counted in the errors of its stage. A failed batch upload of a Push sink
+    (see Push.Failed) always cancels the pipeline: it drops a whole batch of documents, not one item.
+    Cancel (from another thread) stops the stages, Run returns the statistics with cancelled set.
+    """
+    s_OnError = ('raise', 'skip')
+    # End of the items, one per worker of the next stage
+    s_End = object()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_QueueSize: int = 1000, p_OnError: str = 'raise'):
+        """
+        Pipeline Constructor.
+        :arg p_QueueSize: int, max items waiting in front of each stage
+        :arg p_OnError: str, raise or skip
+        """
+        self.logger = logging.getLogger('CoveoPipeline')
+        if p_OnError not in self.s_OnError:
+            Error(self, "Pipeline: unknown p_OnError " + str(p_OnError) + ", use one of " + ', '.join(self.s_OnError))
+        self.QueueSize = max(p_QueueSize, 1)
+        self.OnError = p_OnError
+        self.Stages = []
+        self.cancelled = threading.Event()
+        self.error = None
+        # Push of the sink, and its failed batches at the start of Run
+        self.push = None
+        self.pushFailed = 0
+        self.startTime = None
+        self.endTime = None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def AddStage(self, p_Name: str, p_Function, p_Workers: int = 1, p_Kind: str = 'thread', p_Many: bool = False):
+        """
+        AddStage.
+        Adds a stage after the last one, see PipelineStage.
+        returns: the PipelineStage
+        """
+        stage = PipelineStage(p_Name, p_Function, p_Workers, p_Kind, p_Many)
+        self.Stages.append(stage)
+        return stage
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Cancel(self):
+        """
+        Cancel.
+        Stops the stages, the items in the queues are dropped.
+        """
+        self.cancelled.set()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __fail(self, p_Stage: PipelineStage, p_Error: Exception):
+        uploadFailed = p_Stage is self.sink and self.push is not None and len(self.push.Failed) > self.pushFailed
+        if self.OnError == 'skip' and not uploadFailed:
+            self.logger.warning('Pipeline stage ' + p_Stage.Name + ': ' + repr(p_Error) + ', item skipped')
+            return
+        if self.error is None:
+            self.error = p_Error
+            self.logger.error('Pipeline stage ' + p_Stage.Name + ': ' + repr(p_Error) + ', cancelled')
+        self.cancelled.set()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __put(self, p_Queue: queue.Queue, p_Item):
+        # Blocks while the queue is full, returns False when cancelled
+        while not self.cancelled.is_set():
+            try:
+                p_Queue.put(p_Item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __get(self, p_Queue: queue.Queue):
+        # Blocks while the queue is empty, returns s_End when cancelled
+        while not self.cancelled.is_set():
+            try:
+                return p_Queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return self.s_End
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __feed(self, p_Source, p_Queue: queue.Queue, p_Workers: int):
+        try:
+            for item in p_Source:
+                if not self.__put(p_Queue, item):
+                    return
+        except Exception as e:
+            # The source can not go on after an error: always cancels
+            if self.error is None:
+                self.error = e
+                self.logger.error('Pipeline source: ' + repr(e) + ', cancelled')
+            self.cancelled.set()
+            return
+        for __ in range(p_Workers):
+            self.__put(p_Queue, self.s_End)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __work(self, p_Stage: PipelineStage, p_Executor, p_Output: queue.Queue, p_NextWorkers: int):
+        while True:
+            item = self.__get(p_Stage.Queue)
+            if item is self.s_End:
+                break
+            start = time.perf_counter()
+            try:
+                if p_Executor is not None:
+                    result = p_Executor.submit(p_Stage.Function, item).result()
+                else:
+                    result = p_Stage.Function(item)
+                if p_Stage.Many:
+                    results = result if result is not None else ()
+                else:
+                    results = (result,) if result is not None else ()
+                out = 0
+                for result in results:
+                    if result is not None:
+                        if not self.__put(p_Output, result):
+                            break
+                        out += 1
+                p_Stage.Count(1, out, 0, time.perf_counter() - start)
+            except Exception as e:
+                p_Stage.Count(1, 0, 1, time.perf_counter() - start)
+                self.__fail(p_Stage, e)
+
+        # The last worker of the stage ends the next stage
+        with p_Stage.lock:
+            p_Stage.finished += 1
+            last = p_Stage.finished == p_Stage.Workers
+        if last and not self.cancelled.is_set():
+            for __ in range(p_NextWorkers):
+                self.__put(p_Output, self.s_End)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Run(self, p_Source, p_Sink=None):
+        """
+        Run.
+        Runs the items of p_Source through the stages into p_Sink, until the source is exhausted, an error (raise) or Cancel.
+        :arg p_Source: iterable of items (read by a thread)
+        :arg p_Sink: Push (see PushSink, Start and End are called by the caller), callable(item) or None (results dropped)
+        returns: dict, the statistics (see Stats); raises the first error (p_OnError='raise')
+        """
+        self.push = p_Sink if isinstance(p_Sink, Push) else None
+        self.pushFailed = len(self.push.Failed) if self.push is not None else 0
+        if self.push is not None:
+            p_Sink = PushSink(self.push)
+
+        def consume(p_Item):
+            # The results of the sink are dropped
+            if p_Sink is not None:
+                p_Sink(p_Item)
+
+        sink = PipelineStage('sink', consume)
+        stages = self.Stages + [sink]
+        for stage in stages:
+            stage.Reset()
+            stage.Queue = queue.Queue(self.QueueSize)
+        self.cancelled.clear()
+        self.error = None
+        self.sink = sink
+        self.startTime = time.perf_counter()
+        self.endTime = None
+
+        executors = []
+        threads = [threading.Thread(target=self.__feed, args=(p_Source, stages[0].Queue, stages[0].Workers),
+                                    name='CoveoPipeline-source', daemon=True)]
+        for number, stage in enumerate(self.Stages):
+            executor = None
+            if stage.Kind == 'process':
+                executor = ProcessPoolExecutor(max_workers=stage.Workers)
+                executors.append(executor)
+            following = stages[number + 1]
+            for worker in range(stage.Workers):
+                threads.append(threading.Thread(target=self.__work, args=(stage, executor, following.Queue, following.Workers),
+                                                name='CoveoPipeline-' + stage.Name + '-' + str(worker), daemon=True))
+        completed = False
+        try:
+            for thread in threads:
+                thread.start()
+            # The sink, in this thread
+            self.__work(sink, None, None, 0)
+            completed = True
+        finally:
+            if not completed:
+                # For example KeyboardInterrupt: stops the stages
+                self.cancelled.set()
+            for thread in threads:
+                thread.join()
+            for executor in executors:
+                executor.shutdown(wait=True, cancel_futures=True)
+            self.endTime = time.perf_counter()
+
+        stats = self.Stats()
+        if self.error is not None:
+            raise self.error
+        return stats
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Stats(self):
+        """
+        Stats.
+        returns: dict, wall seconds, cancelled, and per stage (sink included): items in and out, errors,
+                 busy seconds, items per second and queued items. Can be called while Run is running.
+        """
+        if self.startTime is None:
+            return {'wallSeconds': 0.0, 'cancelled': False, 'stages': []}
+        wall = (self.endTime or time.perf_counter()) - self.startTime
+        return {
+            'wallSeconds': round(wall, 3),
+            'cancelled': self.cancelled.is_set(),
+            'stages': [stage.ToJson(wall) for stage in self.Stages + [self.sink]]
+        }
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Report(self):
+        """
+        Report.
+        returns: str, one line per stage
+        """
+        stats = self.Stats()
+        lines = ['wall: {:.3f}s{}'.format(stats['wallSeconds'], ', cancelled' if stats['cancelled'] else '')]
+        for stage in stats['stages']:
+            lines.append('{}: {} x {}, {} in, {} out, {} errors, {:.3f}s busy, {}/s, {} queued'.format(
+                stage['name'], stage['workers'], stage['kind'], stage['in'], stage['out'], stage['errors'],
+                stage['busySeconds'], stage['itemsPerSecond'], stage['queued']))
+        return '\n'.join(lines)
@@ -0,0 +1,261 @@
+# -------------------------------------------------------------------------------------
+# CoveoPlan
+# -------------------------------------------------------------------------------------
+# Contains the PushPlan class
+#   Dry run of a push (see Push.SetDryRun): the documents are prepared and batched as usual,
+#   but no request is sent. The plan holds the batches, the calls which would be made
+#   and the bytes per field, to size the workers and to spot bloated metadata
+# -------------------------------------------------------------------------------------
+import json
+import logging
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+from .CoveoConstants import Constants
+from .CoveoDocument import EncodeJson
+from .CoveoMockServer import MockPushApi
+
+
+# ---------------------------------------------------------------------------------
+class PlannedResponse:
+    """
+    class PlannedResponse.
+    Answer of a request which was not sent (dry run), with the fields the Push class reads.
+    """
+    __slots__ = ('status_code', 'text')
+
+    def __init__(self, p_Status: int, p_Body: {} = None):
+        self.status_code = p_Status
+        self.text = json.dumps(p_Body) if p_Body is not None else ''
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        pass
+
+# ---------------------------------------------------------------------------------
+
+
+class PushPlan:
+    """
+    class PushPlan.
+    Records what a push would do, without network I/O:
+      batches:   documents (added, deleted, updated) and bytes of each batch upload
+      requests:  calls per route (the route names of MockPushApi), and their bytes
+      fields:    bytes of each field (metadata) over all documents, as written in the batches
+      oversized: documents with more than COMPRESSED_DATA_MAX_SIZE_IN_BYTES of data
+
+        plan = push.SetDryRun()
+        push.Start()
+        ...
+        push.End()
+        print(plan.Report(p_MBPerSecond=20, p_SecondsPerBatch=1.5))
+    """
+    s_UploadUri = 'https://dryrun.invalid/s3/'
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_MaxOversized: int = 20):
+        """
+        PushPlan Constructor.
+        :arg p_MaxOversized: int, number of oversized document ids which are kept
+        """
+        self.logger = logging.getLogger('CoveoPlan')
+        self.MaxOversized = p_MaxOversized
+        self.routes = [(method, name, re.compile(pattern)) for method, name, pattern in MockPushApi.s_Routes]
+        self.lock = threading.Lock()
+        self.Reset()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Reset(self):
+        """
+        Reset.
+        Clears the plan.
+        """
+        with self.lock:
+            # One (mode, added, deleted, updated, bytes) tuple per batch upload
+            self.Batches = []
+            # route -> [count, bytes]
+            self.Requests = {}
+            # field -> [documents, bytes]
+            self.Fields = {}
+            self.Documents = 0
+            self.DocumentBytes = 0
+            self.Oversized = 0
+            self.OversizedIds = []
+            self.containers = 0
+            self.StartTime = None
+            self.EndTime = None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Begin(self):
+        """
+        Begin.
+        Marks the start of the preparation (called by Push.Start).
+        """
+        self.StartTime = time.perf_counter()
+        self.EndTime = None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Finish(self):
+        """
+        Finish.
+        Marks the end of the preparation (called by Push.End).
+        """
+        self.EndTime = time.perf_counter()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __route(self, p_Method: str, p_Url: str):
+        path = urlparse(p_Url).path
+        if path.startswith('/push/v1'):
+            path = path[len('/push/v1'):]
+        for method, name, pattern in self.routes:
+            if method == p_Method and pattern.search(path):
+                return name
+        return p_Method + ' ' + path
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Request(self, p_Method: str, p_Url: str, **kwargs):
+        """
+        Request.
+        Records a request instead of sending it (called by the Push in dry run).
+        :arg p_Method: str, post, put or delete
+        :arg p_Url: str, url of the request
+        returns: PlannedResponse, like the answer of the Push API (containers, stream ids)
+        """
+        method = p_Method.upper()
+        route = self.__route(method, p_Url)
+        data = kwargs.get('data') or b''
+        with self.lock:
+            counts = self.Requests.setdefault(route, [0, 0])
+            counts[0] += 1
+            counts[1] += len(data)
+            if route in ('files', 'streamopen', 'streamchunk'):
+                self.containers += 1
+                fileId = 'dryrun-' + str(self.containers)
+        if route in ('files', 'streamchunk'):
+            return PlannedResponse(200, {'uploadUri': self.s_UploadUri + fileId, 'fileId': fileId})
+        if route == 'streamopen':
+            return PlannedResponse(200, {'uploadUri': self.s_UploadUri + fileId, 'fileId': fileId, 'streamId': fileId})
+        if route == 's3':
+            return PlannedResponse(200)
+        return PlannedResponse(202, {})
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def AddBatch(self, p_Mode: str, p_Added: int, p_Deleted: int, p_Updated: int, p_Bytes: int):
+        """
+        AddBatch.
+        Records a batch upload (called by UploadDocuments and UploadPermissions).
+        """
+        with self.lock:
+            self.Batches.append((p_Mode, p_Added, p_Deleted, p_Updated, p_Bytes))
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def AddDocument(self, p_Json, p_DocumentId: str = None, p_DataSize: int = 0):
+        """
+        AddDocument.
+        Records the bytes of each field of a document (called by Add, AddJson, AddEncoded and ProcessAndUploadBatch).
+        :arg p_Json: dict, the JSON of the document, or bytes (already encoded, counted as the '(encoded)' field)
+        :arg p_DocumentId: str, id of the document
+        :arg p_DataSize: int, size of Data and CompressedBinaryData
+        """
+        if isinstance(p_Json, bytes):
+            sizes = {'(encoded)': len(p_Json)}
+        else:
+            # {"key": value} without the braces, with the separator (', ') to the next field
+            sizes = {field: len(EncodeJson({field: value})) for field, value in p_Json.items()}
+        with self.lock:
+            self.Documents += 1
+            for field, size in sizes.items():
+                counts = self.Fields.get(field)
+                if counts is None:
+                    counts = self.Fields[field] = [0, 0]
+                counts[0] += 1
+                counts[1] += size
+                self.DocumentBytes += size
+            if p_DataSize > Constants.COMPRESSED_DATA_MAX_SIZE_IN_BYTES:
+                self.Oversized += 1
+                if len(self.OversizedIds) < self.MaxOversized:
+                    self.OversizedIds.append(p_DocumentId)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def ToJson(self, p_DocumentsPerSecond: float = 0, p_MBPerSecond: float = 10.0, p_SecondsPerBatch: float = 1.0, p_Workers: int = 1):
+        """
+        ToJson.
+        Summary of the plan.
+        :arg p_DocumentsPerSecond: float, preparation rate of the real run (def: 0, the rate measured by this dry run)
+        :arg p_MBPerSecond: float, upload bandwidth to S3 of one worker
+        :arg p_SecondsPerBatch: float, latency of the calls of one batch (container, Push API call)
+        :arg p_Workers: int, number of workers uploading the batches in parallel
+        returns: dict
+        """
+        with self.lock:
+            batches = list(self.Batches)
+            requests = {route: {'count': count, 'bytes': size} for route, (count, size) in self.Requests.items()}
+            fields = sorted(self.Fields.items(), key=lambda item: item[1][1], reverse=True)
+            documents = self.Documents
+            documentBytes = self.DocumentBytes
+
+        wallSeconds = None
+        if self.StartTime is not None:
+            wallSeconds = (self.EndTime or time.perf_counter()) - self.StartTime
+        sizes = [batch[4] for batch in batches]
+        totalBytes = sum(sizes)
+
+        # Preparation runs in the caller, the uploads are spread over the workers
+        if p_DocumentsPerSecond:
+            prepareSeconds = documents / p_DocumentsPerSecond
+        else:
+            prepareSeconds = wallSeconds or 0.0
+        uploadSeconds = len(batches) * p_SecondsPerBatch + totalBytes / (p_MBPerSecond * 1024 * 1024)
+        return {
+            'documents': documents,
+            'batches': {
+                'count': len(batches),
+                'bytes': totalBytes,
+                'minBytes': min(sizes) if sizes else 0,
+                'avgBytes': totalBytes / len(sizes) if sizes else 0,
+                'maxBytes': max(sizes) if sizes else 0,
+                'added': sum(batch[1] for batch in batches),
+                'deleted': sum(batch[2] for batch in batches),
+                'updated': sum(batch[3] for batch in batches),
+            },
+            'requests': requests,
+            'oversized': {'count': self.Oversized, 'documentIds': list(self.OversizedIds)},
+            'fields': [{'field': field, 'documents': count, 'bytes': size,
+                        'avgBytes': size / count, 'share': size / documentBytes if documentBytes else 0}
+                       for field, (count, size) in fields],
+            'wallSeconds': wallSeconds,
+            'projectedSeconds': max(prepareSeconds, uploadSeconds / max(p_Workers, 1)),
+        }
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Report(self, p_DocumentsPerSecond: float = 0, p_MBPerSecond: float = 10.0, p_SecondsPerBatch: float = 1.0, p_Workers: int = 1, p_Fields: int = 20):
+        """
+        Report.
+        Same arguments as ToJson.
+        :arg p_Fields: int, number of fields listed (the largest first)
+        returns: str
+        """
+        plan = self.ToJson(p_DocumentsPerSecond, p_MBPerSecond, p_SecondsPerBatch, p_Workers)
+        batches = plan['batches']
+        lines = ['documents: {}'.format(plan['documents']),
+                 'batches: {} ({} added, {} deleted, {} updated), {} bytes, min {} / avg {:.0f} / max {} bytes'.format(
+                     batches['count'], batches['added'], batches['deleted'], batches['updated'],
+                     batches['bytes'], batches['minBytes'], batches['avgBytes'], batches['maxBytes'])]
+        if plan['wallSeconds'] is not None:
+            lines.append('preparation: {:.3f}s'.format(plan['wallSeconds']))
+        lines.append('projected: {:.1f}s with {} worker(s)'.format(plan['projectedSeconds'], p_Workers))
+        if plan['oversized']['count']:
+            lines.append('oversized documents (> {} bytes of data): {} {}'.format(
+                Constants.COMPRESSED_DATA_MAX_SIZE_IN_BYTES, plan['oversized']['count'], plan['oversized']['documentIds']))
+        lines.append('requests:')
+        for route, counts in sorted(plan['requests'].items()):
+            lines.append('  {}: {} x, {} bytes'.format(route, counts['count'], counts['bytes']))
+        lines.append('fields:')
+        for field in plan['fields'][:p_Fields]:
+            lines.append('  {}: {} bytes ({:.1%}), {} documents, avg {:.0f} bytes'.format(
+                field['field'], field['bytes'], field['share'], field['documents'], field['avgBytes']))
+        return '\n'.join(lines)
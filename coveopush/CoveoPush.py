@@ -9,19 +9,30 @@ from .CoveoDocument import DocumentToUpdate, Validate
 from .CoveoDocument import Document
 from .CoveoDocument import DocumentToDelete
 from .CoveoDocument import BatchDocument
+from .CoveoDocument import EncodeBatch, EncodeJson, s_BatchOverhead
 from .CoveoPermissions import PermissionIdentityExpansion
 from .CoveoPermissions import PermissionIdentityBody
 from .CoveoPermissions import BatchPermissions
 from .CoveoPermissions import SecurityProvider
 from .CoveoPermissions import SecurityProviderReference
+from .CoveoMetrics import PushMetrics
+from .CoveoPlan import PushPlan
+from .CoveoJournal import PushJournal
+from .CoveoSpool import SpoolWriter
+from .CoveoOutbox import Outbox
+from .CoveoPacking import BatchPacker
+from .CoveoShards import ShardWorker
 
 import base64
+from concurrent.futures import ThreadPoolExecutor
 import json
 import jsonpickle
 from dataclasses import asdict, dataclass
 import logging
 import re
 import requests
+import sys
+import threading
 import time
 
 
@@ -30,6 +41,30 @@ def Error(log, err):
     raise Exception(err)
 
 
+# Body of a rejection of a batch which is too large (S3: 400 EntityTooLarge, Push API: 413)
+s_TooLargePattern = re.compile(r'EntityTooLarge|too large|exceeds the maximum', re.IGNORECASE)
+
+
+# ---------------------------------------------------------------------------------
+class OffloadedDocument:
+    """
+    class OffloadedDocument.
+    Placeholder in a batch for a document whose payload is being uploaded to a file container.
+    len() is the size of the document once offloaded (with CompressedBinaryDataFileId), Result() its encoded JSON.
+    """
+    __slots__ = ('Future', 'Size')
+
+    def __init__(self, p_Future, p_Size: int):
+        self.Future = p_Future
+        self.Size = p_Size
+
+    def __len__(self):
+        return self.Size
+
+    def Result(self):
+        return self.Future.result()
+
+
 def isBase64(s):
     """
     isBase64.
@@ -140,14 +175,45 @@ class Push:
     ProcessingDelayInMinutes = 0
     StartOrderingId = 0
     totalSize = 0
-    ToAdd = []
-    ToUpdate = []
-    ToDel = []
-    BatchPermissions = []
+    PermissionsSize = 0
+    ExpansionProviderId = ''
     MaxRequestSize = 0
     currentStream = None
     save = False
     curFile = 1
+    Metrics = None
+    # PushPlan of a dry run (SetDryRun), no requests are sent when set
+    Plan = None
+    # PushJournal of the batch session (SetJournal), to resume it after a crash
+    Journal = None
+    # SpoolWriter of the save mode (p_Save, SetSpool)
+    Spool = None
+    # Outbox receiving the added documents (SetOutbox)
+    Outbox = None
+    # BatchPacker of the packing mode (SetPacking)
+    Packer = None
+    # ShardWorker when the session is one shard of a ShardCoordinator (SetShard)
+    Shard = None
+    # requests.Session with the connection pool used for the calls (SetSession), None for a connection per call
+    Session = None
+    # Workers uploading the payloads too large for a batch (SetOffload), 0 to inline them
+    OffloadWorkers = 4
+    offloadExecutor = None
+    # Logging is set up once, by the first Push (see SetupLogging)
+    LoggingConfigured = False
+    # Progress log (see SetProgressLog)
+    ProgressEvery = 10000
+    ProgressSeconds = 60.0
+    progressCount = 0
+    progressNext = 1024
+    progressLastCount = 0
+    progressLastTime = 0.0
+    progressStartTime = 0.0
+    batchCount = 0
+    pushedBytes = 0
+    # Order of the batch uploads (see Add): turn of the next closed batch, turn of the next upload
+    batchTurn = 0
+    uploadTurn = 0
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # Default constructor used by the deserialization.
@@ -165,12 +231,23 @@ class Push:
         self.OrganizationId = p_OrganizationId
         self.ApiKey = p_ApiKey
         self.Endpoint = p_Endpoint
-        self.MaxRequestSize = 255052544
         self.Mode = p_Mode
         self.save = p_Save
         self.curFile = p_Offset
+        self.ToAdd = []
+        self.ToDel = []
+        self.ToUpdate = []
+        self.BatchPermissions = []
+        # The batch of Add/AddJson/AddEncoded (several threads can add), the uploads of the closed batches
+        self.lock = threading.Lock()
+        self.uploadTurnChanged = threading.Condition()
+        # Documents rejected as too large, even alone in a batch (see UploadBatch)
+        self.Rejected = []
+        # Batches of the session whose upload failed (see End)
+        self.Failed = []
         self.logger = logging.getLogger('CoveoPush')
-        self.SetupLogging()
+        if not Push.LoggingConfigured:
+            self.SetupLogging()
         # validate Api Key
         if not re.match(r'^\w{10}-\w{4}-\w{4}-\w{4}-\w{12}$', p_ApiKey):
             self.logger.error('Invalid Api Key format')
@@ -193,6 +270,154 @@ class Push:
 
         self.MaxRequestSize = p_Max
 
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def SetSpool(self, p_Directory: str = 'batch', p_CompressLevel: int = 0):
+        """
+        SetSpool.
+        Save mode: the batches are written to a spool directory instead of being uploaded, see SpoolReplayer
+        to upload them later. Without SetSpool, p_Save=True spools to 'batch', uncompressed.
+        :arg p_Directory: str, directory of the spool
+        :arg p_CompressLevel: int, 0 (uncompressed) or 1-9 (gzip)
+        returns: the SpoolWriter
+        """
+        self.save = True
+        self.Spool = SpoolWriter(p_Directory, p_CompressLevel, self.curFile)
+        return self.Spool
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def SetOutbox(self, p_Outbox: Outbox):
+        """
+        SetOutbox.
+        Add, AddJson and AddEncoded append the (validated, encoded) documents to the durable outbox instead
+        of the batch in memory; an OutboxUploader uploads them. Start and End are not used with an outbox.
+        :arg p_Outbox: Outbox (None to batch in memory again)
+        returns: the Outbox
+        """
+        self.Outbox = p_Outbox
+        return p_Outbox
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def SetPacking(self, p_Strategy: str = 'bestfit', p_Bins: int = 4, p_Window: int = 1000):
+        """
+        SetPacking.
+        Packing mode: the documents are packed into up to p_Bins open batches instead of being flushed in arrival order,
+        which gives fewer and fuller batches with a mix of large and small documents. See BatchPacker.
+        :arg p_Strategy: str, bestfit or ffd (first-fit-decreasing over a window of p_Window documents), None to stop packing
+        :arg p_Bins: int, max number of open batches
+        :arg p_Window: int, documents in the lookahead window (ffd)
+        returns: the BatchPacker
+        Not with a journal (SetJournal): the packed batches are not in input order, the journal could not tell
+        which input was uploaded.
+        """
+        if p_Strategy is not None and self.Journal is not None:
+            Error(self, "SetPacking: packing can not be used with a journal (SetJournal)")
+        if self.Packer is not None:
+            self.__uploadPacked(self.Packer.Flush())
+        self.Packer = BatchPacker(self, p_Strategy, p_Bins, p_Window) if p_Strategy is not None else None
+        return self.Packer
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def SetOffload(self, p_Workers: int = 4):
+        """
+        SetOffload.
+        In batch mode (Add, AddDocuments), a document with Data or CompressedBinaryData larger than
+        COMPRESSED_DATA_MAX_SIZE_IN_BYTES is uploaded to its own file container by a pool of p_Workers workers,
+        the batch only holds its CompressedBinaryDataFileId. A batch is uploaded once all its offloads are done.
+        Not used in save mode (the spool keeps the documents inline).
+        :arg p_Workers: int, parallel uploads (0 to keep the payloads inline in the batch)
+        """
+        if self.offloadExecutor is not None:
+            self.offloadExecutor.shutdown(wait=True)
+            self.offloadExecutor = None
+        self.OffloadWorkers = max(p_Workers, 0)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __encode(self, p_Document):
+        # Encodes a document of a batch, a document with a payload too large for a batch is offloaded
+        if (type(p_Document) is DocumentToDelete or type(p_Document) is DocumentToUpdate):
+            return EncodeJson(p_Document.ToJson())
+        if (self.OffloadWorkers > 0 and not self.save and type(p_Document) is Document and
+                len(p_Document.Data) + len(p_Document.CompressedBinaryData) > Constants.COMPRESSED_DATA_MAX_SIZE_IN_BYTES):
+            return self.__offload(p_Document)
+        return p_Document.ToEncodedJson()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __offload(self, p_Document: Document):
+        # Validated before the upload, the worker changes the document (SetCompressedDataFileId)
+        valid, error = Validate(p_Document)
+        if not valid:
+            Error(self, "Add: " + p_Document.DocumentId + ", " + error)
+        with self.lock:
+            if self.offloadExecutor is None:
+                self.offloadExecutor = ThreadPoolExecutor(max_workers=self.OffloadWorkers, thread_name_prefix='CoveoOffload')
+
+        # Size of the document in the batch: without the payload, with a file id
+        all = p_Document.ToJson()
+        all.pop('Data', None)
+        all.pop('CompressedBinaryData', None)
+        all['CompressedBinaryDataFileId'] = 'x' * 64
+        size = len(EncodeJson(all))
+        self.logger.debug('Offloading %s, %d bytes', p_Document.DocumentId, len(p_Document.Data) + len(p_Document.CompressedBinaryData))
+        return OffloadedDocument(self.offloadExecutor.submit(self.__offloadDocument, p_Document), size)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __offloadDocument(self, p_Document: Document):
+        # Worker: same upload as UploadDocumentIfTooLarge, returns the encoded document
+        self.UploadDocumentIfTooLarge(p_Document)
+        return p_Document.ToEncodedJson()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __resolveOffloads(self, p_ToAdd: []):
+        # Waits for the offloads of the batch, replaces the placeholders by the encoded documents
+        start = time.perf_counter()
+        offloads = 0
+        for index, encoded in enumerate(p_ToAdd):
+            if type(encoded) is OffloadedDocument:
+                p_ToAdd[index] = encoded.Result()
+                offloads += 1
+        if offloads:
+            self.RecordPhase('offload', start)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __pack(self, p_Document, p_Encoded: bytes, p_Count: bool = True):
+        # Packing mode: validates and hands the encoded document to the packer, then uploads the batches it closed.
+        # The lock covers the packer and the turns of the closed batches, the uploads are done after it
+        if type(p_Document) is DocumentToDelete:
+            operation, documentId = 'delete', p_Document.DocumentId
+        elif type(p_Document) is DocumentToUpdate:
+            operation, documentId = 'update', p_Document.DocumentId
+        elif isinstance(p_Document, Document):
+            valid, error = Validate(p_Document)
+            if not valid:
+                Error(self, "Add: " + p_Document.DocumentId + ", " + error)
+            operation, documentId = 'add', p_Document.DocumentId
+        else:
+            operation, documentId = 'add', BatchPacker.GetDocumentId(p_Encoded)
+
+        with self.lock:
+            closed = self.__turnsOf(self.Packer.Add(operation, documentId, p_Encoded))
+            if p_Count:
+                self.__counted()
+        for batch in closed:
+            self.__uploadInTurn(batch)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __turnsOf(self, p_Packed: []):
+        # Gives their turns to the batches closed by the packer (under self.lock)
+        batches = []
+        for packed in p_Packed:
+            batches.append((self.batchTurn, packed.Add, packed.Delete, packed.Update))
+            self.batchTurn += 1
+        return batches
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __uploadPacked(self, p_Packed: []):
+        # Uploads the batches closed by the packer (Flush), in order
+        with self.lock:
+            closed = self.__turnsOf(p_Packed)
+        for batch in closed:
+            self.__uploadInTurn(batch)
+
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def GetSizeMaxRequest(self):
         if self.MaxRequestSize > 0:
@@ -200,6 +425,15 @@ class Push:
 
         return Constants.MAXIMUM_REQUEST_SIZE_IN_BYTES
 
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def GetSizeMaxBatch(self):
+        """
+        GetSizeMaxBatch.
+        returns: int, max of the summed document sizes in a batch (encoded length + 1 separator each),
+                 the encoded batch is then at most GetSizeMaxRequest bytes
+        """
+        return self.GetSizeMaxRequest() - s_BatchOverhead
+
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def SetupLogging(self, p_LEVEL=logging.INFO, p_OutputFile='CoveoPush.log', p_Format="%(asctime)s %(levelname)-5s [%(filename)s:%(lineno)s %(funcName)s()] %(message)s"):
         """
@@ -210,6 +444,7 @@ class Push:
         """
 
         logging.basicConfig(filename=p_OutputFile, level=p_LEVEL, format=p_Format, datefmt='%Y-%m-%d %H:%M:%S')
+        Push.LoggingConfigured = True
 
         if p_LEVEL == logging.DEBUG:
             req_log = logging.getLogger('requests.packages.urllib3')
@@ -217,70 +452,270 @@ class Push:
             req_log.propagate = True
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    def call_post_api_with_retries(self, call_endpoint, max_nb_retries=7, initial_retry_delay_in_seconds=5, backoff_factor=3, **kwargs):
+    def SetProgressLog(self, p_Every: int = 10000, p_Seconds: float = 60.0):
+        """
+        SetProgressLog.
+        Between Start and End, a progress line (INFO) is logged every p_Every documents or p_Seconds seconds,
+        instead of a line per document. The values are also set as the 'progress' attribute of the log record.
+        :arg p_Every: int, number of documents (0 disables the progress log)
+        :arg p_Seconds: float, seconds
+        """
+        self.ProgressEvery = p_Every
+        self.ProgressSeconds = p_Seconds
+        self.__nextProgress()
+
+    def __nextProgress(self):
+        # The clock is only read every 1024 documents, or at the next p_Every
+        if self.ProgressEvery <= 0:
+            self.progressNext = sys.maxsize
+        else:
+            self.progressNext = min(self.progressCount + 1024, self.progressLastCount + self.ProgressEvery)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def LogProgress(self, p_Force: bool = False):
+        """
+        LogProgress.
+        Logs the progress (documents added, batches and bytes uploaded, rate) when due, or always when p_Force.
+        """
+        documents = self.progressCount
+        if not self.logger.isEnabledFor(logging.INFO):
+            self.progressLastCount = documents
+            self.__nextProgress()
+            return
+        now = time.perf_counter()
+        if not (p_Force or documents - self.progressLastCount >= self.ProgressEvery or now - self.progressLastTime >= self.ProgressSeconds):
+            self.__nextProgress()
+            return
+        elapsed = now - self.progressStartTime
+        progress = {
+            'documents': documents,
+            'batches': self.batchCount,
+            'bytes': self.pushedBytes,
+            'seconds': round(elapsed, 3),
+            'docsPerSecond': round(documents / elapsed, 1) if elapsed > 0 else 0.0
+        }
+        self.logger.info('Progress: %s', json.dumps(progress), extra={'progress': progress})
+        self.progressLastCount = documents
+        self.progressLastTime = now
+        self.__nextProgress()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def EnableMetrics(self, p_Metrics: PushMetrics = None):
+        """
+        EnableMetrics.
+        Records the wall time and bytes of each phase of the push (see CoveoMetrics.PushMetrics).
+        :arg p_Metrics: PushMetrics to use, can be shared by several Push objects (def: a new one)
+        returns: the PushMetrics
+        """
+        self.Metrics = p_Metrics or PushMetrics()
+        # Documents waiting in the current batch, only read by the exporters
+        self.Metrics.AddGauge('queue_depth', lambda: len(self.ToAdd) + len(self.ToDel) + len(self.ToUpdate))
+        return self.Metrics
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def DisableMetrics(self):
+        self.Metrics = None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def RecordPhase(self, p_Phase: str, p_Start: float, p_Bytes: int = 0):
+        """
+        RecordPhase.
+        Records the time since p_Start (time.perf_counter) for the phase, when metrics are enabled.
+        """
+        if self.Metrics is not None:
+            self.Metrics.Record(p_Phase, time.perf_counter() - p_Start, p_Bytes)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __startUpload(self, p_Documents: int, p_Bytes: int, p_Mode: str):
+        self.batchCount += 1
+        self.pushedBytes += p_Bytes
+        # Counters and batches in flight, for the exporters
+        if self.Metrics is not None:
+            labels = (('mode', p_Mode),)
+            self.Metrics.Increment('batches', 1, labels)
+            self.Metrics.Increment('documents', p_Documents, labels)
+            self.Metrics.Increment('bytes', p_Bytes, labels)
+            self.Metrics.ChangeGauge('batches_in_flight', 1)
+
+    def __endUpload(self):
+        if self.Metrics is not None:
+            self.Metrics.ChangeGauge('batches_in_flight', -1)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def SetDryRun(self, p_Plan: PushPlan = None):
+        """
+        SetDryRun.
+        Prepares and batches the documents as usual, but records the requests in a PushPlan instead of sending them.
+        :arg p_Plan: PushPlan (def: a new one)
+        returns: the PushPlan, see PushPlan.Report
+        """
+        self.Plan = p_Plan if p_Plan is not None else PushPlan()
+        self.logger.info('Dry run, no requests are sent')
+        return self.Plan
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def SetJournal(self, p_Journal: PushJournal):
+        """
+        SetJournal.
+        Checkpoints the batch sessions (Start/Add/End) in the journal, an unfinished session is resumed by Start.
+        :arg p_Journal: PushJournal (None to stop journaling)
+        returns: the PushJournal, see PushJournal for the skipping of the acknowledged input
+        Not in packing mode (SetPacking): the journal acknowledges the input in order.
+        """
+        if p_Journal is not None and self.Packer is not None:
+            Error(self, "SetJournal: a journal can not be used in packing mode (SetPacking)")
+        self.Journal = p_Journal
+        return p_Journal
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def SetSession(self, p_Session: requests.Session):
+        """
+        SetSession.
+        The Push API and S3 calls use the connection pool of p_Session (kept alive, can be shared by several Push).
+        :arg p_Session: requests.Session (None for a new connection per call)
+        returns: the requests.Session
+        """
+        self.Session = p_Session
+        return p_Session
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def SetShard(self, p_Shard: ShardWorker):
+        """
+        SetShard.
+        The batch sessions (Start/Add/End) are shards of a session of a ShardCoordinator: Start uses its ordering id
+        and stream, the status, the close of the stream and the delete of the older documents are done by the coordinator.
+        :arg p_Shard: ShardWorker (None for independent sessions again)
+        returns: the ShardWorker
+        """
+        self.Shard = p_Shard
+        return p_Shard
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __pending(self, p_Step: str):
+        # If a step of End must still be done (not done before the session was interrupted)
+        return self.Journal is None or not self.Journal.IsDone(p_Step)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __done(self, p_Step: str):
+        if self.Journal is not None:
+            self.Journal.Done(p_Step)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __send(self, p_Method: str, p_Url: str, **kwargs):
+        if self.Plan is not None:
+            return self.Plan.Request(p_Method, p_Url, **kwargs)
+        return getattr(self.Session or requests, p_Method)(p_Url, **kwargs)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __planDocument(self, p_Document):
+        # Field sizes of the document, for the plan of a dry run
+        if isinstance(p_Document, bytes):
+            self.Plan.AddDocument(p_Document)
+        elif isinstance(p_Document, dict):
+            dataSize = len(p_Document.get('Data') or p_Document.get('data') or '') + \
+                len(p_Document.get('CompressedBinaryData') or p_Document.get('compressedBinaryData') or '')
+            self.Plan.AddDocument(p_Document, p_Document.get('DocumentId') or p_Document.get('documentId'), dataSize)
+        elif type(p_Document) is Document:
+            self.Plan.AddDocument(p_Document.ToJson(), p_Document.DocumentId,
+                                  len(p_Document.Data) + len(p_Document.CompressedBinaryData))
+        else:
+            self.Plan.AddDocument(p_Document.ToJson(), p_Document.DocumentId)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def call_post_api_with_retries(self, call_endpoint, max_nb_retries=7, initial_retry_delay_in_seconds=5, backoff_factor=3, phase='api', **kwargs):
         delay_in_seconds = initial_retry_delay_in_seconds
         nb_retries = 0
         timeout=False
 
         while True:
+            start = time.perf_counter()
             try:
-                response = requests.post(call_endpoint,timeout=15, **kwargs)
+                response = self.__send('post', call_endpoint, timeout=15, **kwargs)
             except requests.exceptions.Timeout:
                 print("read timeout")
                 timeout=True
             nb_retries += 1
+            if self.Metrics is not None:
+                if timeout:
+                    self.Metrics.Increment('timeouts')
+                else:
+                    self.Metrics.Increment('responses', 1, (('status', str(response.status_code)),))
             if (response.status_code == 429 or timeout) and nb_retries <= max_nb_retries:
                 print("429, sleeping")
                 self.logger.debug('429, sleeping')
+                self.RecordPhase('retry', start)
                 time.sleep(delay_in_seconds)
+                if self.Metrics is not None:
+                    self.Metrics.Record('backoff', delay_in_seconds)
                 timeout=False
                 delay_in_seconds = delay_in_seconds * backoff_factor
             else:
                 #Error(self, "Calling API (429): Too many requests, even after retrying")
+                self.RecordPhase(phase, start, len(kwargs.get('data') or b''))
                 response.raise_for_status()
                 return response
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    def call_put_api_with_retries(self, call_endpoint, max_nb_retries=7, initial_retry_delay_in_seconds=5, backoff_factor=3, **kwargs):
+    def call_put_api_with_retries(self, call_endpoint, max_nb_retries=7, initial_retry_delay_in_seconds=5, backoff_factor=3, phase='api', **kwargs):
         delay_in_seconds = initial_retry_delay_in_seconds
         nb_retries = 0
         timeout=False
         while True:
+            start = time.perf_counter()
             try:
-                response = requests.put(call_endpoint, timeout=15,**kwargs)
+                response = self.__send('put', call_endpoint, timeout=15, **kwargs)
             except requests.exceptions.Timeout:
                 print("read timeout")
                 timeout=True
             nb_retries += 1
+            if self.Metrics is not None:
+                if timeout:
+                    self.Metrics.Increment('timeouts')
+                else:
+                    self.Metrics.Increment('responses', 1, (('status', str(response.status_code)),))
             if (response.status_code == 429 or timeout) and nb_retries <= max_nb_retries:
                 print("429, sleeping")
                 self.logger.debug('429, sleeping')
+                self.RecordPhase('retry', start)
                 time.sleep(delay_in_seconds)
+                if self.Metrics is not None:
+                    self.Metrics.Record('backoff', delay_in_seconds)
                 timeout=False
                 delay_in_seconds = delay_in_seconds * backoff_factor
             else:
                 #Error(self, "Calling API (429): Too many requests, even after retrying")
+                self.RecordPhase(phase, start, len(kwargs.get('data') or b''))
                 response.raise_for_status()
                 return response                
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    def call_delete_api_with_retries(self, call_endpoint, max_nb_retries=7, initial_retry_delay_in_seconds=5, backoff_factor=3, **kwargs):
+    def call_delete_api_with_retries(self, call_endpoint, max_nb_retries=7, initial_retry_delay_in_seconds=5, backoff_factor=3, phase='api', **kwargs):
         delay_in_seconds = initial_retry_delay_in_seconds
         nb_retries = 0
         timeout=False
         while True:
+            start = time.perf_counter()
             try:
-                response = requests.delete(call_endpoint, timeout=15,**kwargs)
+                response = self.__send('delete', call_endpoint, timeout=15, **kwargs)
             except requests.exceptions.Timeout:
                 print("read timeout")
                 timeout=True
             nb_retries += 1
+            if self.Metrics is not None:
+                if timeout:
+                    self.Metrics.Increment('timeouts')
+                else:
+                    self.Metrics.Increment('responses', 1, (('status', str(response.status_code)),))
             if (response.status_code == 429 or timeout) and nb_retries <= max_nb_retries:
                 print("429, sleeping")
                 self.logger.debug('429, sleeping')
+                self.RecordPhase('retry', start)
                 time.sleep(delay_in_seconds)
+                if self.Metrics is not None:
+                    self.Metrics.Record('backoff', delay_in_seconds)
                 timeout=False
                 delay_in_seconds = delay_in_seconds * backoff_factor
             else:
                 #Error(self, "Calling API (429): Too many requests, even after retrying")
+                self.RecordPhase(phase, start, len(kwargs.get('data') or b''))
                 response.raise_for_status()
                 return response                
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -531,11 +966,14 @@ class Push:
         }
 
         # make POST request to change status
-        r = requests.post(
+        start = time.perf_counter()
+        r = self.__send(
+            'post',
             self.GetStatusUrl(),
             headers=self.GetRequestHeaders(),
             params=params
         )
+        self.RecordPhase('api', start)
         return self.CheckReturnCode(r)
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -547,10 +985,13 @@ class Push:
         """
 
         self.logger.debug(self.GetLargeFileContainerUrl())
-        r = requests.post(
+        start = time.perf_counter()
+        r = self.__send(
+            'post',
             self.GetLargeFileContainerUrl(),
             headers=self.GetRequestHeaders()
         )
+        self.RecordPhase('container', start)
         self.CheckReturnCode(r)
 
         results = LargeFileContainer(json.loads(r.text))
@@ -568,6 +1009,7 @@ class Push:
         #r = #requests.post(
         r=   self.call_post_api_with_retries(
             self.GetOpenStreamUrl(),
+            phase='container',
             headers=self.GetRequestHeaders()
         )
         self.CheckReturnCode(r)
@@ -588,6 +1030,7 @@ class Push:
         #r = requests.post(
         r=   self.call_post_api_with_retries(            
             self.GetChunkStreamUrl(p_streamId),
+            phase='container',
             headers=self.GetRequestHeaders()
         )
         self.CheckReturnCode(r)
@@ -596,6 +1039,22 @@ class Push:
         results = LargeFileContainer(json.loads(r.text))
         return results
 
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def CloseStream(self, p_streamId: str):
+        """
+        CloseStream.
+        Close the stream, its chunks are then processed.
+        """
+
+        self.logger.debug(self.GetCloseStreamUrl(p_streamId))
+        #r = requests.post(
+        r=   self.call_post_api_with_retries(
+            self.GetCloseStreamUrl(p_streamId),
+            headers=self.GetRequestHeaders()
+        )
+        self.CheckReturnCode(r)
+        return r.status_code
+
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def UploadDocument(self, p_UploadUri: str, p_CompressedFile: str):
@@ -621,6 +1080,7 @@ class Push:
         r=self.call_put_api_with_retries(
             p_UploadUri,
             data=p_CompressedFile,
+            phase='s3put',
             headers=self.GetRequestHeadersForS3()
         )
         self.CheckReturnCode(r)
@@ -644,34 +1104,48 @@ class Push:
         if not p_ToAdd and not p_ToDelete and not p_ToUpdate:
             Error(self, "UploadBatch: p_ToAdd and p_ToDelete and p_ToUpdate are empty")
 
-        #start = time.time()
-        data = BatchDocument()
-        data.AddOrUpdate = p_ToAdd
-        data.Delete = p_ToDelete
-        data.partialUpdate = p_ToUpdate
-        #encoded = jsonpickle.encode(data, unpicklable=False) #data.toJson()#
-        encoded = json.dumps(data.toJson(),default = str)
-        #print (encoded)
-        #end = time.time()
-        #print("Encoding batch: "+str(end-start))
-        #r = requests.put(
-        r=self.call_put_api_with_retries(
-            p_UploadUri,
-            data=encoded,
-            headers=self.GetRequestHeadersForS3()
-        )
-        #print (encoded)
-        # start = time.time()
-        # print("PUT REQ: "+str(start-end))
+        start = time.perf_counter()
+        # p_ToAdd can contain already encoded fragments (bytes), see AddEncoded
+        encoded = EncodeBatch(p_ToAdd, p_ToDelete, p_ToUpdate)
+        self.RecordPhase('serialization', start, len(encoded))
+        self.UploadEncoded(p_UploadUri, encoded, len(p_ToAdd), len(p_ToDelete), len(p_ToUpdate))
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def UploadEncoded(self, p_UploadUri: str, p_Encoded: bytes, p_Added: int = 0, p_Deleted: int = 0, p_Updated: int = 0):
+        """
+        UploadEncoded.
+        Upload an already encoded batch document (EncodeBatch, or a spool file) to S3.
+        :arg p_UploadUri: string, retrieved from the GetLargeFileContainer call
+        :arg p_Encoded: bytes, the batch
+        :arg p_Added, p_Deleted, p_Updated: int, documents per operation in the batch (for the metrics)
+        """
+
+        if not p_UploadUri:
+            Error(self, "UploadEncoded: p_UploadUri is not present")
+
+        if self.Plan is not None:
+            self.Plan.AddBatch(self.Mode.value, p_Added, p_Deleted, p_Updated, len(p_Encoded))
+        self.__startUpload(p_Added + p_Deleted + p_Updated, len(p_Encoded), self.Mode.value)
+        try:
+            #r = requests.put(
+            r=self.call_put_api_with_retries(
+                p_UploadUri,
+                data=p_Encoded,
+                phase='s3put',
+                headers=self.GetRequestHeadersForS3()
+            )
+        finally:
+            self.__endUpload()
         self.CheckReturnCode(r)
         self.logger.debug('result: '+str(r.status_code))
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    def UploadPermissions(self, p_UploadUri: str):
+    def UploadPermissions(self, p_UploadUri: str, p_BatchPermissions: BatchPermissions = None):
         """
         UploadPermissions.
         Upload a batch permission to S3.
         :arg p_UploadUri: string, retrieved from the GetLargeFileContainer call
+        :arg p_BatchPermissions: BatchPermissions or already encoded batch (bytes) to upload (def: the current expansion batch)
         """
 
         self.logger.debug(p_UploadUri)
@@ -679,15 +1153,30 @@ class Push:
         if not p_UploadUri:
             Error(self, "UploadPermissions: p_UploadUri is not present")
 
-        pickled_permissions = jsonpickle.encode(self.BatchPermissions, unpicklable=False)
-        self.logger.debug("JSON: " + pickled_permissions)
+        if p_BatchPermissions is None:
+            p_BatchPermissions = self.BatchPermissions
 
-        #r = requests.put(
-        r=self.call_put_api_with_retries(
-            p_UploadUri,
-            data=pickled_permissions,
-            headers=self.GetRequestHeadersForS3()
-        )
+        start = time.perf_counter()
+        if isinstance(p_BatchPermissions, bytes):
+            pickled_permissions = p_BatchPermissions
+        else:
+            pickled_permissions = jsonpickle.encode(p_BatchPermissions, unpicklable=False)
+            self.RecordPhase('serialization', start, len(pickled_permissions))
+        self.logger.debug("JSON: %s", pickled_permissions)
+
+        if self.Plan is not None:
+            self.Plan.AddBatch('PERMISSIONS', 0, 0, 0, len(pickled_permissions))
+        self.__startUpload(0, len(pickled_permissions), 'PERMISSIONS')
+        try:
+            #r = requests.put(
+            r=self.call_put_api_with_retries(
+                p_UploadUri,
+                data=pickled_permissions,
+                phase='s3put',
+                headers=self.GetRequestHeadersForS3()
+            )
+        finally:
+            self.__endUpload()
 
         self.CheckReturnCode(r)
         self.logger.debug('result: '+str(r.status_code))
@@ -891,12 +1380,9 @@ class Push:
             self.UpdateSourceStatus(Constants.SourceStatusType.Rebuild)
 
         # Push Document
-        try:
-            if (p_CoveoDocument.CompressedBinaryData != '' or p_CoveoDocument.Data != ''):
-                self.UploadDocumentIfTooLarge(p_CoveoDocument)
-            self.AddUpdateDocumentRequest(p_CoveoDocument, orderingId)
-        finally:
-            p_CoveoDocument.Content = ''
+        if (p_CoveoDocument.CompressedBinaryData != '' or p_CoveoDocument.Data != ''):
+            self.UploadDocumentIfTooLarge(p_CoveoDocument)
+        self.AddUpdateDocumentRequest(p_CoveoDocument, orderingId)
 
         # Update Source Status
         if updateStatus:
@@ -955,17 +1441,20 @@ class Push:
     
     
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    def AddUpdateDocumentsRequest(self, p_FileId: str):
+    def AddUpdateDocumentsRequest(self, p_FileId: str, p_OrderingId: int = None):
         """
         AddUpdateDocumentsRequest.
         Sends the documents to the Push API, if previously uploaded to s3 the fileId is set
         :arg p_FileId: File Id retrieved from GetLargeFileContainer call
+        :arg p_OrderingId: int (optional), ordering id of the operations of the batch
         """
 
         self.logger.debug(p_FileId)
         params = {
             Constants.Parameters.FILE_ID: p_FileId
         }
+        if p_OrderingId is not None:
+            params[Constants.Parameters.ORDERING_ID] = p_OrderingId
         # make POST request to change status
         #r = requests.put(
         r=self.call_put_api_with_retries(
@@ -1012,6 +1501,61 @@ class Push:
         if not p_ToAdd and not p_ToDelete and not p_ToUpdate:
             Error(self, "UploadBatch: p_ToAdd and p_ToDelete and p_ToUpdate are empty")
 
+        if self.offloadExecutor is not None:
+            self.__resolveOffloads(p_ToAdd)
+
+        start = time.perf_counter()
+
+        if self.save:
+            # Spool the batch (all modes), see SpoolReplayer
+            self.Spool.Write(EncodeBatch(p_ToAdd, p_ToDelete, p_ToUpdate), len(p_ToAdd), len(p_ToDelete), len(p_ToUpdate))
+            self.curFile = self.Spool.Offset
+
+        else:
+            self.__uploadBatch(p_ToAdd, p_ToDelete, p_ToUpdate)
+
+        if self.Journal is not None:
+            self.Journal.Acknowledge(len(p_ToAdd) + len(p_ToDelete) + len(p_ToUpdate))
+        self.RecordPhase('batch', start)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __uploadBatch(self, p_ToAdd: [], p_ToDelete: [], p_ToUpdate: []):
+        # A batch rejected as too large is split in halves and uploaded again, down to single documents
+        try:
+            self.__sendBatch(p_ToAdd, p_ToDelete, p_ToUpdate)
+            return
+        except requests.exceptions.HTTPError as error:
+            response = error.response
+            if response is None or not (response.status_code == 413 or
+                                        (response.status_code == 400 and s_TooLargePattern.search(response.text or ''))):
+                raise
+            status = response.status_code
+
+        operations = [('add', document) for document in p_ToAdd] + \
+                     [('delete', document) for document in p_ToDelete] + \
+                     [('update', document) for document in p_ToUpdate]
+        if self.Metrics is not None:
+            self.Metrics.Increment('rejections', 1, (('status', str(status)),))
+        if len(operations) == 1:
+            operation, document = operations[0]
+            encoded = EncodeJson(document)
+            documentId = BatchPacker.GetDocumentId(encoded)
+            self.logger.error('Document %s (%s, %d bytes) rejected as too large (%d)', documentId, operation, len(encoded), status)
+            rejected = {'documentId': documentId, 'operation': operation, 'bytes': len(encoded), 'status': status}
+            self.Rejected.append(rejected)
+            if self.Journal is not None:
+                self.Journal.Reject(rejected)
+            return
+
+        self.logger.warning('Batch of %d documents rejected as too large (%d), splitting it', len(operations), status)
+        half = len(operations) // 2
+        for part in (operations[:half], operations[half:]):
+            self.__uploadBatch([document for operation, document in part if operation == 'add'],
+                               [document for operation, document in part if operation == 'delete'],
+                               [document for operation, document in part if operation == 'update'])
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __sendBatch(self, p_ToAdd: [], p_ToDelete: [], p_ToUpdate: []):
         if self.Mode == Constants.Mode.Push:
             container = self.GetLargeFileContainer()
             if not container:
@@ -1020,23 +1564,17 @@ class Push:
             self.UploadDocuments(container.UploadUri, p_ToAdd, p_ToDelete, p_ToUpdate)
             self.AddUpdateDocumentsRequest(container.FileId)
 
-        if self.Mode == Constants.Mode.Stream:
-            if (self.save):
-              name = "batch/"+str(self.curFile) + "_batch.json"
-              self.curFile = self.curFile +1
-              with open(name, "w", encoding='utf-8') as file:
-                text = json.dumps(p_ToAdd, ensure_ascii=True,default = str)
-                file.write(text)
-            else:
-              self.UploadDocuments(self.currentStream.UploadUri, p_ToAdd, p_ToDelete, p_ToUpdate)
-              # get a new container for the next batch?
-              container = self.GetStreamChunkFileContainer(self.currentStream.StreamId)
-              self.currentStream.UploadUri = container.UploadUri
-              self.currentStream.FileId = container.FileId
-              if not container:
-                  Error(self, "UploadBatch: S3 container is null")
-
-        if self.Mode == Constants.Mode.UpdateStream:
+        elif self.Mode == Constants.Mode.Stream:
+            # A rejected upload leaves the chunk unused, the next (half) batch is uploaded into it
+            self.UploadDocuments(self.currentStream.UploadUri, p_ToAdd, p_ToDelete, p_ToUpdate)
+            # get a new container for the next batch?
+            container = self.GetStreamChunkFileContainer(self.currentStream.StreamId)
+            if not container:
+                Error(self, "UploadBatch: S3 container is null")
+            self.currentStream.UploadUri = container.UploadUri
+            self.currentStream.FileId = container.FileId
+
+        elif self.Mode == Constants.Mode.UpdateStream:
             container = self.GetLargeFileContainer()
 
             if not container:
@@ -1057,21 +1595,40 @@ class Push:
         currentBatchToAddUpdate = []
         currentBatchToUpdate = []
 
+        if self.Packer is not None:
+            for document in p_Documents:
+                if self.Plan is not None:
+                    self.__planDocument(document)
+                self.__pack(document, self.__encode(document), False)
+            self.__uploadPacked(self.Packer.Flush())
+            return
+
         totalSize = 0
+        metrics = self.Metrics
         for document in p_Documents:
+            if self.Plan is not None:
+                self.__planDocument(document)
+            if metrics is not None:
+                start = time.perf_counter()
+            # Encode once, the encoded document is added to the batch
+            encoded = self.__encode(document)
             # Add 1 byte to account for the comma in the JSON array.
-            # documentSize = len(json.dumps(document,default=lambda x: x.__dict__)) + 1
-            #documentSize = len(jsonpickle.encode(document.ToJson(), unpicklable=False)) + 1
-            documentSize = len(json.dumps(document.ToJson(),default = str)) + 1
+            documentSize = len(encoded) + 1
+            if metrics is not None:
+                start = metrics.Lap('tojson', start, documentSize - 1)
 
             totalSize += documentSize
-            self.logger.debug("Doc: "+document.DocumentId)
-            self.logger.debug("Currentsize: "+str(totalSize) + " vs max: "+str(self.GetSizeMaxRequest()))
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug('Doc: %s, Currentsize: %d vs max: %d', document.DocumentId, totalSize, self.GetSizeMaxBatch())
 
-            if (documentSize > self.GetSizeMaxRequest()):
-                Error(self, "No document can be larger than " + str(self.GetSizeMaxRequest())+" bytes in size.")
+            if (documentSize > self.GetSizeMaxBatch()):
+                Error(self, "No document can be larger than " + str(self.GetSizeMaxBatch())+" bytes in size.")
 
-            if (totalSize > self.GetSizeMaxRequest() - (len(currentBatchToAddUpdate) + len(currentBatchToDelete)+ len(currentBatchToUpdate))):
+            flush = (totalSize > self.GetSizeMaxBatch())
+            if metrics is not None:
+                metrics.Lap('sizing', start)
+
+            if flush:
                 self.UploadBatch(currentBatchToAddUpdate, currentBatchToDelete, currentBatchToUpdate)
                 currentBatchToAddUpdate = []
                 currentBatchToDelete = []
@@ -1079,16 +1636,20 @@ class Push:
                 totalSize = documentSize
 
             if (type(document) is DocumentToDelete):
-                currentBatchToDelete.append(document.ToJson())
+                currentBatchToDelete.append(encoded)
             elif (type(document) is DocumentToUpdate):
-                currentBatchToUpdate.append(document.ToJson())
+                currentBatchToUpdate.append(encoded)
             else:
                 # Validate each document
+                if metrics is not None:
+                    start = time.perf_counter()
                 valid, error = Validate(document)
+                if metrics is not None:
+                    metrics.Lap('validation', start)
                 if not valid:
                     Error(self, "PushDocument: " + document.DocumentId + ", " + error)
                 else:
-                    currentBatchToAddUpdate.append(document.ToJson())
+                    currentBatchToAddUpdate.append(encoded)
 
         self.UploadBatch(currentBatchToAddUpdate, currentBatchToDelete, currentBatchToUpdate)
 
@@ -1173,20 +1734,67 @@ class Push:
         """
         Start.
         Starts a batch Push call, will set the start ordering Id and will update the status of the source
+        Between Start and End, Add, AddJson and AddEncoded can be called by several threads at once:
+          - the documents are validated and encoded by the calling thread, outside of the lock
+          - each document goes into exactly one batch; a full batch is uploaded by the thread which closed it,
+            while the other threads fill the next batch
+          - the batches are uploaded one at a time, in the order they were closed: the operations added by
+            one thread keep their order
+          - an upload error is raised in the thread which closed the batch, and by End (see Failed)
+        Start, End, AddDocuments and the Set methods are called by one thread: Start before the producers, End after them.
         :arg p_UpdateStatus: bool (True), if the source status should be updated
         :arg p_DeleteOlder: bool (False), if older documents should be removed from the index after the new push
         """
 
         self.ToAdd = []
         self.ToDel = []
+        self.ToUpdate = []
         self.totalSize = 0
+        self.batchTurn = 0
+        self.uploadTurn = 0
+        self.Rejected = []
+        self.Failed = []
         self.logger.debug('Start')
+        if self.Metrics is not None:
+            self.Metrics.Begin()
+        if self.Plan is not None:
+            self.Plan.Begin()
+        self.progressCount = 0
+        self.progressLastCount = 0
+        self.progressStartTime = self.progressLastTime = time.perf_counter()
+        self.__nextProgress()
+        self.batchCount = 0
+        self.pushedBytes = 0
         # Batch Call
         # First check
-        self.StartOrderingId = self.CreateOrderingId()
+        resume = self.Journal is not None and self.Journal.CanResume(self.SourceId, self.Mode.value)
+        session = None
+        if self.Shard is not None:
+            # One shard of a coordinated session: its ordering id, and its stream in Stream mode
+            session = self.Shard.Join(self.SourceId, self.Mode.value)
+            self.StartOrderingId = session['orderingId']
+            if self.Journal is not None and not resume:
+                self.Journal.Begin(self.SourceId, self.Mode.value, self.StartOrderingId)
+        elif resume:
+            # Same ordering id, the final DeleteOlderThan keeps the documents pushed before the interruption
+            self.Journal.Resume()
+            self.StartOrderingId = self.Journal.OrderingId
+        else:
+            self.StartOrderingId = self.CreateOrderingId()
+            if self.Journal is not None:
+                self.Journal.Begin(self.SourceId, self.Mode.value, self.StartOrderingId)
+        if resume:
+            # The rejections before the interruption still hold back DeleteOlderThan
+            self.Rejected = list(self.Journal.Rejected)
+
+        if self.save:
+            # Nothing is sent, the status and deletes are done by the replay of the spool
+            if self.Spool is None:
+                self.Spool = SpoolWriter('batch', 0, self.curFile)
+            self.Spool.Begin(self.SourceId, self.Mode.value)
 
         # Update Source Status
-        if p_UpdateStatus and self.Mode==Constants.Mode.Push:
+        if p_UpdateStatus and self.Mode==Constants.Mode.Push and not self.save and session is None:
             self.UpdateSourceStatus(Constants.SourceStatusType.Rebuild)
         
         # Check mode
@@ -1194,11 +1802,24 @@ class Push:
           if self.Mode == Constants.Mode.Stream or self.Mode == Constants.Mode.UpdateStream:
             self.logger.debug('Stream MODE for Catalog Sources')
 
-            if self.Mode == Constants.Mode.Stream:
+            if self.Mode == Constants.Mode.Stream and session is not None:
+                # Chunks of the stream opened by the coordinator
+                container = self.GetStreamChunkFileContainer(session['streamId'])
+                self.currentStream = StreamFileContainer({'uploadUri': container.UploadUri, 'fileId': container.FileId,
+                                                          'streamId': session['streamId']})
+            elif self.Mode == Constants.Mode.Stream and resume and self.Journal.StreamId:
+                # Continue the stream of the interrupted session, in a new chunk
+                if self.__pending('close'):
+                    container = self.GetStreamChunkFileContainer(self.Journal.StreamId)
+                    self.currentStream = StreamFileContainer({'uploadUri': container.UploadUri, 'fileId': container.FileId,
+                                                              'streamId': self.Journal.StreamId})
+            elif self.Mode == Constants.Mode.Stream:
                 # Call the Open Stream, in the case of an Stream
                 self.currentStream = self.GetStreamFileContainer()
                 if not self.currentStream:
                     Error(self, "StreamFileContainer: S3 container is null")
+                if self.Journal is not None:
+                    self.Journal.SetStream(self.currentStream.StreamId)
 
             if self.Mode == Constants.Mode.UpdateStream:
                 # Call the get the large file container
@@ -1207,75 +1828,170 @@ class Push:
                     Error(self, "GetLargeFileContainer: S3 container is null")
 
 
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __closeBatch(self):
+        # Takes the current batch (under self.lock) with its turn to be uploaded
+        batch = (self.batchTurn, self.ToAdd, self.ToDel, self.ToUpdate)
+        self.batchTurn += 1
+        self.ToAdd = []
+        self.ToDel = []
+        self.ToUpdate = []
+        return batch
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __uploadInTurn(self, p_Batch):
+        # Uploads a closed batch once the batches closed before it are uploaded: one upload at a time, in order
+        turn, toAdd, toDelete, toUpdate = p_Batch
+        with self.uploadTurnChanged:
+            while self.uploadTurn != turn:
+                self.uploadTurnChanged.wait()
+        try:
+            self.UploadBatch(toAdd, toDelete, toUpdate)
+        except Exception as e:
+            # Raised in this thread; kept for End, which must not delete the older documents
+            with self.lock:
+                self.Failed.append({'batch': turn, 'documents': len(toAdd) + len(toDelete) + len(toUpdate), 'error': repr(e)})
+            raise
+        finally:
+            with self.uploadTurnChanged:
+                self.uploadTurn += 1
+                self.uploadTurnChanged.notify_all()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __counted(self):
+        # Counts an added document (under self.lock)
+        self.progressCount += 1
+        if self.progressCount >= self.progressNext:
+            self.LogProgress()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __addToBatch(self, p_Operation: str, p_Encoded: bytes, p_Size: int):
+        # The callers encode and validate outside of the lock. The lock only covers the append, and the close
+        # of a full batch, which is then uploaded by this thread while the others go on filling the next batch
+        if (p_Size > self.GetSizeMaxBatch()):
+            Error(self, "No document can be larger than " + str(self.GetSizeMaxBatch())+" bytes in size.")
+
+        start = time.perf_counter()
+        full = None
+        with self.lock:
+            self.totalSize += p_Size
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug('Add: Currentsize: %d vs max: %d', self.totalSize, self.GetSizeMaxBatch())
+            if (self.totalSize > self.GetSizeMaxBatch()):
+                full = self.__closeBatch()
+                self.totalSize = p_Size
+
+            if p_Operation == 'delete':
+                self.ToDel.append(p_Encoded)
+            elif p_Operation == 'update':
+                self.ToUpdate.append(p_Encoded)
+            else:
+                self.ToAdd.append(p_Encoded)
+            self.__counted()
+        self.RecordPhase('sizing', start)
+
+        if full is not None:
+            self.__uploadInTurn(full)
+
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def Add(self, p_CoveoDocument):
         """
         Add.
         Add a document to the batch call, if the buffer max is reached content is pushed
+        Can be called by several threads at once, see Start.
         :arg p_CoveoDocument: CoveoDocument or CoveoDocumentToDelete or CoveoDocumentToUpdate
         """
 
-        self.logger.debug('Add')
-
         if not p_CoveoDocument:
             Error(self, "Add: p_CoveoDocument is empty")
 
-        #documentSize = len(jsonpickle.encode(p_CoveoDocument.ToJson(), unpicklable=False)) + 1
-        documentSize = len(json.dumps(p_CoveoDocument.ToJson(),default = str)) + 1
-
-        self.totalSize += documentSize
-        self.logger.debug("Doc: "+p_CoveoDocument.DocumentId)
-        self.logger.debug("Currentsize: "+str(self.totalSize) + " vs max: "+str(self.GetSizeMaxRequest()))
-
-        if (documentSize > self.GetSizeMaxRequest()):
-            Error(self, "No document can be larger than " + str(self.GetSizeMaxRequest())+" bytes in size.")
-
-        if (self.totalSize > self.GetSizeMaxRequest() - (len(self.ToAdd) + len(self.ToDel) + len(self.ToUpdate))):
-            self.UploadBatch(self.ToAdd, self.ToDel, self.ToUpdate)
-            self.ToAdd = []
-            self.ToDel = []
-            self.ToUpdate = []
-            self.totalSize = documentSize
-
+        if self.Outbox is not None:
+            self.Outbox.Add(p_CoveoDocument)
+            with self.lock:
+                self.progressCount += 1
+            return
+
+        if self.Plan is not None:
+            self.__planDocument(p_CoveoDocument)
+        metrics = self.Metrics
+        if metrics is not None:
+            start = time.perf_counter()
         if (type(p_CoveoDocument) is DocumentToDelete):
-            self.ToDel.append(p_CoveoDocument.ToJson())
+            operation = 'delete'
         elif (type(p_CoveoDocument) is DocumentToUpdate):
-            self.ToUpdate.append(p_CoveoDocument.ToJson())
+            operation = 'update'
         else:
+            operation = 'add'
             # Validate each document
             valid, error = Validate(p_CoveoDocument)
+            if metrics is not None:
+                start = metrics.Lap('validation', start)
             if not valid:
                 Error(self, "Add: "+p_CoveoDocument.DocumentId+", "+error)
-            else:
-                self.ToAdd.append(p_CoveoDocument.ToJson())
- 
- # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+        # Encode once, the encoded document is added to the batch
+        encoded = self.__encode(p_CoveoDocument)
+        documentSize = len(encoded) + 1
+        if metrics is not None:
+            metrics.Lap('tojson', start, documentSize - 1)
+
+        if self.Packer is not None:
+            self.__pack(p_CoveoDocument, encoded)
+            return
+
+        self.__addToBatch(operation, encoded, documentSize)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def AddJson(self, p_Json):
         """
         Add.
         Add a document to the batch call, if the buffer max is reached content is pushed
+        Can be called by several threads at once, see Start.
         :arg p_CoveoDocument: Coveoocument of CoveoDocumentToDelete
         """
 
-        self.logger.debug('AddJson')
+        if self.Outbox is not None:
+            self.Outbox.Append('add', EncodeJson(p_Json))
+            with self.lock:
+                self.progressCount += 1
+            return
 
-        documentSize = len(json.dumps(p_Json,default = str)) + 1
-        #documentSize = len(jsonpickle.encode(p_Json, unpicklable=False)) + 1
+        start = time.perf_counter()
+        # Encode once: the size is the exact length in bytes, the encoded document is added to the batch
+        encoded = EncodeJson(p_Json)
+        documentSize = len(encoded) + 1
+        self.RecordPhase('tojson', start, documentSize - 1)
+        if self.Plan is not None:
+            self.__planDocument(p_Json)
+        if self.Packer is not None:
+            self.__pack(p_Json, encoded)
+            return
 
-        self.totalSize += documentSize
-        self.logger.debug("Currentsize: "+str(self.totalSize) + " vs max: "+str(self.GetSizeMaxRequest()))
+        self.__addToBatch('add', encoded, documentSize)
 
-        if (documentSize > self.GetSizeMaxRequest()):
-            Error(self, "No document can be larger than " + str(self.GetSizeMaxRequest())+" bytes in size.")
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def AddEncoded(self, p_Encoded: bytes):
+        """
+        AddEncoded.
+        Add an already encoded document (JSON as utf-8 bytes) to the batch call, if the buffer max is reached content is pushed
+        The fragment is written as is into the batch, it is not parsed nor validated.
+        Can be called by several threads at once, see Start.
+        :arg p_Encoded: bytes, JSON of one document in the Push API format
+        """
 
-        if (self.totalSize > self.GetSizeMaxRequest() - (len(self.ToAdd) + len(self.ToDel)+ len(self.ToUpdate))):
-            self.UploadBatch(self.ToAdd, self.ToDel, self.ToUpdate)
-            self.ToAdd = []
-            self.ToDel = []
-            self.ToUpdate = []
-            self.totalSize = documentSize
+        if self.Outbox is not None:
+            self.Outbox.Append('add', p_Encoded)
+            with self.lock:
+                self.progressCount += 1
+            return
 
-        self.ToAdd.append(p_Json)
+        if self.Plan is not None:
+            self.__planDocument(p_Encoded)
+        if self.Packer is not None:
+            self.__pack(p_Encoded, p_Encoded)
+            return
+
+        self.__addToBatch('add', p_Encoded, len(p_Encoded) + 1)
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def End(self, p_UpdateStatus: bool = True, p_DeleteOlder: bool = False):
@@ -1284,35 +2000,89 @@ class Push:
         Ends the batch call (when started with Start()). Will push the final batch, update the status and delete older documents
         :arg p_UpdateStatus: bool (True), if the source status should be updated
         :arg p_DeleteOlder: bool (False), if older documents should be removed from the index after the new push
+                            (skipped when documents were rejected as too large, see Rejected; with a journal
+                            the session then stays unfinished, and is resumed with its rejections)
+        Raises when the upload of a batch failed (in any thread, see Failed): the stream is not closed and the
+        older documents are not deleted.
         """
 
         self.logger.debug('End')
         # Batch Call
-        self.UploadBatch(self.ToAdd, self.ToDel, self.ToUpdate)
+        if self.Packer is not None:
+            self.__uploadPacked(self.Packer.Flush())
+        # A resumed or packed session can have nothing left in this batch
+        if self.ToAdd or self.ToDel or self.ToUpdate or (self.Packer is None and (self.Journal is None or not self.Journal.Resumed)):
+            with self.lock:
+                last = self.__closeBatch()
+            self.__uploadInTurn(last)
 
         # Close the stream
+        # Not when a batch failed: the closed stream would replace the content of the source without its documents
+        deleteSkipped = False
         if self.Mode == Constants.Mode.Stream:
-          if not self.save:
-            self.logger.debug(self.GetCloseStreamUrl(self.currentStream.StreamId))
-            #r = requests.post(
-            r=   self.call_post_api_with_retries(
-                self.GetCloseStreamUrl(self.currentStream.StreamId),
-                headers=self.GetRequestHeaders()
-            )
-            self.CheckReturnCode(r)
+          if not self.save and self.Shard is None and self.__pending('close'):
+            if self.Failed:
+                self.logger.error('CloseStream skipped: %d batches failed', len(self.Failed))
+                deleteSkipped = True
+            else:
+                self.CloseStream(self.currentStream.StreamId)
+                self.__done('close')
+
+        if self.save:
+            self.Spool.End()
+
+        if self.Rejected:
+            self.logger.error('%d documents rejected as too large: %s', len(self.Rejected),
+                              ', '.join(str(rejected['documentId']) for rejected in self.Rejected))
 
         # Delete Older Documents
-        if p_DeleteOlder and self.Mode==Constants.Mode.Push:
-            self.DeleteOlderThan(self.StartOrderingId)
+        # Not when documents were rejected or a batch failed: their indexed version is older than the session, and would be deleted
+        if p_DeleteOlder and self.Mode==Constants.Mode.Push and not self.save and self.Shard is None and self.__pending('deleteolder'):
+            if self.Failed:
+                self.logger.error('DeleteOlderThan skipped: %d batches failed', len(self.Failed))
+                deleteSkipped = True
+            elif self.Rejected:
+                self.logger.error('DeleteOlderThan skipped: %d documents were rejected', len(self.Rejected))
+                deleteSkipped = True
+            else:
+                self.DeleteOlderThan(self.StartOrderingId)
+                self.__done('deleteolder')
 
         self.ToAdd = []
         self.ToDel = []
         self.ToUpdate = []
 
         # Update Source Status
-        if p_UpdateStatus and self.Mode==Constants.Mode.Push:
+        if p_UpdateStatus and self.Mode==Constants.Mode.Push and not self.save and self.Shard is None:
             self.UpdateSourceStatus(Constants.SourceStatusType.Idle)
 
+        if self.Shard is not None:
+            if self.Failed:
+                self.Shard.Fail(str(len(self.Failed)) + ' batches failed')
+            else:
+                self.Shard.Done(self.progressCount, self.batchCount)
+
+        if self.Journal is not None:
+            if deleteSkipped or self.Failed:
+                # The session is not finished: the delete of the older documents (or the close) is still pending
+                self.logger.warning('Journal ' + self.Journal.File + ' kept: the session is not finished')
+                self.Journal.Close()
+            else:
+                self.Journal.Complete()
+
+        if self.ProgressEvery > 0:
+            self.LogProgress(True)
+        if self.Metrics is not None:
+            self.Metrics.Finish()
+            self.logger.info('Metrics:\n' + self.Metrics.Report())
+        if self.Plan is not None:
+            self.Plan.Finish()
+            self.logger.info('Dry run plan:\n' + self.Plan.Report())
+
+        if self.Failed:
+            Error(self, "End: " + str(len(self.Failed)) + " batches failed (" + str(sum(failed['documents'] for failed in self.Failed)) +
+                  " documents), the session was not ended (no CloseStream, no DeleteOlderThan): " + '; '.join(failed['error'] for failed in self.Failed[:5]))
+
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def AddSecurityProvider(self, p_SecurityProviderId: str, p_Type: str, p_CascadingTo: {}, p_Endpoint: Constants.PlatformEndpoint = Constants.PlatformEndpoint.PROD_PLATFORM_API_URL):
         """
@@ -1401,6 +2171,7 @@ class Push:
         Will start a Batch for Expansion/Permission updates.
         Using AddExpansionMember, AddExpansionMapping or AddExpansionDeleted operations are added.
         EndExpansion must be called at the end to write the Batch to the Push API.
+        When the batch reaches the max request size (SetSizeMaxRequest) it is pushed, a session can push several batches.
         :arg p_SecurityProviderId: Security Provider to use
         :arg p_DeleteOlder: bool (False), if older documents should be removed from the index after the new push
         """
@@ -1410,6 +2181,37 @@ class Push:
         # First check
         self.StartOrderingId = self.CreateOrderingId()
         self.BatchPermissions = BatchPermissions()
+        self.PermissionsSize = 0
+        self.ExpansionProviderId = p_SecurityProviderId
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def AddExpansion(self, p_PermissionIdentityBody: PermissionIdentityBody, p_Attr: str):
+        """
+        AddExpansion.
+        Add a PermissionIdentityBody to the expansion batch, if the buffer max is reached the batch is pushed
+        :arg p_PermissionIdentityBody: PermissionIdentityBody
+        :arg p_Attr: str, members, mappings or deleted
+        """
+        bodySize = len(json.dumps(p_PermissionIdentityBody, default=str)) + 1
+
+        if (bodySize > self.GetSizeMaxRequest()):
+            Error(self, "No permission identity can be larger than " + str(self.GetSizeMaxRequest())+" bytes in size.")
+
+        self.PermissionsSize += bodySize
+        count = len(self.BatchPermissions['members']) + len(self.BatchPermissions['mappings']) + len(self.BatchPermissions['deleted'])
+        if (self.PermissionsSize > self.GetSizeMaxRequest() - count):
+            self.UploadPermissionsBatch(self.ExpansionProviderId)
+            self.BatchPermissions = BatchPermissions()
+            self.PermissionsSize = bodySize
+
+        if p_Attr == 'members':
+            self.BatchPermissions.AddMembers(p_PermissionIdentityBody)
+        elif p_Attr == 'mappings':
+            self.BatchPermissions.AddMappings(p_PermissionIdentityBody)
+        elif p_Attr == 'deleted':
+            self.BatchPermissions.AddDeletes(p_PermissionIdentityBody)
+        else:
+            Error(self, "AddExpansion: " + p_Attr + " must be members, mappings or deleted")
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def AddExpansionMember(self, p_Identity: PermissionIdentityExpansion, p_Members: [], p_Mappings: [], p_WellKnowns: []):
@@ -1427,7 +2229,7 @@ class Push:
         permissionIdentityBody.AddMembers(p_Members)
         permissionIdentityBody.AddMappings(p_Mappings)
         permissionIdentityBody.AddWellKnowns(p_WellKnowns)
-        self.BatchPermissions.AddMembers(permissionIdentityBody)
+        self.AddExpansion(permissionIdentityBody, 'members')
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def AddExpansionMapping(self, p_Identity: PermissionIdentityExpansion, p_Members: [], p_Mappings: [], p_WellKnowns: []):
@@ -1445,7 +2247,7 @@ class Push:
         permissionIdentityBody.AddMembers(p_Members)
         permissionIdentityBody.AddMappings(p_Mappings)
         permissionIdentityBody.AddWellKnowns(p_WellKnowns)
-        self.BatchPermissions.AddMappings(permissionIdentityBody)
+        self.AddExpansion(permissionIdentityBody, 'mappings')
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def AddExpansionDeleted(self, p_Identity: PermissionIdentityExpansion, p_Members: [], p_Mappings: [], p_WellKnowns: []):
@@ -1462,7 +2264,7 @@ class Push:
         permissionIdentityBody.AddMembers(p_Members)
         permissionIdentityBody.AddMappings(p_Mappings)
         permissionIdentityBody.AddWellKnowns(p_WellKnowns)
-        self.BatchPermissions.AddDeletes(permissionIdentityBody)
+        self.AddExpansion(permissionIdentityBody, 'deleted')
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def EndExpansion(self, p_SecurityProviderId: str, p_DeleteOlder: bool = False):
@@ -1473,11 +2275,29 @@ class Push:
         :arg p_DeleteOlder: bool (False), if older documents should be removed from the index after the new push
         """
         self.logger.debug('EndExpansion')
+        self.UploadPermissionsBatch(p_SecurityProviderId)
+        self.BatchPermissions = BatchPermissions()
+        self.PermissionsSize = 0
+
+        # Only once, after all the batches of the session
+        if p_DeleteOlder:
+            self.DeletePermissionsOlderThan(p_SecurityProviderId, self.StartOrderingId)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def UploadPermissionsBatch(self, p_SecurityProviderId: str, p_BatchPermissions: BatchPermissions = None):
+        """
+        UploadPermissionsBatch.
+        Uploads the expansion batch (BatchPermissions) to S3 and calls the Push API to record the fileId
+        :arg p_SecurityProviderId: Security Provider to use
+        :arg p_BatchPermissions: BatchPermissions or already encoded batch (bytes) to upload (def: the current expansion batch)
+        """
+        self.logger.info('UploadPermissionsBatch')
+        start = time.perf_counter()
         container = self.GetLargeFileContainer()
         if not container:
             Error(self, "UploadBatch: S3 container is null")
 
-        self.UploadPermissions(container.UploadUri)
+        self.UploadPermissions(container.UploadUri, p_BatchPermissions)
         params = {
             Constants.Parameters.FILE_ID: container.FileId
         }
@@ -1497,9 +2317,7 @@ class Push:
             params=params
         )
         self.CheckReturnCode(r)
-
-        if p_DeleteOlder:
-            self.DeletePermissionsOlderThan(p_SecurityProviderId, self.StartOrderingId)
+        self.RecordPhase('batch', start)
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def RemovePermissionIdentity(self, p_SecurityProviderId: str, p_PermissionIdentity: PermissionIdentityExpansion):
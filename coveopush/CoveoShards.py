@@ -0,0 +1,265 @@
+# -------------------------------------------------------------------------------------
+# CoveoShards
+# -------------------------------------------------------------------------------------
+# Contains the ShardCoordinator and ShardWorker classes
+#   One batch session (Start/Add/End) pushed by several processes or nodes (the shards),
+#   with one status update, one StartOrderingId, one stream and one DeleteOlderThan
+# -------------------------------------------------------------------------------------
+import json
+import logging
+import os
+import time
+import uuid
+
+from .CoveoConstants import Constants
+
+
+# ---------------------------------------------------------------------------------
+def Error(log, err):
+    log.logger.info(err)
+    raise Exception(err)
+
+# ---------------------------------------------------------------------------------
+
+
+def WriteFile(p_Path: str, p_Record: {}):
+    # Written atomically: a reader sees the whole file or no file
+    temporaryFile = p_Path + '.' + str(os.getpid()) + '.tmp'
+    with open(temporaryFile, mode='w', encoding='utf-8') as file:
+        json.dump(p_Record, file)
+    os.replace(temporaryFile, p_Path)
+
+
+def ReadFile(p_Path: str):
+    try:
+        with open(p_Path, mode='r', encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+# ---------------------------------------------------------------------------------
+
+
+class ShardCoordinator:
+    """
+    class ShardCoordinator.
+    Coordinates a full rebuild which is split over p_Shards processes or nodes, each running Start/Add/End
+    with a ShardWorker (Push.SetShard). The rendezvous is a directory, local or shared between the nodes:
+      Begin: sets the Rebuild status once, creates the StartOrderingId, opens the stream (Stream mode)
+             and publishes them in session.json
+      the shards read the session in Start (same ordering id, chunks of the same stream), and write
+             shard-<n>.json in End (or when they fail)
+      End:   waits until all the shards are done, then closes the stream (Stream mode) or deletes the
+             older documents (Push mode), once, and sets the status to Idle
+    When a shard fails, End raises without deleting the older documents: the documents of the failed
+    shard would be deleted.
+
+        coordinator = ShardCoordinator(push, '/shared/rebuild', 8)
+        coordinator.Begin()
+        ... start the 8 shards ...
+        coordinator.End(True, True)
+    """
+    s_Session = 'session.json'
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_Push, p_Directory: str, p_Shards: int):
+        """
+        ShardCoordinator Constructor.
+        :arg p_Push: CoveoPush.Push of the source (its mode is the mode of the session)
+        :arg p_Directory: str, rendezvous directory (created)
+        :arg p_Shards: int, number of shards
+        """
+        self.logger = logging.getLogger('CoveoShards')
+        if p_Shards < 1:
+            Error(self, "ShardCoordinator: p_Shards must be at least 1")
+        self.Push = p_Push
+        self.Directory = p_Directory
+        self.Shards = p_Shards
+        self.Session = None
+        os.makedirs(p_Directory, exist_ok=True)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Begin(self, p_UpdateStatus: bool = True):
+        """
+        Begin.
+        Starts the session and publishes it to the shards.
+        :arg p_UpdateStatus: bool (True), if the source status should be set to Rebuild (Push mode)
+        returns: dict, the session
+        """
+        for name in os.listdir(self.Directory):
+            if name.startswith('shard-') or name == self.s_Session:
+                os.remove(os.path.join(self.Directory, name))
+
+        push = self.Push
+        if p_UpdateStatus and push.Mode == Constants.Mode.Push:
+            push.UpdateSourceStatus(Constants.SourceStatusType.Rebuild)
+        streamId = None
+        if push.Mode == Constants.Mode.Stream:
+            stream = push.GetStreamFileContainer()
+            if not stream:
+                Error(self, "StreamFileContainer: S3 container is null")
+            streamId = stream.StreamId
+
+        self.Session = {
+            'id': str(uuid.uuid4()),
+            'sourceId': push.SourceId,
+            'mode': push.Mode.value,
+            'orderingId': push.CreateOrderingId(),
+            'streamId': streamId,
+            'shards': self.Shards,
+            'time': time.time()
+        }
+        WriteFile(os.path.join(self.Directory, self.s_Session), self.Session)
+        self.logger.info('Session ' + self.Session['id'] + ' of ' + str(self.Shards) + ' shards, ordering id ' +
+                         str(self.Session['orderingId']))
+        return self.Session
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Status(self):
+        """
+        Status.
+        returns: dict, shard number -> report (status done or failed, documents, batches, error) of the shards which reported
+        """
+        reports = {}
+        for shard in range(self.Shards):
+            report = ReadFile(os.path.join(self.Directory, 'shard-' + str(shard) + '.json'))
+            if report is not None and report.get('session') == self.Session['id']:
+                reports[shard] = report
+        return reports
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Wait(self, p_Timeout: float = None, p_Poll: float = 1.0):
+        """
+        Wait.
+        Waits until all the shards reported.
+        :arg p_Timeout: float, seconds (def: no timeout)
+        :arg p_Poll: float, seconds between the checks of the directory
+        returns: dict, the reports (see Status); raises when a shard failed or on timeout
+        """
+        if self.Session is None:
+            Error(self, "ShardCoordinator: Begin was not called")
+        deadline = time.time() + p_Timeout if p_Timeout is not None else None
+        while True:
+            reports = self.Status()
+            failed = [str(shard) + ': ' + str(report.get('error')) for shard, report in sorted(reports.items())
+                      if report.get('status') != 'done']
+            if failed:
+                Error(self, "ShardCoordinator: shards failed, " + '; '.join(failed))
+            if len(reports) == self.Shards:
+                return reports
+            if deadline is not None and time.time() > deadline:
+                Error(self, "ShardCoordinator: timeout, " + str(len(reports)) + ' of ' + str(self.Shards) + ' shards done')
+            time.sleep(p_Poll)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def End(self, p_UpdateStatus: bool = True, p_DeleteOlder: bool = False, p_Timeout: float = None):
+        """
+        End.
+        Waits for the shards, then ends the session once: closes the stream, deletes the older documents, sets the status.
+        :arg p_UpdateStatus: bool (True), if the source status should be set to Idle (Push mode)
+        :arg p_DeleteOlder: bool (False), if the documents older than the session should be removed (Push mode)
+        :arg p_Timeout: float, seconds to wait for the shards (def: no timeout)
+        returns: dict, the reports of the shards
+        """
+        reports = self.Wait(p_Timeout)
+        push = self.Push
+        if push.Mode == Constants.Mode.Stream:
+            push.CloseStream(self.Session['streamId'])
+        if p_DeleteOlder and push.Mode == Constants.Mode.Push:
+            push.DeleteOlderThan(self.Session['orderingId'])
+        if p_UpdateStatus and push.Mode == Constants.Mode.Push:
+            push.UpdateSourceStatus(Constants.SourceStatusType.Idle)
+
+        os.remove(os.path.join(self.Directory, self.s_Session))
+        self.logger.info('Session ' + self.Session['id'] + ' ended, ' +
+                         str(sum(report.get('documents', 0) for report in reports.values())) + ' documents')
+        return reports
+
+# ---------------------------------------------------------------------------------
+
+
+class ShardWorker:
+    """
+    class ShardWorker.
+    One shard of a session of a ShardCoordinator, set on the Push of the shard with Push.SetShard:
+    Start waits for the session and uses its ordering id (and stream), without changing the status,
+    End uploads the last batch and reports to the coordinator, without closing the stream nor deleting.
+
+        push.SetShard(ShardWorker('/shared/rebuild', shardNumber))
+        try:
+            push.Start()
+            for document in documentsOfTheShard:
+                push.Add(document)
+            push.End()
+        except Exception as e:
+            push.Shard.Fail(e)
+            raise
+    """
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_Directory: str, p_Shard: int, p_Timeout: float = 600.0, p_Poll: float = 1.0):
+        """
+        ShardWorker Constructor.
+        :arg p_Directory: str, rendezvous directory of the coordinator
+        :arg p_Shard: int, number of this shard (0 to shards-1)
+        :arg p_Timeout: float, seconds to wait for the session in Start
+        :arg p_Poll: float, seconds between the checks of the directory
+        """
+        self.logger = logging.getLogger('CoveoShards')
+        self.Directory = p_Directory
+        self.Shard = p_Shard
+        self.Timeout = p_Timeout
+        self.Poll = p_Poll
+        self.Session = None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Join(self, p_SourceId: str, p_Mode: str):
+        """
+        Join.
+        Waits for the session of the coordinator (called by Push.Start).
+        returns: dict, the session (orderingId, streamId)
+        """
+        deadline = time.time() + self.Timeout
+        path = os.path.join(self.Directory, ShardCoordinator.s_Session)
+        while True:
+            session = ReadFile(path)
+            if session is not None:
+                break
+            if time.time() > deadline:
+                Error(self, "ShardWorker: no session in " + self.Directory + " after " + str(self.Timeout) + "s")
+            time.sleep(self.Poll)
+
+        if session['sourceId'] != p_SourceId or session['mode'] != p_Mode:
+            Error(self, "ShardWorker: the session is of source " + session['sourceId'] + ' (' + session['mode'] +
+                  '), not of ' + p_SourceId + ' (' + p_Mode + ')')
+        if not 0 <= self.Shard < session['shards']:
+            Error(self, "ShardWorker: shard " + str(self.Shard) + " is not one of the " + str(session['shards']) + " shards")
+        self.Session = session
+        self.logger.info('Shard ' + str(self.Shard) + ' of session ' + session['id'])
+        return session
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __report(self, p_Report: {}):
+        if self.Session is None:
+            self.logger.warning('Shard ' + str(self.Shard) + ' did not join a session, nothing reported')
+            return
+        p_Report['session'] = self.Session['id']
+        p_Report['shard'] = self.Shard
+        p_Report['time'] = time.time()
+        WriteFile(os.path.join(self.Directory, 'shard-' + str(self.Shard) + '.json'), p_Report)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Done(self, p_Documents: int, p_Batches: int):
+        """
+        Done.
+        Reports that all the batches of the shard are uploaded (called by Push.End).
+        """
+        self.__report({'status': 'done', 'documents': p_Documents, 'batches': p_Batches})
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Fail(self, p_Error):
+        """
+        Fail.
+        Reports that the shard failed: the coordinator does not end the session.
+        """
+        self.__report({'status': 'failed', 'error': str(p_Error)})
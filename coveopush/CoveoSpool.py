@@ -0,0 +1,298 @@
+# -------------------------------------------------------------------------------------
+# CoveoSpool
+# -------------------------------------------------------------------------------------
+# Contains the SpoolWriter and SpoolReplayer classes
+#   A spool is a directory of batch files (as uploaded to the Push API) with a manifest,
+#   written by Push(p_Save=True) and uploaded later, with parallel workers, by SpoolReplayer
+#   (see examples/replay_spool.py). Document preparation and upload can run at different times.
+# -------------------------------------------------------------------------------------
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from .CoveoConstants import Constants
+from .CoveoJsonLines import s_DocumentIdPattern
+
+
+# ---------------------------------------------------------------------------------
+def Error(log, err):
+    log.logger.info(err)
+    raise Exception(err)
+
+# ---------------------------------------------------------------------------------
+
+
+class SpoolWriter:
+    """
+    class SpoolWriter.
+    Writes the batches of a push session into a directory:
+      <N>_batch.json (or <N>_batch.json.gz): the batch as uploaded ({"AddOrUpdate": [...], "Delete": [...], "partialUpdate": [...]})
+      manifest.json: source, mode, and for each file the documents per operation, the bytes and the sha256 of the batch
+    Files and manifest are written to a temporary file first, then renamed.
+    The manifest is marked complete by End, SpoolReplayer refuses an incomplete spool unless forced.
+
+        push = CoveoPush.Push(sourceId, orgId, apiKey, p_Mode=Constants.Mode.Stream, p_Save=True)
+        push.SetSpool('batch', p_CompressLevel=1)
+        push.Start()
+        ...
+        push.End()
+    """
+    s_Manifest = 'manifest.json'
+    version = 1
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_Directory: str = 'batch', p_CompressLevel: int = 0, p_Offset: int = 1):
+        """
+        SpoolWriter Constructor.
+        :arg p_Directory: str, directory of the spool (created when needed)
+        :arg p_CompressLevel: int, 0 (uncompressed) or 1-9 (gzip)
+        :arg p_Offset: int, number of the first batch file; with an offset > 1, the files of an existing manifest are kept
+        """
+        if not 0 <= p_CompressLevel <= 9:
+            Error(self, "SpoolWriter: p_CompressLevel must be between 0 and 9")
+        self.logger = logging.getLogger('CoveoSpool')
+        self.Directory = p_Directory
+        self.CompressLevel = p_CompressLevel
+        self.Offset = p_Offset
+        self.Manifest = None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __writeFile(self, p_Name: str, p_Data: bytes):
+        path = os.path.join(self.Directory, p_Name)
+        temporaryFile = path + '.tmp'
+        with open(temporaryFile, mode='wb') as file:
+            file.write(p_Data)
+        os.replace(temporaryFile, path)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __writeManifest(self):
+        self.__writeFile(self.s_Manifest, json.dumps(self.Manifest, indent=1).encode('utf-8'))
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Begin(self, p_SourceId: str, p_Mode: str):
+        """
+        Begin.
+        Starts the spool of a session (called by Push.Start).
+        """
+        os.makedirs(self.Directory, exist_ok=True)
+        files = []
+        manifestFile = os.path.join(self.Directory, self.s_Manifest)
+        if self.Offset > 1 and os.path.isfile(manifestFile):
+            # Continue the numbering of a previous session
+            with open(manifestFile, mode='r', encoding='utf-8') as file:
+                files = [entry for entry in json.load(file)['files'] if entry['number'] < self.Offset]
+        self.Manifest = {'version': self.version, 'sourceId': p_SourceId, 'mode': p_Mode,
+                         'created': time.time(), 'complete': False, 'files': files}
+        self.__writeManifest()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Write(self, p_Encoded: bytes, p_Added: int, p_Deleted: int, p_Updated: int):
+        """
+        Write.
+        Writes one batch (called by Push.UploadBatch in save mode).
+        :arg p_Encoded: bytes, the batch (EncodeBatch)
+        :arg p_Added, p_Deleted, p_Updated: int, documents per operation
+        returns: str, the file name
+        """
+        if self.Manifest is None:
+            Error(self, "SpoolWriter.Write: Begin was not called")
+        number = self.Offset
+        self.Offset += 1
+        name = str(number) + '_batch.json'
+        data = p_Encoded
+        if self.CompressLevel:
+            name += '.gz'
+            data = gzip.compress(p_Encoded, compresslevel=self.CompressLevel)
+        self.__writeFile(name, data)
+        self.Manifest['files'].append({'number': number, 'file': name, 'added': p_Added, 'deleted': p_Deleted,
+                                       'updated': p_Updated, 'bytes': len(p_Encoded),
+                                       'sha256': hashlib.sha256(p_Encoded).hexdigest()})
+        self.__writeManifest()
+        self.logger.debug('Spooled %s, %d bytes', name, len(data))
+        return name
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def End(self):
+        """
+        End.
+        Marks the spool complete (called by Push.End).
+        """
+        if self.Manifest is None:
+            return
+        self.Manifest['complete'] = True
+        self.__writeManifest()
+        self.logger.info('Spool ' + self.Directory + ': ' + str(len(self.Manifest['files'])) + ' batch files')
+
+# ---------------------------------------------------------------------------------
+
+
+class SpoolReplayer:
+    """
+    class SpoolReplayer.
+    Uploads a spool directory with parallel workers, in the mode of the Push (Push, Stream or UpdateStream),
+    which can differ from the mode of the session which wrote it:
+      Push:         a file container per batch, then a documents/batch call
+      Stream:       one stream, a chunk per batch (in parallel), the stream is closed at the end
+      UpdateStream: a file container per batch, then a stream/update call
+    The files are uploaded in parallel, but the operations on one document keep the order of the spool:
+    in Push mode each file gets the next ordering id (in file order), in the other modes a file waits for
+    the earlier files with one of its documents.
+    Spools of older versions (only <N>_batch.json files with the list of documents to add, no manifest) are also read.
+
+        push = CoveoPush.Push(sourceId, orgId, apiKey, p_Mode=Constants.Mode.Stream)
+        print(SpoolReplayer(push, 'batch', p_Workers=8).Replay())
+    """
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_Push, p_Directory: str = 'batch', p_Workers: int = 4, p_Force: bool = False):
+        """
+        SpoolReplayer Constructor.
+        :arg p_Push: CoveoPush.Push, source and mode to upload to
+        :arg p_Directory: str, directory of the spool
+        :arg p_Workers: int, parallel uploads
+        :arg p_Force: bool (False), also replay a spool which is not complete (session without End)
+        """
+        self.logger = logging.getLogger('CoveoSpool')
+        self.Push = p_Push
+        self.Directory = p_Directory
+        self.Workers = max(p_Workers, 1)
+        self.Force = p_Force
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Load(self):
+        """
+        Load.
+        returns: list of the manifest entries (file, added, deleted, updated, bytes, sha256), in file number order
+        """
+        manifestFile = os.path.join(self.Directory, SpoolWriter.s_Manifest)
+        if os.path.isfile(manifestFile):
+            with open(manifestFile, mode='r', encoding='utf-8') as file:
+                manifest = json.load(file)
+            if manifest.get('version') != SpoolWriter.version:
+                Error(self, 'Spool ' + self.Directory + ': unknown version ' + str(manifest.get('version')))
+            if not manifest['complete'] and not self.Force:
+                Error(self, 'Spool ' + self.Directory + ' is not complete (the session was not ended), use p_Force to replay it')
+            return sorted(manifest['files'], key=lambda entry: entry['number'])
+
+        # Spool without manifest: lists of documents to add
+        entries = []
+        for path in glob.glob(os.path.join(self.Directory, '*_batch.json')):
+            match = re.match(r'^(\d+)_batch\.json$', os.path.basename(path))
+            if match:
+                entries.append({'number': int(match.group(1)), 'file': os.path.basename(path)})
+        return sorted(entries, key=lambda entry: entry['number'])
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Read(self, p_Entry: {}):
+        """
+        Read.
+        returns: bytes, the batch of the entry (decompressed and checked)
+        """
+        with open(os.path.join(self.Directory, p_Entry['file']), mode='rb') as file:
+            data = file.read()
+        if p_Entry['file'].endswith('.gz'):
+            data = gzip.decompress(data)
+        if 'sha256' not in p_Entry:
+            # A list of documents to add
+            if data.lstrip()[:1] == b'[':
+                data = b'{"AddOrUpdate":' + data + b'}'
+            return data
+        if len(data) != p_Entry['bytes'] or hashlib.sha256(data).hexdigest() != p_Entry['sha256']:
+            Error(self, 'Spool ' + self.Directory + ': ' + p_Entry['file'] + ' is corrupted')
+        return data
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __upload(self, p_Entry: {}, p_StreamId: str, p_Container=None, p_OrderingId: int = None, p_After: [] = ()):
+        # p_After: the uploads of the earlier files with one of the documents of this file
+        push = self.Push
+        if p_After:
+            wait(p_After)
+        data = self.Read(p_Entry)
+        if push.Mode == Constants.Mode.Stream:
+            container = p_Container or push.GetStreamChunkFileContainer(p_StreamId)
+        else:
+            container = push.GetLargeFileContainer()
+        if not container:
+            Error(self, "SpoolReplayer: S3 container is null")
+        push.UploadEncoded(container.UploadUri, data, p_Entry.get('added', 0), p_Entry.get('deleted', 0), p_Entry.get('updated', 0))
+        if push.Mode == Constants.Mode.Push:
+            push.AddUpdateDocumentsRequest(container.FileId, p_OrderingId)
+        elif push.Mode == Constants.Mode.UpdateStream:
+            push.AddUpdateStreamRequest(container.FileId)
+        return len(data)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Replay(self, p_UpdateStatus: bool = True, p_DeleteOlder: bool = False):
+        """
+        Replay.
+        Uploads all batch files. The stream is closed, the older documents deleted (Push mode) and the status
+        set to Idle only when all files were uploaded.
+        :arg p_UpdateStatus: bool (True), if the source status should be updated (Push mode)
+        :arg p_DeleteOlder: bool (False), if older documents should be removed from the index after the replay (Push mode)
+        returns: dict, files, documents, bytes, seconds
+        """
+        push = self.Push
+        entries = self.Load()
+        if not entries:
+            Error(self, 'Spool ' + self.Directory + ' is empty')
+        self.logger.info('Replaying ' + str(len(entries)) + ' batch files from ' + self.Directory + ' in ' + push.Mode.value +
+                         ' mode, ' + str(self.Workers) + ' workers')
+
+        start = time.perf_counter()
+        orderingId = push.CreateOrderingId()
+        if p_UpdateStatus and push.Mode == Constants.Mode.Push:
+            push.UpdateSourceStatus(Constants.SourceStatusType.Rebuild)
+
+        streamId = None
+        first = None
+        if push.Mode == Constants.Mode.Stream:
+            # The container of the open call is used for the first batch, each other batch gets a chunk
+            first = push.GetStreamFileContainer()
+            streamId = first.StreamId
+
+        with ThreadPoolExecutor(max_workers=self.Workers, thread_name_prefix='CoveoSpool') as executor:
+            # Submitted in file order: an earlier file is always picked up before a file which waits for it
+            futures = []
+            last = {}
+            for nr, entry in enumerate(entries):
+                if push.Mode == Constants.Mode.Push:
+                    futures.append(executor.submit(self.__upload, entry, streamId, None, orderingId + nr))
+                    continue
+                ids = set(s_DocumentIdPattern.findall(self.Read(entry))) if self.Workers > 1 else set()
+                after = {last[documentId] for documentId in ids if documentId in last}
+                future = executor.submit(self.__upload, entry, streamId, first if nr == 0 else None, None, list(after))
+                for documentId in ids:
+                    last[documentId] = future
+                futures.append(future)
+            uploaded = 0
+            failed = []
+            for entry, future in zip(entries, futures):
+                try:
+                    uploaded += future.result()
+                except Exception as e:
+                    self.logger.error('Spool ' + entry['file'] + ': ' + str(e))
+                    failed.append(entry['file'])
+        if failed:
+            Error(self, 'SpoolReplayer: ' + str(len(failed)) + ' batch files failed: ' + ', '.join(failed[:10]))
+
+        if push.Mode == Constants.Mode.Stream:
+            push.CloseStream(streamId)
+        if p_DeleteOlder and push.Mode == Constants.Mode.Push:
+            push.DeleteOlderThan(orderingId)
+        if p_UpdateStatus and push.Mode == Constants.Mode.Push:
+            push.UpdateSourceStatus(Constants.SourceStatusType.Idle)
+
+        result = {
+            'files': len(entries),
+            'documents': sum(entry.get('added', 0) + entry.get('deleted', 0) + entry.get('updated', 0) for entry in entries),
+            'bytes': uploaded,
+            'seconds': time.perf_counter() - start
+        }
+        self.logger.info('Replayed: ' + json.dumps(result))
+        return result
@@ -0,0 +1,395 @@
+# -------------------------------------------------------------------------------------
+# CoveoTemplates
+# -------------------------------------------------------------------------------------
+# Contains the DocumentTemplate and CsvLoader classes
+#   A DocumentTemplate maps a row (dict) to an encoded document, it is compiled once
+#   The CsvLoader streams the rows of a CSV file into a batch push
+# -------------------------------------------------------------------------------------
+import base64
+import csv
+import json
+import logging
+import re
+import string
+import zlib
+from json.encoder import encode_basestring_ascii
+from urllib.parse import urlparse
+from .CoveoConstants import Constants
+from .CoveoDocument import generatePermanentId
+from .CoveoPermissions import DocumentPermissionLevel
+from .CoveoPermissions import DocumentPermissionSet
+from .CoveoPermissions import PermissionModel
+
+
+# ---------------------------------------------------------------------------------
+def Error(log, err):
+    log.logger.info(err)
+    raise Exception(err)
+
+
+def EncodeString(p_Value: str):
+    """
+    EncodeString.
+    Encodes a string as a JSON string (bytes, including the quotes).
+    """
+    return encode_basestring_ascii(p_Value).encode('ascii')
+
+# ---------------------------------------------------------------------------------
+
+
+class FieldTemplate:
+    """
+    class FieldTemplate.
+    Holds a template like 'https://myreference&id=$UserName' or '${FirstName} ${LastName}'.
+    The syntax is the one of string.Template ($$ is a literal $).
+    The template is parsed once, rendering a row is a simple join.
+    """
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_Template: str):
+        """
+        class FieldTemplate constructor.
+        :arg p_Template: str, template referencing the columns with $column or ${column}
+        """
+        self.Template = p_Template
+        # List of (literal, column), column is None for the trailing literal
+        self.Parts = []
+        self.Columns = []
+
+        literal = ''
+        position = 0
+        for match in string.Template.pattern.finditer(p_Template):
+            literal += p_Template[position:match.start()]
+            position = match.end()
+            if match.group('escaped') is not None:
+                literal += '$'
+                continue
+            column = match.group('named') or match.group('braced')
+            if column is None:
+                raise Exception("FieldTemplate: invalid placeholder in template: " + p_Template)
+            self.Parts.append((literal, column))
+            self.Columns.append(column)
+            literal = ''
+        literal += p_Template[position:]
+        if literal or not self.Parts:
+            self.Parts.append((literal, None))
+
+        # The literal text before the first column
+        self.Prefix = self.Parts[0][0]
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def IsStatic(self):
+        return not self.Columns
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Render(self, p_Row: {}):
+        """
+        Render.
+        Renders the template for the row. Missing/empty values are rendered as ''.
+        :arg p_Row: dict, column -> value
+        """
+        values = []
+        for literal, column in self.Parts:
+            values.append(literal)
+            if column is not None:
+                values.append(p_Row[column] or '')
+        return ''.join(values)
+
+# ---------------------------------------------------------------------------------
+
+
+class PermissionTemplate:
+    """
+    class PermissionTemplate.
+    Same permission model as Document.SetAllowedAndDeniedPermissions (one level, one set),
+    but the identities can reference columns, for example:
+        PermissionIdentity(Constants.PermissionIdentityType.User, "", "$Email")
+    The model is encoded once, only the templated identities are encoded per row.
+    """
+    # Marker used for the templated identities in the encoded model
+    s_Marker = '\x00{0}\x00'
+    s_MarkerPattern = re.compile(r'"\\u0000(\d+)\\u0000"')
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_AllowedPermissions: [], p_DeniedPermissions: [], p_AllowAnonymous: bool = False):
+        """
+        class PermissionTemplate constructor.
+        :arg p_AllowedPermissions: list of PermissionIdentities which have access
+        :arg p_DeniedPermissions: list of PermissionIdentities which do NOT have access
+        :arg p_AllowAnonymous: (def: False) if Anonymous access is allowed
+        """
+        self.Templates = []
+
+        simplePermissionSet = DocumentPermissionSet('Set1')
+        simplePermissionSet.AddAllowedPermissions([self.__mark(identity) for identity in p_AllowedPermissions])
+        simplePermissionSet.AddDeniedPermissions([self.__mark(identity) for identity in p_DeniedPermissions])
+        simplePermissionSet.SetAnonymousPermissions(p_AllowAnonymous)
+
+        simplePermissionLevel = DocumentPermissionLevel('Level1')
+        simplePermissionLevel.AddPermissionSet(simplePermissionSet)
+
+        encoded = json.dumps([simplePermissionLevel])
+        # Split in literals and template indexes: [literal, index, literal, index, ..., literal]
+        parts = self.s_MarkerPattern.split(encoded)
+        self.Literals = [part.encode('ascii') for part in parts[0::2]]
+        self.Indexes = [int(part) for part in parts[1::2]]
+        self.Encoded = self.Literals[0] if not self.Indexes else None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __mark(self, p_Identity):
+        template = FieldTemplate(p_Identity['identity'])
+        if template.IsStatic():
+            return p_Identity
+        identity = type(p_Identity).__new__(type(p_Identity))
+        dict.update(identity, p_Identity)
+        marker = self.s_Marker.format(len(self.Templates))
+        identity['name'] = marker
+        identity['identity'] = marker
+        self.Templates.append(template)
+        return identity
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Encode(self, p_Row: {}):
+        """
+        Encode.
+        Returns the encoded permissions (bytes) for the row.
+        :arg p_Row: dict, column -> value
+        """
+        if self.Encoded is not None:
+            return self.Encoded
+        values = [EncodeString(template.Render(p_Row)) for template in self.Templates]
+        parts = [self.Literals[0]]
+        for nr, index in enumerate(self.Indexes):
+            parts.append(values[index])
+            parts.append(self.Literals[nr + 1])
+        return b''.join(parts)
+
+# ---------------------------------------------------------------------------------
+
+
+class DocumentTemplate:
+    """
+    class DocumentTemplate.
+    Declarative mapping of a row (dict) to a document in the Push API format.
+    The mapping is compiled once; encoding a row does not create a Document, nor calls
+    AddMetadata/SetAllowedAndDeniedPermissions.
+
+        template = DocumentTemplate('https://myreference&id=$UserName',
+                                    p_Title='$FirstName $LastName',
+                                    p_Content='<html><body>$FirstName $LastName</body></html>',
+                                    p_Metadata={'department': 'Department'},
+                                    p_StaticMetadata={'connectortype': 'CSV'},
+                                    p_Permissions=PermissionTemplate([myperm], [], True),
+                                    p_FileExtension='.html')
+        push.AddEncoded(template.Encode(row))
+    """
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_DocumentId: str, p_Title: str = '', p_Content: str = '', p_Metadata: {} = None, p_StaticMetadata: {} = None, p_Permissions=None, p_FileExtension: str = '', p_Date: str = '', p_Compress: bool = True):
+        """
+        class DocumentTemplate constructor.
+        :arg p_DocumentId: str, template of the DocumentId (valid URL)
+        :arg p_Title: str, template of the Title
+        :arg p_Content: str, template of the content (for example HTML)
+        :arg p_Metadata: dict, metadata name -> column
+        :arg p_StaticMetadata: dict, metadata name -> value (str or list), same for all rows
+        :arg p_Permissions: PermissionTemplate, PermissionModel or list of DocumentPermissionLevel
+        :arg p_FileExtension: str, file extension (for example: .html)
+        :arg p_Date: str, column holding the date (ISO format)
+        :arg p_Compress: bool (True), ZLIB compress the content (CompressedBinaryData) instead of setting Data
+        """
+        self.logger = logging.getLogger('CoveoTemplates')
+
+        if not p_DocumentId:
+            Error(self, "DocumentTemplate: DocumentId template not set")
+
+        self.DocumentId = FieldTemplate(p_DocumentId)
+        # When the template starts with the scheme, the rendered DocumentId is always an URL
+        self.DocumentIdHasScheme = bool(urlparse(self.DocumentId.Prefix).scheme) and '://' in self.DocumentId.Prefix
+        self.Title = FieldTemplate(p_Title) if p_Title else None
+        self.Content = FieldTemplate(p_Content) if p_Content else None
+        self.Compress = p_Compress
+        self.Date = p_Date
+
+        reservedKeys = [key.lower() for key in Constants.s_DocumentReservedKeys]
+
+        # Metadata: list of (encoded key, column)
+        self.Metadata = []
+        for key, column in (p_Metadata or {}).items():
+            if (key == '' or key.lower() in reservedKeys):
+                Error(self, "DocumentTemplate: " + key + " is a reserved field and cannot be set as metadata.")
+            self.Metadata.append((b',' + EncodeString(key.lower()) + b':', column))
+
+        # Everything which is the same for all rows is encoded once
+        tail = []
+        if p_FileExtension:
+            tail.append(b',"FileExtension":' + EncodeString(p_FileExtension))
+        for key, value in (p_StaticMetadata or {}).items():
+            if (key == '' or key.lower() in reservedKeys):
+                Error(self, "DocumentTemplate: " + key + " is a reserved field and cannot be set as metadata.")
+            if (value == '' or value == None):
+                self.logger.info("DocumentTemplate: value not set for " + key)
+                continue
+            tail.append(b',' + EncodeString(key.lower()) + b':' + json.dumps(value, default=str).encode('utf-8'))
+
+        self.Permissions = None
+        if isinstance(p_Permissions, PermissionTemplate):
+            if p_Permissions.Encoded is not None:
+                tail.append(b',"Permissions":' + p_Permissions.Encoded)
+            else:
+                self.Permissions = p_Permissions
+        elif isinstance(p_Permissions, PermissionModel):
+            tail.append(b',"Permissions":' + p_Permissions.Encoded)
+        elif p_Permissions:
+            tail.append(b',"Permissions":' + json.dumps(p_Permissions, default=str).encode('utf-8'))
+        tail.append(b'}')
+        self.Tail = b''.join(tail)
+
+        if self.Compress:
+            self.ContentKey = b',"CompressedBinaryData":"'
+            self.ContentEnd = b'","CompressionType":"' + Constants.CompressionType.ZLIB.value.encode('ascii') + b'"'
+        else:
+            self.ContentKey = b',"Data":'
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def GetColumns(self):
+        """
+        GetColumns.
+        Returns the columns used by the template.
+        """
+        columns = list(self.DocumentId.Columns)
+        if self.Title:
+            columns.extend(self.Title.Columns)
+        if self.Content:
+            columns.extend(self.Content.Columns)
+        if self.Date:
+            columns.append(self.Date)
+        columns.extend([column for __, column in self.Metadata])
+        if self.Permissions:
+            for template in self.Permissions.Templates:
+                columns.extend(template.Columns)
+        return columns
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def CheckColumns(self, p_Columns: []):
+        """
+        CheckColumns.
+        Checks that all the columns used by the template are available (for example the CSV header).
+        :arg p_Columns: list of column names
+        """
+        missing = [column for column in self.GetColumns() if column not in p_Columns]
+        if missing:
+            Error(self, "DocumentTemplate: unknown columns: " + ', '.join(missing))
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Encode(self, p_Row: {}):
+        """
+        Encode.
+        Returns the encoded document (bytes) for the row, to use with Push.AddEncoded.
+        :arg p_Row: dict, column -> value
+        """
+        documentId = self.DocumentId.Render(p_Row)
+        if documentId == '':
+            Error(self, "DocumentTemplate: DocumentId is empty")
+        if not self.DocumentIdHasScheme:
+            parsed_url = urlparse(documentId)
+            if not parsed_url.scheme:
+                Error(self, "DocumentTemplate: DocumentId is not a valid URL format [missing scheme]: " + documentId)
+
+        parts = [b'{"DocumentId":', EncodeString(documentId), b',"permanentid":"', generatePermanentId(documentId).encode('ascii'), b'"']
+
+        if self.Title:
+            title = self.Title.Render(p_Row)
+            if title:
+                parts.append(b',"Title":')
+                parts.append(EncodeString(title))
+
+        if self.Content:
+            content = self.Content.Render(p_Row)
+            if content:
+                parts.append(self.ContentKey)
+                if self.Compress:
+                    parts.append(base64.b64encode(zlib.compress(content.encode('utf8'), zlib.Z_BEST_COMPRESSION)))
+                    parts.append(self.ContentEnd)
+                else:
+                    parts.append(EncodeString(content))
+
+        if self.Date:
+            date = p_Row[self.Date]
+            if date:
+                parts.append(b',"Date":')
+                parts.append(EncodeString(date))
+
+        for key, column in self.Metadata:
+            value = p_Row[column]
+            if value:
+                parts.append(key)
+                parts.append(EncodeString(value))
+
+        if self.Permissions:
+            parts.append(b',"Permissions":')
+            parts.append(self.Permissions.Encode(p_Row))
+
+        parts.append(self.Tail)
+        return b''.join(parts)
+
+# ---------------------------------------------------------------------------------
+
+
+class CsvLoader:
+    """
+    class CsvLoader.
+    Streams the rows of a CSV file, through a DocumentTemplate, into a batch push.
+
+        push.Start(updateSourceStatus, deleteOlder)
+        CsvLoader(push, template, p_Delimiter=';').Load('People.csv')
+        push.End(updateSourceStatus, deleteOlder)
+    """
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_Push, p_Template: DocumentTemplate, p_Delimiter: str = ',', p_Encoding: str = 'utf-8'):
+        """
+        CsvLoader Constructor.
+        :arg p_Push: CoveoPush.Push, the push client (Start must be called before Load)
+        :arg p_Template: DocumentTemplate
+        :arg p_Delimiter: str, CSV delimiter
+        :arg p_Encoding: str, encoding of the CSV file
+        """
+        self.Push = p_Push
+        self.Template = p_Template
+        self.Delimiter = p_Delimiter
+        self.Encoding = p_Encoding
+        self.logger = logging.getLogger('CoveoTemplates')
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def LoadRows(self, p_Rows):
+        """
+        LoadRows.
+        Encodes every row and adds it to the batch.
+        :arg p_Rows: iterable of dict (for example csv.DictReader)
+        returns: number of documents added
+        """
+        encode = self.Template.Encode
+        add = self.Push.AddEncoded
+        count = 0
+        for row in p_Rows:
+            add(encode(row))
+            count += 1
+        return count
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Load(self, p_FilePath: str):
+        """
+        Load.
+        Streams the CSV file into the batch.
+        :arg p_FilePath: str, CSV file (with a header)
+        returns: number of documents added
+        """
+        self.logger.info('Loading ' + p_FilePath)
+        with open(p_FilePath, mode='r', encoding=self.Encoding, newline='') as file:
+            rows = csv.DictReader(file, delimiter=self.Delimiter)
+            self.Template.CheckColumns(rows.fieldnames or [])
+            count = self.LoadRows(rows)
+
+        self.logger.info('Loaded ' + str(count) + ' documents from ' + p_FilePath)
+        return count
@@ -0,0 +1,195 @@
+# -------------------------------------------------------------------------------------
+# CoveoTrace
+# -------------------------------------------------------------------------------------
+# Contains the Tracer class
+#   Records the timeline of a push (batches, HTTP calls, serialization, document compression)
+#   as Chrome trace-event JSON, viewable in chrome://tracing or https://ui.perfetto.dev
+# -------------------------------------------------------------------------------------
+import json
+import logging
+import os
+import threading
+import time
+
+# Tracer of the Document operations, set by Tracer.Start
+ActiveTracer = None
+
+
+# ---------------------------------------------------------------------------------
+class Tracer:
+    """
+    class Tracer.
+    Records spans (trace events of type 'X', with thread ids) of:
+      push:     batches (UploadBatch, UploadPermissionsBatch)
+      http:     container, S3 and API calls, retries and backoff sleeps
+      encoding: batch serialization, and when p_DocumentEvents, ToJson, validation and size accounting per document
+      document: compression (SetContentAndZLibCompress, GetFileAndCompress)
+
+        tracer = Tracer().Attach(push).Start()
+        push.Start()
+        ...
+        push.End()
+        tracer.Stop()
+        tracer.Write('push.trace.json')
+
+    The number of events is bounded by p_MaxEvents, the next events are dropped (see Dropped).
+    """
+    s_Categories = {
+        'batch': 'push',
+        'container': 'http',
+        's3put': 'http',
+        'api': 'http',
+        'retry': 'http',
+        'backoff': 'http',
+        'serialization': 'encoding',
+        'tojson': 'encoding',
+        'validation': 'encoding',
+        'sizing': 'encoding',
+    }
+    s_DocumentPhases = ('tojson', 'validation', 'sizing')
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, p_DocumentEvents: bool = False, p_MaxEvents: int = 1000000):
+        """
+        Tracer Constructor.
+        :arg p_DocumentEvents: bool (False), also record a span per document for ToJson, validation and size accounting
+        :arg p_MaxEvents: int, max number of events kept in memory
+        """
+        self.logger = logging.getLogger('CoveoTrace')
+        self.DocumentEvents = p_DocumentEvents
+        self.MaxEvents = p_MaxEvents
+        self.Events = []
+        self.Dropped = 0
+        self.Threads = {}
+        self.pid = os.getpid()
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Complete(self, p_Name: str, p_Category: str, p_Start: float, p_End: float = None, p_Args: {} = None):
+        """
+        Complete.
+        Adds a span of the current thread.
+        :arg p_Name: str, name of the span
+        :arg p_Category: str, category (push, http, encoding, document or your own)
+        :arg p_Start: float, time.perf_counter at the start
+        :arg p_End: float, time.perf_counter at the end (def: now)
+        :arg p_Args: dict, shown with the span (optional)
+        """
+        if p_End is None:
+            p_End = time.perf_counter()
+        thread = threading.current_thread()
+        event = {'name': p_Name, 'cat': p_Category, 'ph': 'X', 'pid': self.pid, 'tid': thread.ident,
+                 'ts': (p_Start - self.origin) * 1e6, 'dur': (p_End - p_Start) * 1e6}
+        if p_Args:
+            event['args'] = p_Args
+        with self.lock:
+            if len(self.Events) >= self.MaxEvents:
+                self.Dropped += 1
+                return
+            self.Events.append(event)
+            if thread.ident not in self.Threads:
+                self.Threads[thread.ident] = thread.name
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Span(self, p_Name: str, p_Category: str = 'user', p_Args: {} = None):
+        """
+        Span.
+        Context manager adding a span around your own code (for example reading the source data).
+
+            with tracer.Span('read', 'source'):
+                rows = read()
+        """
+        return _Span(self, p_Name, p_Category, p_Args)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def OnPhase(self, p_Phase: str, p_Seconds: float, p_Bytes: int):
+        """
+        OnPhase.
+        PushMetrics hook: adds the span of the phase which just ended.
+        """
+        if p_Phase in self.s_DocumentPhases and not self.DocumentEvents:
+            return
+        end = time.perf_counter()
+        self.Complete(p_Phase, self.s_Categories.get(p_Phase, 'push'), end - p_Seconds, end,
+                      {'bytes': p_Bytes} if p_Bytes else None)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Attach(self, p_Push):
+        """
+        Attach.
+        Traces the phases of the push (enables its metrics when needed).
+        :arg p_Push: CoveoPush.Push
+        """
+        metrics = p_Push.Metrics or p_Push.EnableMetrics()
+        metrics.AddHook(self.OnPhase)
+        return self
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Detach(self, p_Push):
+        if p_Push.Metrics is not None and self.OnPhase in p_Push.Metrics.Hooks:
+            p_Push.Metrics.RemoveHook(self.OnPhase)
+        return self
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Start(self):
+        """
+        Start.
+        Traces the Document operations (compression), of all threads.
+        """
+        global ActiveTracer
+        ActiveTracer = self
+        return self
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Stop(self):
+        global ActiveTracer
+        if ActiveTracer is self:
+            ActiveTracer = None
+        return self
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def ToJson(self):
+        """
+        ToJson.
+        returns: dict, the trace in the Chrome trace-event format
+        """
+        with self.lock:
+            events = list(self.Events)
+            threads = dict(self.Threads)
+        metadata = [{'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'tid': 0, 'args': {'name': 'coveopush'}}]
+        for ident, name in threads.items():
+            metadata.append({'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': ident, 'args': {'name': name}})
+        trace = {'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}
+        if self.Dropped:
+            trace['otherData'] = {'droppedEvents': self.Dropped}
+        return trace
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def Write(self, p_File: str):
+        """
+        Write.
+        Writes the trace (JSON) to p_File, open it in chrome://tracing or https://ui.perfetto.dev
+        """
+        with open(p_File, mode='w', encoding='utf-8') as file:
+            json.dump(self.ToJson(), file, separators=(',', ':'))
+        self.logger.info('Trace written to ' + p_File + ' (' + str(len(self.Events)) + ' events, ' + str(self.Dropped) + ' dropped)')
+
+# ---------------------------------------------------------------------------------
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'category', 'args', 'start')
+
+    def __init__(self, p_Tracer: Tracer, p_Name: str, p_Category: str, p_Args: {}):
+        self.tracer = p_Tracer
+        self.name = p_Name
+        self.category = p_Category
+        self.args = p_Args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer.Complete(self.name, self.category, self.start, None, self.args)
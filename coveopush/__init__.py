@@ -2,3 +2,20 @@ from .CoveoConstants import *
 from .CoveoDocument import *
 from .CoveoPermissions import *
 from .CoveoPush import *
+from .CoveoJsonLines import *
+from .CoveoTemplates import *
+from .CoveoDocumentFrame import *
+from .CoveoExpansion import *
+from .CoveoMembershipDelta import *
+from .CoveoMetrics import *
+from .CoveoExporters import *
+from .CoveoTrace import Tracer
+from .CoveoMockServer import MockPushApi
+from .CoveoPlan import PushPlan
+from .CoveoJournal import PushJournal
+from .CoveoSpool import SpoolWriter, SpoolReplayer
+from .CoveoOutbox import Outbox, OutboxUploader
+from .CoveoPacking import BatchPacker
+from .CoveoShards import ShardCoordinator, ShardWorker
+from .CoveoPipeline import Pipeline, PipelineStage, PushSink, SerializeDocument
+from .CoveoFanOut import FanOutPush
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -------------------------------------------------------------------------------------
+# Benchmark of the batch push (Start/Add/End) against a local mock Push API
+# (coveopush.CoveoMockServer), in Push, Stream and UpdateStream modes,
+# with synthetic documents of several sizes
+# Reports docs/sec, MB/sec, peak RSS and requests per batch
+# No organization or settings are needed:
+#   python benchmark_push.py --documents 20000 --sizes 100,1000,10000 --latency 0.02
+# -------------------------------------------------------------------------------------
+
+import argparse
+import multiprocessing
+import random
+import resource
+import string
+import sys
+import time
+
+from coveopush import CoveoPush
+from coveopush import Document
+from coveopush import MockPushApi
+from coveopush.CoveoConstants import Constants
+
+MODES = {
+    'push': Constants.Mode.Push,
+    'stream': Constants.Mode.Stream,
+    'updatestream': Constants.Mode.UpdateStream,
+}
+
+
+def createDoc(nr, text):
+    doc = Document('https://benchmark/doc?id=' + str(nr))
+    doc.Title = 'Document ' + str(nr)
+    doc.SetData(text)
+    doc.FileExtension = '.txt'
+    doc.AddMetadata('connectortype', 'Benchmark')
+    doc.AddMetadata('nr', str(nr))
+    return doc
+
+
+def run(mode, size, args, results):
+    try:
+        results.put(measure(mode, size, args))
+    except Exception as e:
+        # For example a 503 which is not retried
+        results.put({'mode': mode, 'size': size, 'error': repr(e)})
+
+
+def measure(mode, size, args):
+    # One process per run: the peak RSS is the one of this run
+    rnd = random.Random(size)
+    texts = [''.join(rnd.choice(string.ascii_letters + ' ') for __ in range(size)) for __ in range(16)]
+    with MockPushApi(p_Latency=args.latency, p_Bandwidth=args.bandwidth * 1024 * 1024,
+                     p_Rate429=args.rate429, p_Rate5xx=args.rate5xx, p_Seed=1) as server:
+        push = CoveoPush.Push('benchmarksource', 'benchmarkorg', 'xx00000000-0000-0000-0000-000000000000',
+                              p_Endpoint=server.Endpoint, p_Mode=MODES[mode])
+        push.SetSizeMaxRequest(args.max_request_size * 1024 * 1024)
+        start = time.perf_counter()
+        push.Start(True, False)
+        for nr in range(args.documents):
+            push.Add(createDoc(nr, texts[nr % len(texts)]))
+        push.End(True, False)
+        seconds = time.perf_counter() - start
+        stats = server.Stats()
+
+    batches = max(stats['batches'], 1)
+    return {
+        'mode': mode,
+        'size': size,
+        'seconds': seconds,
+        'docsPerSecond': args.documents / seconds,
+        'mbPerSecond': stats['bytesReceived'] / seconds / (1024 * 1024),
+        # ru_maxrss is in KB on Linux, in bytes on macOS
+        'peakRssMb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024),
+        'batches': stats['batches'],
+        'requestsPerBatch': stats['totalRequests'] / batches,
+        'faults': sum(stats['faults'].values()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the batch push against a local mock Push API')
+    parser.add_argument('--documents', type=int, default=10000, help='documents per run')
+    parser.add_argument('--sizes', default='100,1000,10000', help='document body sizes (characters), comma separated')
+    parser.add_argument('--modes', default='push,stream,updatestream', help='modes, comma separated')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to each request')
+    parser.add_argument('--bandwidth', type=float, default=0, help='upload bandwidth in MB/sec (0: unlimited)')
+    parser.add_argument('--rate429', type=float, default=0.0, help='part of the requests answered with 429 (retried after 5s+)')
+    parser.add_argument('--rate5xx', type=float, default=0.0, help='part of the requests answered with 503')
+    parser.add_argument('--max-request-size', type=int, default=5, help='max batch size in MB')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    print('%-13s %8s %9s %10s %8s %10s %8s %12s %7s' %
+          ('mode', 'size', 'seconds', 'docs/sec', 'MB/sec', 'peak RSS', 'batches', 'req/batch', 'faults'))
+    for mode in args.modes.split(','):
+        for size in [int(size) for size in args.sizes.split(',')]:
+            results = context.Queue()
+            process = context.Process(target=run, args=(mode, size, args, results))
+            process.start()
+            result = results.get()
+            process.join()
+            if 'error' in result:
+                print('%-13s %8d failed: %s' % (result['mode'], result['size'], result['error']))
+                continue
+            print('%-13s %8d %9.2f %10.0f %8.1f %8.0fMB %8d %12.2f %7d' %
+                  (result['mode'], result['size'], result['seconds'], result['docsPerSecond'], result['mbPerSecond'],
+                   result['peakRssMb'], result['batches'], result['requestsPerBatch'], result['faults']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -------------------------------------------------------------------------------------
+# Measure the memory (bytes per document) and construction rate of
+# Document, DocumentToDelete and DocumentToUpdate
+# No push is done, no settings are needed
+# -------------------------------------------------------------------------------------
+
+import gc
+import time
+import tracemalloc
+
+from coveopush import Document
+from coveopush import DocumentToDelete
+from coveopush import DocumentToUpdate
+
+
+def measure(name, factory, count):
+    # Create the ids first, so they are not counted
+    ids = ['https://myreference&id=' + str(nr) for nr in range(count)]
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    items = [factory(docId) for docId in ids]
+    end = time.perf_counter()
+    size, __ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('%-18s %6d bytes/document %10d documents/sec' % (name, size / count, count / (end - start)))
+    return items
+
+
+def main():
+    count = 200000
+    measure('Document', lambda docId: Document(docId), count)
+    measure('DocumentToDelete', lambda docId: DocumentToDelete(docId), count)
+    measure('DocumentToUpdate', lambda docId: DocumentToUpdate(docId, 'add', 'myfield', 'myvalue'), count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -------------------------------------------------------------------------------------
+# Push of a JSONL file (one document in the Push API format per line) to several sources
+# (organizations, regions) in one run: each line is read and encoded once, the targets share
+# a connection pool, and a slow or throttled target does not hold the others
+#   python push_fanout.py documents.jsonl targets.json --workers 4
+# targets.json, a list of targets (apikey: def. the COVEO_API_KEY environment variable):
+#   [{"name": "prod", "source": "mysourceid", "org": "myorgid", "apikey": "..."},
+#    {"name": "hipaa", "source": "mysourceid", "org": "myhipaaorgid", "endpoint": "https://apihipaa.cloud.coveo.com/push/v1"}]
+# -------------------------------------------------------------------------------------
+
+import argparse
+import json
+import os
+
+from coveopush import CoveoPush
+from coveopush import FanOutPush
+from coveopush.CoveoConstants import Constants
+
+
+def createTargets(path):
+    with open(path, mode='r', encoding='utf-8') as file:
+        config = json.load(file)
+    targets = []
+    for number, target in enumerate(config):
+        apiKey = target.get('apikey', os.environ.get('COVEO_API_KEY'))
+        if not apiKey:
+            raise Exception('target ' + str(number) + ': an API key is needed (apikey or COVEO_API_KEY)')
+        push = CoveoPush.Push(target['source'], target['org'], apiKey,
+                              p_Endpoint=target.get('endpoint', Constants.PushApiEndpoint.PROD_PUSH_API_URL))
+        targets.append((target.get('name', target['org'] + '/' + target['source']), push))
+    return targets
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pushes a JSONL file to several sources in one run')
+    parser.add_argument('file', help='JSONL file, one document per line')
+    parser.add_argument('targets', help='JSON file with the targets')
+    parser.add_argument('--workers', type=int, default=0, help='threads serving the targets (def: one per target)')
+    parser.add_argument('--slice', type=int, default=256, help='documents given to a target before the next one')
+    parser.add_argument('--delete-older', action='store_true', help='delete the documents older than the run')
+    args = parser.parse_args()
+
+    fanOut = FanOutPush(createTargets(args.targets), p_Workers=args.workers, p_Slice=args.slice)
+    fanOut.Start(True, args.delete_older)
+    with open(args.file, mode='rb') as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                fanOut.AddEncoded(line)
+    try:
+        fanOut.End(True, args.delete_older)
+    finally:
+        print(fanOut.Report())
+
+
+if __name__ == '__main__':
+    main()
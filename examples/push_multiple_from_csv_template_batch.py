@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -------------------------------------------------------------------------------------
+# Push Multiple From CSV using a DocumentTemplate and BATCH calls
+# The template is compiled once, rows are encoded without creating Documents
+# -------------------------------------------------------------------------------------
+
+import os
+
+from coveopush import CoveoPush
+from coveopush import CoveoPermissions
+from coveopush import CoveoConstants
+from coveopush import CsvLoader
+from coveopush import DocumentTemplate
+from coveopush import PermissionTemplate
+
+
+def main():
+    sourceId = os.environ.get('PUSH_SOURCE_ID') or '--Enter your source id--'
+    orgId = os.environ.get('PUSH_ORG_ID') or '--Enter your org id--'
+    apiKey = os.environ.get('PUSH_API_KEY') or '--Enter your API key--'
+
+    updateSourceStatus = True
+    deleteOlder = True
+
+    # Columns are referenced with $column or ${column}
+    content = "<html><head><title>${FirstName} ${LastName}</title></head><body><table><tbody>" \
+        "<tr><td>FirstName</td><td>$FirstName</td></tr><tr><td>MiddleName</td><td>$MiddleName</td></tr>" \
+        "<tr><td>LastName</td><td>$LastName</td></tr><tr><td>PositionDescription</td><td>$PositionDescription</td></tr>" \
+        "</tbody></table></body></html>"
+
+    # Set permissions
+    user_email = "wim@coveo.com"
+    myperm = CoveoPermissions.PermissionIdentity(CoveoConstants.Constants.PermissionIdentityType.User, "", user_email)
+
+    template = DocumentTemplate(
+        'https://myreference&id=$UserName',
+        p_Title='$FirstName $LastName',
+        p_Content=content,
+        p_Metadata={'department': 'Department'},
+        # rssauthors should be set as a multi-value field in your Coveo Cloud organization
+        p_StaticMetadata={'connectortype': 'CSV', 'rssauthors': ['Coveo', 'R&D']},
+        p_Permissions=PermissionTemplate([myperm], [], True),
+        p_FileExtension='.html')
+
+    # Create the push client
+    push = CoveoPush.Push(sourceId, orgId, apiKey)
+
+    push.Start(updateSourceStatus, deleteOlder)
+
+    # Stream the rows into the batches
+    CsvLoader(push, template, p_Delimiter=';').Load(os.path.join('testfiles', 'People.csv'))
+
+    # End the Push
+    push.End(updateSourceStatus, deleteOlder)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -------------------------------------------------------------------------------------
+# Push Multiple From a NDJSON/JSONL file using BATCH calls
+# Every line must hold one document in the Push API format, for example:
+# {"documentId": "https://myreference&id=1", "title": "Doc 1", "data": "Content of doc 1"}
+# -------------------------------------------------------------------------------------
+
+import os
+
+from coveopush import CoveoPush
+from coveopush import JsonLinesLoader
+
+
+def main():
+    sourceId = os.environ.get('PUSH_SOURCE_ID') or '--Enter your source id--'
+    orgId = os.environ.get('PUSH_ORG_ID') or '--Enter your org id--'
+    apiKey = os.environ.get('PUSH_API_KEY') or '--Enter your API key--'
+
+    updateSourceStatus = True
+    deleteOlder = True
+
+    # Create the push client
+    push = CoveoPush.Push(sourceId, orgId, apiKey)
+
+    push.Start(updateSourceStatus, deleteOlder)
+
+    # Stream the lines into the batches, without parsing them
+    loader = JsonLinesLoader(push, p_ValidateDocumentId=True)
+    loader.Load(os.path.join('testfiles', 'documents.jsonl'))
+
+    # End the Push
+    push.End(updateSourceStatus, deleteOlder)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -------------------------------------------------------------------------------------
+# Push of the text files of a directory with a Pipeline:
+#   read (8 threads) -> build Document (thread) -> compress (process pool) -> serialize (process pool) -> Push
+#   python push_pipeline.py ./docs --source mysourceid --org myorgid --compress-workers 4
+# The API key is read from the COVEO_API_KEY environment variable (or --apikey)
+# -------------------------------------------------------------------------------------
+
+import argparse
+import os
+
+from coveopush import CoveoPush
+from coveopush import Document
+from coveopush import Pipeline
+from coveopush import SerializeDocument
+from coveopush.CoveoConstants import Constants
+
+
+def listFiles(directory):
+    for root, __, files in os.walk(directory):
+        for name in files:
+            yield os.path.join(root, name)
+
+
+def readFile(path):
+    with open(path, mode='r', encoding='utf-8', errors='replace') as file:
+        return path, file.read()
+
+
+def buildDocument(item):
+    path, content = item
+    doc = Document('file:///' + os.path.abspath(path).replace(os.sep, '/').lstrip('/'))
+    doc.Title = os.path.basename(path)
+    doc.FileExtension = os.path.splitext(path)[1]
+    doc.AddMetadata('connectortype', 'Pipeline')
+    doc.AddMetadata('size', str(len(content)))
+    # An empty file has no content to compress: stays a metadata only document
+    return doc, content
+
+
+def compressDocument(item):
+    # Runs in a process: zlib and base64
+    doc, content = item
+    if content:
+        doc.SetContentAndZLibCompress(content)
+    return doc
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pushes the text files of a directory with a pipeline')
+    parser.add_argument('directory', help='directory with the files')
+    parser.add_argument('--source', required=True, help='source id')
+    parser.add_argument('--org', required=True, help='organization id')
+    parser.add_argument('--apikey', default=os.environ.get('COVEO_API_KEY'), help='API key (def: COVEO_API_KEY)')
+    parser.add_argument('--endpoint', default=Constants.PushApiEndpoint.PROD_PUSH_API_URL, help='Push API endpoint')
+    parser.add_argument('--read-workers', type=int, default=8, help='threads reading the files')
+    parser.add_argument('--compress-workers', type=int, default=os.cpu_count() or 2, help='processes compressing')
+    parser.add_argument('--serialize-workers', type=int, default=2, help='processes serializing')
+    parser.add_argument('--skip-errors', action='store_true', help='skip the files which fail, instead of stopping')
+    args = parser.parse_args()
+
+    if not args.apikey:
+        parser.error('an API key is needed (--apikey or COVEO_API_KEY)')
+
+    push = CoveoPush.Push(args.source, args.org, args.apikey, p_Endpoint=args.endpoint)
+    pipeline = Pipeline(p_QueueSize=256, p_OnError='skip' if args.skip_errors else 'raise')
+    pipeline.AddStage('read', readFile, p_Workers=args.read_workers)
+    pipeline.AddStage('build', buildDocument)
+    pipeline.AddStage('compress', compressDocument, p_Workers=args.compress_workers, p_Kind='process')
+    pipeline.AddStage('serialize', SerializeDocument, p_Workers=args.serialize_workers, p_Kind='process')
+
+    push.Start(True, False)
+    pipeline.Run(listFiles(args.directory), push)
+    push.End(True, False)
+    print(pipeline.Report())
+
+
+if __name__ == '__main__':
+    main()
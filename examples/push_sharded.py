@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -------------------------------------------------------------------------------------
+# Full rebuild of a source from a JSONL file (one document in the Push API format per line),
+# split over several processes (the shards) with one coordinated session:
+# one Rebuild/Idle status, one StartOrderingId, one stream and one DeleteOlderThan
+#   python push_sharded.py documents.jsonl --source mysourceid --org myorgid --shards 8 --delete-older
+# The shards can also run on other nodes, with a shared --directory and --shard:
+#   python push_sharded.py documents.jsonl ... --directory /shared/rebuild --coordinator   (one node)
+#   python push_sharded.py documents.jsonl ... --directory /shared/rebuild --shard 3       (each shard)
+# The API key is read from the COVEO_API_KEY environment variable (or --apikey)
+# -------------------------------------------------------------------------------------
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from coveopush import CoveoPush
+from coveopush import ShardCoordinator
+from coveopush import ShardWorker
+from coveopush.CoveoConstants import Constants
+
+MODES = {
+    'push': Constants.Mode.Push,
+    'stream': Constants.Mode.Stream,
+    'updatestream': Constants.Mode.UpdateStream,
+}
+
+
+def createPush(args):
+    return CoveoPush.Push(args.source, args.org, args.apikey, p_Endpoint=args.endpoint, p_Mode=MODES[args.mode])
+
+
+def runShard(args, shard):
+    # Every shard reads the file, and pushes the lines of its shard
+    push = createPush(args)
+    push.SetShard(ShardWorker(args.directory, shard))
+    try:
+        push.Start()
+        with open(args.file, mode='rb') as file:
+            for nr, line in enumerate(file):
+                line = line.strip()
+                if line and nr % args.shards == shard:
+                    push.AddEncoded(line)
+        push.End()
+    except Exception as e:
+        push.Shard.Fail(e)
+        raise
+
+
+def waitForShards(coordinator, processes, timeout):
+    # A shard process which ends without a report (killed, crashed before Start) would be waited for forever
+    deadline = time.time() + timeout
+    while True:
+        reports = coordinator.Status()
+        if len(reports) == coordinator.Shards or any(report.get('status') != 'done' for report in reports.values()):
+            # All done, or a shard failed: End raises with its error
+            return
+        lost = [shard for shard, process in enumerate(processes) if process.exitcode is not None and shard not in reports]
+        if lost:
+            raise Exception('shard processes ended without reporting: ' + ', '.join(
+                '%d (exit code %s)' % (shard, processes[shard].exitcode) for shard in lost))
+        if time.time() > deadline:
+            raise Exception('timeout, %d of %d shards done' % (len(reports), coordinator.Shards))
+        time.sleep(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Full rebuild of a source from a JSONL file, split over several processes')
+    parser.add_argument('file', help='JSONL file, one document per line')
+    parser.add_argument('--source', required=True, help='source id')
+    parser.add_argument('--org', required=True, help='organization id')
+    parser.add_argument('--apikey', default=os.environ.get('COVEO_API_KEY'), help='API key (def: COVEO_API_KEY)')
+    parser.add_argument('--endpoint', default=Constants.PushApiEndpoint.PROD_PUSH_API_URL, help='Push API endpoint')
+    parser.add_argument('--mode', default='push', choices=sorted(MODES), help='mode of the push')
+    parser.add_argument('--shards', type=int, default=4, help='number of shards')
+    parser.add_argument('--directory', help='rendezvous directory (def: a temporary directory)')
+    parser.add_argument('--coordinator', action='store_true', help='only run the coordinator (shards on other nodes)')
+    parser.add_argument('--shard', type=int, help='only run this shard (coordinator on another node)')
+    parser.add_argument('--delete-older', action='store_true', help='delete the documents older than the rebuild (Push mode)')
+    parser.add_argument('--timeout', type=float, default=4 * 3600, help='seconds to wait for the shards')
+    args = parser.parse_args()
+
+    if not args.apikey:
+        parser.error('an API key is needed (--apikey or COVEO_API_KEY)')
+    if (args.coordinator or args.shard is not None) and not args.directory:
+        parser.error('--coordinator and --shard need a shared --directory')
+    if args.shard is not None:
+        runShard(args, args.shard)
+        return
+    if not args.directory:
+        args.directory = tempfile.mkdtemp(prefix='coveoshards')
+
+    coordinator = ShardCoordinator(createPush(args), args.directory, args.shards)
+    coordinator.Begin(True)
+    processes = []
+    if not args.coordinator:
+        context = multiprocessing.get_context('spawn')
+        processes = [context.Process(target=runShard, args=(args, shard)) for shard in range(args.shards)]
+        for process in processes:
+            process.start()
+    try:
+        waitForShards(coordinator, processes, args.timeout)
+        reports = coordinator.End(True, args.delete_older, p_Timeout=args.timeout)
+    finally:
+        for process in processes:
+            if process.exitcode is None:
+                # The shards still running when the wait stopped
+                process.terminate()
+            process.join()
+    for shard, report in sorted(reports.items()):
+        print('shard %d: %d documents, %d batches' % (shard, report['documents'], report['batches']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -------------------------------------------------------------------------------------
+# Replay of a spool directory (written by a Push with p_Save=True / SetSpool)
+# Uploads the batch files with parallel workers, in Push, Stream or UpdateStream mode:
+#   python replay_spool.py batch --source mysourceid --org myorgid --mode stream --workers 8
+# The API key is read from the COVEO_API_KEY environment variable (or --apikey)
+# -------------------------------------------------------------------------------------
+
+import argparse
+import os
+
+from coveopush import CoveoPush
+from coveopush import SpoolReplayer
+from coveopush.CoveoConstants import Constants
+
+MODES = {
+    'push': Constants.Mode.Push,
+    'stream': Constants.Mode.Stream,
+    'updatestream': Constants.Mode.UpdateStream,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Uploads a spool directory to a Push source')
+    parser.add_argument('directory', help='spool directory (with manifest.json)')
+    parser.add_argument('--source', required=True, help='source id')
+    parser.add_argument('--org', required=True, help='organization id')
+    parser.add_argument('--apikey', default=os.environ.get('COVEO_API_KEY'), help='API key (def: COVEO_API_KEY)')
+    parser.add_argument('--endpoint', default=Constants.PushApiEndpoint.PROD_PUSH_API_URL, help='Push API endpoint')
+    parser.add_argument('--mode', default='push', choices=sorted(MODES), help='mode of the upload')
+    parser.add_argument('--workers', type=int, default=4, help='parallel uploads')
+    parser.add_argument('--no-status', action='store_true', help='do not update the source status (Push mode)')
+    parser.add_argument('--delete-older', action='store_true', help='delete the documents older than the replay (Push mode)')
+    parser.add_argument('--force', action='store_true', help='also replay a spool which is not complete')
+    args = parser.parse_args()
+
+    if not args.apikey:
+        parser.error('an API key is needed (--apikey or COVEO_API_KEY)')
+
+    push = CoveoPush.Push(args.source, args.org, args.apikey, p_Endpoint=args.endpoint, p_Mode=MODES[args.mode])
+    replayer = SpoolReplayer(push, args.directory, p_Workers=args.workers, p_Force=args.force)
+    result = replayer.Replay(not args.no_status, args.delete_older)
+    print('%d files, %d documents, %d bytes in %.1fs' % (result['files'], result['documents'], result['bytes'], result['seconds']))
+
+
+if __name__ == '__main__':
+    main()
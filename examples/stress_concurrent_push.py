@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -------------------------------------------------------------------------------------
+# Stress test of a batch push (Start/Add/End) with many producer threads
+# calling Add, AddJson and AddEncoded at once, against a local mock Push API
+# Checks that each document is uploaded exactly once, and that the operations
+# of each thread are uploaded in the order they were added
+#   python stress_concurrent_push.py --threads 32 --documents 2000 --mode stream
+# -------------------------------------------------------------------------------------
+
+import argparse
+import json
+import threading
+import time
+
+from coveopush import CoveoPush
+from coveopush import Document
+from coveopush import DocumentToDelete
+from coveopush import MockPushApi
+from coveopush.CoveoConstants import Constants
+from coveopush.CoveoDocument import EncodeJson
+
+MODES = {
+    'push': Constants.Mode.Push,
+    'stream': Constants.Mode.Stream,
+    'updatestream': Constants.Mode.UpdateStream,
+}
+
+
+class CheckedPush(CoveoPush.Push):
+    """
+    Push which keeps the uploaded batches (decoded) to check them.
+    """
+    def UploadEncoded(self, p_UploadUri, p_Encoded, p_Added=0, p_Deleted=0, p_Updated=0):
+        self.uploaded.append(json.loads(p_Encoded))
+        super().UploadEncoded(p_UploadUri, p_Encoded, p_Added, p_Deleted, p_Updated)
+
+
+def documentId(thread, nr):
+    return 'https://stress/' + str(thread) + '/' + str(nr)
+
+
+def produce(push, thread, documents, errors):
+    try:
+        for nr in range(documents):
+            # Each thread cycles through the three ways to add, and deletes one document out of 10
+            if nr % 10 == 9:
+                push.Add(DocumentToDelete(documentId(thread, nr)))
+            elif nr % 3 == 0:
+                doc = Document(documentId(thread, nr))
+                doc.Title = 'Document ' + str(nr)
+                doc.SetData('text of document ' + str(nr) + ' ' * (nr % 200))
+                doc.AddMetadata('thread', str(thread))
+                push.Add(doc)
+            elif nr % 3 == 1:
+                push.AddJson({'DocumentId': documentId(thread, nr), 'title': 'Document ' + str(nr), 'data': 'json ' + str(nr)})
+            else:
+                push.AddEncoded(EncodeJson({'DocumentId': documentId(thread, nr), 'title': 'Encoded ' + str(nr)}))
+    except Exception as e:
+        errors.append(repr(e))
+
+
+def check(uploaded, threads, documents):
+    # Document ids in upload order
+    seen = {}
+    order = []
+    for batch in uploaded:
+        for operation in ('AddOrUpdate', 'Delete'):
+            for item in batch.get(operation, []):
+                id = item.get('DocumentId') or item.get('documentId')
+                seen[id] = seen.get(id, 0) + 1
+                order.append(id)
+
+    problems = []
+    expected = threads * documents
+    if len(seen) != expected:
+        problems.append('%d distinct documents uploaded, %d added' % (len(seen), expected))
+    duplicates = [id for id, count in seen.items() if count > 1]
+    if duplicates:
+        problems.append('%d documents uploaded more than once' % len(duplicates))
+
+    # Per thread, the adds and the deletes each keep the order of the thread
+    last = {}
+    for id in order:
+        thread, nr = id.split('/')[-2:]
+        key = (thread, int(nr) % 10 == 9)
+        if last.get(key, -1) > int(nr):
+            problems.append('thread %s: document %s uploaded after %d' % (thread, nr, last[key]))
+            break
+        last[key] = int(nr)
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stress test of a batch push with many producer threads')
+    parser.add_argument('--threads', type=int, default=16, help='producer threads')
+    parser.add_argument('--documents', type=int, default=2000, help='documents per thread')
+    parser.add_argument('--mode', default='push', choices=sorted(MODES), help='mode of the push')
+    parser.add_argument('--latency', type=float, default=0.005, help='seconds added to each request')
+    parser.add_argument('--max-request-size', type=int, default=64, help='max batch size in KB (small: many batches)')
+    args = parser.parse_args()
+
+    with MockPushApi(p_Latency=args.latency) as server:
+        push = CheckedPush('stresssource', 'stressorg', 'xx00000000-0000-0000-0000-000000000000',
+                           p_Endpoint=server.Endpoint, p_Mode=MODES[args.mode])
+        push.uploaded = []
+        push.SetSizeMaxRequest(args.max_request_size * 1024)
+        errors = []
+        producers = [threading.Thread(target=produce, args=(push, thread, args.documents, errors))
+                     for thread in range(args.threads)]
+
+        start = time.perf_counter()
+        push.Start(True, False)
+        for producer in producers:
+            producer.start()
+        for producer in producers:
+            producer.join()
+        push.End(True, False)
+        seconds = time.perf_counter() - start
+
+    problems = errors + check(push.uploaded, args.threads, args.documents)
+    print('%d threads, %d documents, %d batches in %.2fs (%.0f docs/sec)' %
+          (args.threads, args.threads * args.documents, len(push.uploaded), seconds, args.threads * args.documents / seconds))
+    for problem in problems:
+        print('FAILED: ' + problem)
+    if not problems:
+        print('OK')
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())